@@ -0,0 +1,5 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""Dumpyara benchmarks."""
@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+from benchmarks.main import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,697 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Synthetic firmware generators.
+
+Everything is generated offline from a seeded PRNG, so the same size and
+seed always give the same files.
+Generators return the SHA-256 of the raw images they hold, to check what
+the stages extract.
+Partition data is made of runs of random, half compressible, zero and
+fill pattern blocks, roughly like a real filesystem image.
+"""
+
+import brotli
+import bz2
+import lzma
+import tarfile
+import zlib
+import zstandard
+from ctypes import c_uint8, sizeof
+from hashlib import md5, sha256
+from liblp import (
+    LP_METADATA_GEOMETRY_MAGIC,
+    LP_METADATA_HEADER_MAGIC,
+    LP_METADATA_MAJOR_VERSION,
+    LP_PARTITION_ATTR_READONLY,
+    LP_SECTOR_SIZE,
+    LP_TARGET_TYPE_LINEAR,
+    LpMetadataBlockDevice,
+    LpMetadataExtent,
+    LpMetadataGeometry,
+    LpMetadataHeaderV1_0,
+    LpMetadataPartition,
+    LpMetadataPartitionGroup,
+    LpMetadataTableDescriptor,
+)
+from liblp.utility import (
+    GetBackupGeometryOffset,
+    GetBackupMetadataOffset,
+    GetPrimaryGeometryOffset,
+    GetPrimaryMetadataOffset,
+    GetTotalMetadataSize,
+)
+from pathlib import Path
+from random import Random
+from shutil import copyfileobj
+from struct import Struct
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+from uuid import UUID
+
+from dumpyara.lib.libkdz.dz import DZChunk, DZFile
+from dumpyara.lib.libkdz.kdz import KDZFile
+from dumpyara.lib.libpayload import update_metadata_pb2
+from dumpyara.lib.libsparse import (
+    CHUNK_HEADER,
+    CHUNK_TYPE_DONT_CARE,
+    CHUNK_TYPE_FILL,
+    CHUNK_TYPE_RAW,
+    SPARSE_HEADER,
+    SPARSE_HEADER_MAGIC,
+)
+
+# Generated protobuf classes aren't visible to type checkers
+DeltaArchiveManifest = update_metadata_pb2.DeltaArchiveManifest  # type: ignore
+InstallOperation = update_metadata_pb2.InstallOperation  # type: ignore
+
+BLOCK_SIZE = 4096
+
+# Run types
+(
+    RUN_DATA,
+    RUN_ZERO,
+    RUN_FILL,
+) = range(3)
+
+# Maximum size of a run, in blocks
+MAX_RUN_BLOCKS = 256
+
+# Blocks per payload operation, like delta_generator does for full OTAs
+PAYLOAD_OPERATION_BLOCKS = 512
+
+# Blocks per DZ chunk
+DZ_CHUNK_BLOCKS = 1024
+
+# Brotli quality used by AOSP for A-only OTAs
+BROTLI_QUALITY = 6
+
+# GPT
+GPT_HEADER = Struct("<8sIIIIQQQQ16sQIII")
+GPT_ENTRY = Struct("<16s16sQQQ72s")
+GPT_ENTRY_COUNT = 128
+GPT_ENTRIES_BLOCKS = GPT_ENTRY_COUNT * GPT_ENTRY.size // BLOCK_SIZE
+GPT_LINUX_DATA_TYPE = UUID("0fc63daf-8483-4772-8e79-3d69d8477de4")
+
+# KDZ
+KDZ_DATA_ALIGNMENT = 1024
+
+# Samsung tar.md5 archive name
+TAR_MD5_NAME = "AP_BENCHMARK.tar.md5"
+
+
+def get_partition_sizes(size: int):
+    """Split size in a few partitions, like a real firmware."""
+    blocks = size // BLOCK_SIZE
+
+    boot_blocks = max(blocks // 8, 1)
+    vendor_blocks = max(blocks // 4, 1)
+    system_blocks = max(blocks - boot_blocks - vendor_blocks, 1)
+
+    return {
+        "boot": boot_blocks * BLOCK_SIZE,
+        "system": system_blocks * BLOCK_SIZE,
+        "vendor": vendor_blocks * BLOCK_SIZE,
+    }
+
+
+def get_runs(rng: Random, blocks: int, max_run_blocks: int = MAX_RUN_BLOCKS):
+    """Split blocks in runs, returns a list of (run type, first block, blocks)."""
+    runs: List[Tuple[int, int, int]] = []
+
+    block = 0
+    while block < blocks:
+        run_blocks = min(rng.randint(1, max_run_blocks), blocks - block)
+        run_type = rng.choices((RUN_DATA, RUN_ZERO, RUN_FILL), weights=(70, 20, 10))[0]
+
+        runs.append((run_type, block, run_blocks))
+        block += run_blocks
+
+    return runs
+
+
+def get_data(rng: Random, blocks: int):
+    """Get blocks of data, a mix of random and half compressible blocks."""
+    data = bytearray()
+
+    for _ in range(blocks):
+        if rng.random() < 0.5:
+            data += rng.randbytes(BLOCK_SIZE)
+        else:
+            data += rng.randbytes(BLOCK_SIZE // 2)
+            data += rng.randbytes(64) * (BLOCK_SIZE // 2 // 64)
+
+    return bytes(data)
+
+
+def get_fill_pattern(rng: Random):
+    return rng.randbytes(4)
+
+
+def get_run_data(rng: Random, run_type: int, blocks: int):
+    """Get the content of a run."""
+    if run_type == RUN_DATA:
+        return get_data(rng, blocks)
+    elif run_type == RUN_FILL:
+        return get_fill_pattern(rng) * (blocks * BLOCK_SIZE // 4)
+
+    return bytes(blocks * BLOCK_SIZE)
+
+
+def iter_image(rng: Random, size: int, max_run_blocks: int = MAX_RUN_BLOCKS):
+    """Get the runs of an image with their content, zero runs have no content."""
+    for run_type, block, blocks in get_runs(rng, size // BLOCK_SIZE, max_run_blocks):
+        data = b"" if run_type == RUN_ZERO else get_run_data(rng, run_type, blocks)
+        yield run_type, block, blocks, data
+
+
+def generate_raw_image(path: Path, size: int, seed: int = 0):
+    """Generate a raw partition image, zero runs are holes."""
+    rng = Random(seed)
+    image_hash = sha256()
+
+    with path.open("wb") as f:
+        f.truncate(size)
+
+        for _, block, blocks, data in iter_image(rng, size):
+            image_hash.update(data or bytes(blocks * BLOCK_SIZE))
+
+            if data:
+                f.seek(block * BLOCK_SIZE)
+                f.write(data)
+
+    return image_hash.hexdigest()
+
+
+def generate_sparse_image(path: Path, size: int, seed: int = 0):
+    """Generate an Android sparse image with raw, fill and don't care chunks."""
+    rng = Random(seed)
+    blocks = size // BLOCK_SIZE
+    chunks = 0
+    image_hash = sha256()
+
+    with path.open("wb") as f:
+        # The header is written once the number of chunks is known
+        f.seek(SPARSE_HEADER.size)
+
+        for run_type, _, run_blocks, data in iter_image(rng, size):
+            image_hash.update(data or bytes(run_blocks * BLOCK_SIZE))
+
+            if run_type == RUN_DATA:
+                f.write(
+                    CHUNK_HEADER.pack(CHUNK_TYPE_RAW, 0, run_blocks, CHUNK_HEADER.size + len(data))
+                )
+                f.write(data)
+            elif run_type == RUN_FILL:
+                f.write(CHUNK_HEADER.pack(CHUNK_TYPE_FILL, 0, run_blocks, CHUNK_HEADER.size + 4))
+                f.write(data[:4])
+            else:
+                f.write(CHUNK_HEADER.pack(CHUNK_TYPE_DONT_CARE, 0, run_blocks, CHUNK_HEADER.size))
+
+            chunks += 1
+
+        f.seek(0)
+        f.write(
+            SPARSE_HEADER.pack(
+                SPARSE_HEADER_MAGIC,
+                1,
+                0,
+                SPARSE_HEADER.size,
+                CHUNK_HEADER.size,
+                BLOCK_SIZE,
+                blocks,
+                chunks,
+                0,
+            )
+        )
+
+    return image_hash.hexdigest()
+
+
+def generate_sdat(output_dir: Path, partition: str, size: int, seed: int = 0, use_brotli=False):
+    """
+    Generate the transfer list and new data of a partition of an A-only OTA.
+
+    If use_brotli is True, the new data is Brotli compressed like AOSP does.
+    """
+    rng = Random(seed)
+    blocks = size // BLOCK_SIZE
+
+    commands: List[str] = []
+    new_blocks = 0
+    image_hash = sha256()
+
+    new_data_path = output_dir / f"{partition}.new.dat{'.br' if use_brotli else ''}"
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY) if use_brotli else None
+
+    with new_data_path.open("wb") as f:
+        for run_type, block, run_blocks, data in iter_image(rng, size):
+            image_hash.update(data or bytes(run_blocks * BLOCK_SIZE))
+
+            rangeset = f"2,{block},{block + run_blocks}"
+
+            if run_type == RUN_ZERO:
+                commands.append(f"zero {rangeset}")
+                continue
+
+            commands.append(f"new {rangeset}")
+            new_blocks += run_blocks
+
+            f.write(compressor.process(data) if compressor is not None else data)
+
+        if compressor is not None:
+            f.write(compressor.finish())
+
+    (output_dir / f"{partition}.transfer.list").write_text(
+        "\n".join(["4", str(new_blocks), "0", "0", f"erase 2,0,{blocks}", *commands]) + "\n"
+    )
+
+    return image_hash.hexdigest()
+
+
+def _get_payload_operation(rng: Random, run_type: int, data: bytes):
+    """Get the type and the blob of an operation."""
+    if run_type == RUN_ZERO:
+        return InstallOperation.ZERO, b""
+
+    operation_type = rng.choices(
+        (
+            InstallOperation.REPLACE_XZ,
+            InstallOperation.REPLACE_BZ,
+            InstallOperation.REPLACE,
+        ),
+        weights=(3, 1, 1),
+    )[0]
+
+    if operation_type == InstallOperation.REPLACE_XZ:
+        return operation_type, lzma.compress(data, check=lzma.CHECK_CRC32)
+    elif operation_type == InstallOperation.REPLACE_BZ:
+        return operation_type, bz2.compress(data)
+
+    return operation_type, data
+
+
+def generate_payload(path: Path, partitions: Dict[str, int], seed: int = 0):
+    """Generate a full OTA payload.bin with REPLACE, REPLACE_XZ, REPLACE_BZ and ZERO operations."""
+    rng = Random(seed)
+
+    manifest = DeltaArchiveManifest()
+    manifest.block_size = BLOCK_SIZE
+    manifest.minor_version = 0
+
+    blobs_path = path.with_name(f"{path.name}.blobs")
+    data_offset = 0
+    hashes: Dict[str, str] = {}
+
+    with blobs_path.open("w+b") as blobs:
+        for name, size in partitions.items():
+            partition = manifest.partitions.add()
+            partition.partition_name = name
+
+            partition_hash = sha256()
+
+            for run_type, block, blocks, data in iter_image(rng, size, PAYLOAD_OPERATION_BLOCKS):
+                operation_type, blob = _get_payload_operation(rng, run_type, data)
+
+                operation = partition.operations.add()
+                operation.type = operation_type
+
+                extent = operation.dst_extents.add()
+                extent.start_block = block
+                extent.num_blocks = blocks
+
+                if blob:
+                    operation.data_offset = data_offset
+                    operation.data_length = len(blob)
+                    operation.data_sha256_hash = sha256(blob).digest()
+
+                    blobs.write(blob)
+                    data_offset += len(blob)
+
+                partition_hash.update(data or bytes(blocks * BLOCK_SIZE))
+
+            partition.new_partition_info.size = size
+            partition.new_partition_info.hash = partition_hash.digest()
+            hashes[name] = partition_hash.hexdigest()
+
+        manifest_data = manifest.SerializeToString()
+
+        with path.open("wb") as f:
+            f.write(b"CrAU")
+            f.write(Struct(">QQI").pack(2, len(manifest_data), 0))
+            f.write(manifest_data)
+
+            blobs.seek(0)
+            copyfileobj(blobs, f)
+
+    blobs_path.unlink()
+
+    return hashes
+
+
+def _get_lp_table(tables: bytearray, entries: list, entry_size: int):
+    descriptor = LpMetadataTableDescriptor()
+    descriptor.offset = len(tables)
+    descriptor.num_entries = len(entries)
+    descriptor.entry_size = entry_size
+
+    for entry in entries:
+        tables += bytes(entry)
+
+    return descriptor
+
+
+def generate_super_image(path: Path, partitions: Dict[str, int], seed: int = 0):
+    """
+    Generate a super image of an A/B device.
+
+    The partitions of slot A have one linear extent each,
+    the ones of slot B are empty.
+    """
+    rng = Random(seed)
+
+    metadata_max_size = 65536
+    metadata_slot_count = 2
+
+    # Partitions start at the first 1 MiB boundary after the metadata
+    alignment = 1024 * 1024
+    first_sector = (
+        (GetTotalMetadataSize(metadata_max_size, metadata_slot_count) + alignment - 1)
+        // alignment
+        * alignment
+        // LP_SECTOR_SIZE
+    )
+
+    lp_partitions: List[LpMetadataPartition] = []
+    lp_extents: List[LpMetadataExtent] = []
+    partition_sectors: Dict[str, int] = {}
+
+    sector = first_sector
+    for slot_suffix in ("_a", "_b"):
+        for name, size in partitions.items():
+            lp_partition = LpMetadataPartition()
+            lp_partition.name = f"{name}{slot_suffix}".encode()
+            lp_partition.attributes = LP_PARTITION_ATTR_READONLY
+            lp_partition.first_extent_index = len(lp_extents)
+            lp_partition.num_extents = 0
+            lp_partition.group_index = 0
+
+            if slot_suffix == "_a":
+                extent = LpMetadataExtent()
+                extent.num_sectors = size // LP_SECTOR_SIZE
+                extent.target_type = LP_TARGET_TYPE_LINEAR
+                extent.target_data = sector
+                extent.target_source = 0
+
+                lp_extents.append(extent)
+                lp_partition.num_extents = 1
+                partition_sectors[name] = sector
+                sector += extent.num_sectors
+
+            lp_partitions.append(lp_partition)
+
+    group = LpMetadataPartitionGroup()
+    group.name = b"default"
+
+    block_device = LpMetadataBlockDevice()
+    block_device.first_logical_sector = first_sector
+    block_device.size = sector * LP_SECTOR_SIZE
+    block_device.partition_name = b"super"
+
+    tables = bytearray()
+    header = LpMetadataHeaderV1_0()
+    header.magic = LP_METADATA_HEADER_MAGIC
+    header.major_version = LP_METADATA_MAJOR_VERSION
+    header.minor_version = 0
+    header.header_size = sizeof(LpMetadataHeaderV1_0)
+    header.partitions = _get_lp_table(tables, lp_partitions, sizeof(LpMetadataPartition))
+    header.extents = _get_lp_table(tables, lp_extents, sizeof(LpMetadataExtent))
+    header.groups = _get_lp_table(tables, [group], sizeof(LpMetadataPartitionGroup))
+    header.block_devices = _get_lp_table(tables, [block_device], sizeof(LpMetadataBlockDevice))
+    header.tables_size = len(tables)
+    header.tables_checksum = (c_uint8 * 32)(*sha256(tables).digest())
+    header.header_checksum = (c_uint8 * 32)(*sha256(bytes(header)).digest())
+
+    geometry = LpMetadataGeometry()
+    geometry.magic = LP_METADATA_GEOMETRY_MAGIC
+    geometry.struct_size = sizeof(LpMetadataGeometry)
+    geometry.metadata_max_size = metadata_max_size
+    geometry.metadata_slot_count = metadata_slot_count
+    geometry.logical_block_size = BLOCK_SIZE
+    geometry.checksum = (c_uint8 * 32)(*sha256(bytes(geometry)).digest())
+
+    with path.open("wb") as f:
+        f.truncate(block_device.size)
+
+        for offset in (GetPrimaryGeometryOffset(), GetBackupGeometryOffset()):
+            f.seek(offset)
+            f.write(bytes(geometry))
+
+        for slot in range(metadata_slot_count):
+            for offset in (
+                GetPrimaryMetadataOffset(geometry, slot),
+                GetBackupMetadataOffset(geometry, slot),
+            ):
+                f.seek(offset)
+                f.write(bytes(header) + tables)
+
+        hashes: Dict[str, str] = {}
+        for name, size in partitions.items():
+            partition_offset = partition_sectors[name] * LP_SECTOR_SIZE
+            image_hash = sha256()
+            for _, block, blocks, data in iter_image(rng, size):
+                image_hash.update(data or bytes(blocks * BLOCK_SIZE))
+
+                if data:
+                    f.seek(partition_offset + block * BLOCK_SIZE)
+                    f.write(data)
+
+            hashes[name] = image_hash.hexdigest()
+
+    return hashes
+
+
+def _get_gpt(partitions: Dict[str, int], rng: Random, first_lba: int, last_lba: int):
+    """Get the primary and backup GPT (entries and header) blocks."""
+    entries = bytearray()
+    lba = first_lba
+    for name, size in partitions.items():
+        blocks = size // BLOCK_SIZE
+        entries += GPT_ENTRY.pack(
+            GPT_LINUX_DATA_TYPE.bytes_le,
+            UUID(int=rng.getrandbits(128)).bytes_le,
+            lba,
+            lba + blocks - 1,
+            0,
+            name.encode("utf-16-le"),
+        )
+        lba += blocks
+
+    entries = bytes(entries.ljust(GPT_ENTRIES_BLOCKS * BLOCK_SIZE, b"\x00"))
+    disk_uuid = UUID(int=rng.getrandbits(128)).bytes_le
+    backup_lba = last_lba + GPT_ENTRIES_BLOCKS + 1
+
+    def get_header(my_lba: int, alternate_lba: int, entries_lba: int):
+        values = [
+            b"EFI PART",
+            0x00010000,
+            GPT_HEADER.size,
+            0,
+            0,
+            my_lba,
+            alternate_lba,
+            first_lba,
+            last_lba,
+            disk_uuid,
+            entries_lba,
+            GPT_ENTRY_COUNT,
+            GPT_ENTRY.size,
+            zlib.crc32(entries),
+        ]
+        values[3] = zlib.crc32(GPT_HEADER.pack(*values))
+
+        return GPT_HEADER.pack(*values).ljust(BLOCK_SIZE, b"\x00")
+
+    # Protective MBR, header, entries
+    primary = bytes(BLOCK_SIZE) + get_header(1, backup_lba, 2) + entries
+    # Entries, header
+    backup = entries + get_header(backup_lba, 1, last_lba + 1)
+
+    return primary, backup
+
+
+def generate_dz(path: Path, partitions: Dict[str, int], seed: int = 0, compression="zstd"):
+    """
+    Generate a LG DZ file, compression is either "zstd" (newer devices) or "zlib".
+
+    The first chunk holds the primary GPT, the last one the backup GPT.
+    Zero runs aren't stored, they're wiped by the trim count of the previous chunk.
+    """
+    rng = Random(seed)
+
+    if compression == "zstd":
+        compress = zstandard.ZstdCompressor().compress
+    elif compression == "zlib":
+        # The extractor looks for the level 1 zlib header
+        def compress(data: bytes):
+            return zlib.compress(data, 1)
+
+    else:
+        raise ValueError(f"Unknown compression: {compression}")
+
+    first_lba = 2 + GPT_ENTRIES_BLOCKS
+    last_lba = first_lba + sum(size // BLOCK_SIZE for size in partitions.values()) - 1
+
+    primary_gpt, backup_gpt = _get_gpt(partitions, rng, first_lba, last_lba)
+
+    hashes: Dict[str, str] = {}
+
+    # (slice name, first block, blocks to wipe, data)
+    def iter_chunks() -> Iterator[Tuple[str, int, int, bytes]]:
+        yield "PrimaryGPT", 0, first_lba, primary_gpt
+
+        lba = first_lba
+        for name, size in partitions.items():
+            blocks = size // BLOCK_SIZE
+            image_hash = sha256()
+            runs: List[Tuple[int, bytes]] = []
+            for run_type, block, run_blocks, data in iter_image(rng, size, DZ_CHUNK_BLOCKS):
+                image_hash.update(data or bytes(run_blocks * BLOCK_SIZE))
+                if run_type != RUN_ZERO:
+                    runs.append((block, data))
+
+            hashes[name] = image_hash.hexdigest()
+
+            for index, (block, data) in enumerate(runs):
+                next_block = runs[index + 1][0] if index + 1 < len(runs) else blocks
+                yield name, lba + block, next_block - block, data
+
+            lba += blocks
+
+        yield "BackupGPT", last_lba + 1, GPT_ENTRIES_BLOCKS + 1, backup_gpt
+
+    chunk_header = DZChunk()
+    headers_md5 = md5()
+    chunks = 0
+
+    with path.open("wb") as f:
+        # The header is written once the chunks are known
+        f.seek(DZFile._dz_length)
+
+        for slice_name, target_addr, trim_count, data in iter_chunks():
+            compressed_data = compress(data)
+            header = chunk_header.packdict(
+                {
+                    "sliceName": slice_name.encode(),
+                    "chunkName": f"{slice_name}_{target_addr}.bin".encode(),
+                    "targetSize": len(data),
+                    "dataSize": len(compressed_data),
+                    "md5": md5(data).digest(),
+                    "targetAddr": target_addr,
+                    "trimCount": trim_count,
+                    "dev": 0,
+                    "crc32": zlib.crc32(data),
+                }
+            )
+
+            f.write(header)
+            f.write(compressed_data)
+
+            headers_md5.update(header)
+            chunks += 1
+
+        f.seek(0)
+        f.write(
+            DZFile().packdict(
+                {
+                    "formatMajor": 2,
+                    "formatMinor": 1,
+                    "device": b"BENCHMARK",
+                    "version": b"BENCHMARK10a",
+                    "chunkCount": chunks,
+                    "md5": headers_md5.digest(),
+                    "unknown0": 256,
+                    "buildType": b"user",
+                    "androidVer": b"14",
+                    "reserved5": 0,
+                    "unknown4": 0,
+                    "unknown5": 0,
+                }
+            )
+        )
+
+    return hashes
+
+
+def _align(offset: int, alignment: int):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _write_kdz(f: BinaryIO, files: List[Tuple[str, Path]]):
+    """Write a v2 KDZ file, every file starts at an aligned offset."""
+    header = KDZFile()
+
+    offset = len(header._dz_header) + len(files) * header._dz_length + 1
+    offsets: List[int] = []
+    for _, file in files:
+        offset = _align(offset, KDZ_DATA_ALIGNMENT)
+        offsets.append(offset)
+        offset += file.stat().st_size
+
+    f.write(header._dz_header)
+    for (name, file), offset in zip(files, offsets):
+        f.write(
+            header.packdict(
+                {"name": name.encode(), "length": file.stat().st_size, "offset": offset}
+            )
+        )
+
+    # End of headers
+    f.write(b"\x00")
+
+    for (_, file), offset in zip(files, offsets):
+        f.seek(offset)
+        with file.open("rb") as data:
+            copyfileobj(data, f)
+
+
+def generate_kdz(path: Path, partitions: Dict[str, int], seed: int = 0, compression="zstd"):
+    """Generate a LG KDZ file, holding a DZ file and a flash tool DLL."""
+    rng = Random(seed)
+
+    dz_path = path.with_name(f"{path.stem}.dz")
+    dll_path = path.with_name("LGUP_c.dll")
+
+    hashes = generate_dz(dz_path, partitions, seed, compression)
+    dll_path.write_bytes(rng.randbytes(64 * 1024))
+
+    with path.open("wb") as f:
+        _write_kdz(f, [(dz_path.name, dz_path), (dll_path.name, dll_path)])
+
+    dz_path.unlink()
+    dll_path.unlink()
+
+    return hashes
+
+
+def generate_tar_md5(path: Path, partitions: Dict[str, int], seed: int = 0):
+    """Generate a Samsung tar.md5 archive of raw images."""
+    hashes: Dict[str, str] = {}
+    with tarfile.open(path, "w", format=tarfile.GNU_FORMAT) as tar:
+        for index, (name, size) in enumerate(partitions.items()):
+            image_path = path.with_name(f"{name}.img")
+            hashes[name] = generate_raw_image(image_path, size, seed + index)
+            tar.add(image_path, arcname=image_path.name)
+            image_path.unlink()
+
+    # The MD5 of the tar is appended to it, like odin expects
+    tar_md5 = md5()
+    with path.open("rb") as f:
+        while data := f.read(1024 * 1024):
+            tar_md5.update(data)
+
+    with path.open("ab") as f:
+        f.write(f"{tar_md5.hexdigest()}  {path.name[: -len('.md5')]}\n".encode())
+
+    return hashes
@@ -0,0 +1,220 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import json
+import os
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, Optional
+
+from benchmarks.stages import BENCHMARKS
+from dumpyara.utils.cache import hash_file
+from dumpyara.utils.files import rmtree_recursive
+from dumpyara.utils.stats import STATS_STEPS, DumpStats
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+BASELINE_VERSION = 1
+
+# Expected SHA-256 of the images written by the stage, created once the
+# input of a benchmark has been generated
+EXPECTED_HASHES_NAME = ".expected_hashes.json"
+
+
+def _generate(name: str, input_path: Path, size: int):
+    if (input_path / EXPECTED_HASHES_NAME).is_file():
+        return
+
+    if input_path.exists():
+        rmtree_recursive(input_path)
+    input_path.mkdir(parents=True)
+
+    generate, _ = BENCHMARKS[name]
+    expected_hashes = generate(input_path, size)
+
+    (input_path / EXPECTED_HASHES_NAME).write_text(json.dumps(expected_hashes, indent=2) + "\n")
+
+
+def _check(name: str, input_path: Path, output_path: Path):
+    """Check the images written by a benchmark, raises RuntimeError if any is wrong."""
+    expected_hashes: Dict[str, str] = json.loads((input_path / EXPECTED_HASHES_NAME).read_text())
+
+    for image_name, image_hash in expected_hashes.items():
+        image_path = output_path / image_name
+        if not image_path.is_file():
+            raise RuntimeError(f"{name}: {image_name} wasn't written")
+
+        if hash_file(image_path) != image_hash:
+            raise RuntimeError(f"{name}: {image_name} doesn't match the generated data")
+
+
+def _run(name: str, input_path: Path, output_path: Path, jobs: int):
+    """Run a benchmark, this is always called in a new process."""
+    if output_path.exists():
+        rmtree_recursive(output_path)
+    output_path.mkdir(parents=True)
+
+    _, run = BENCHMARKS[name]
+    stats = DumpStats()
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        with stats.measure(STATS_STEPS, name):
+            run(input_path, output_path, jobs)
+
+    # The process only runs this benchmark, its peak RSS is the one of the run,
+    # taken before the check reads the output
+    result = {**stats.entries[STATS_STEPS][0], "max_rss": stats.to_dict()["total"]["max_rss"]}
+
+    _check(name, input_path, output_path)
+
+    rmtree_recursive(output_path)
+
+    return result
+
+
+def _load_baseline(path: Path, size: int, jobs: int) -> Optional[Dict[str, Any]]:
+    if not path.is_file():
+        return None
+
+    baseline = json.loads(path.read_text())
+    if baseline.get("version") != BASELINE_VERSION:
+        print(f"Ignoring {path}, unknown version")
+        return None
+
+    if baseline["size"] != size or baseline["jobs"] != jobs:
+        print(
+            f"Ignoring {path}, it was made with size {baseline['size'] // 1024**2} MiB "
+            f"and {baseline['jobs']} jobs"
+        )
+        return None
+
+    return baseline
+
+
+def _format_comparison(result: Dict[str, Any], baseline_result: Dict[str, Any]):
+    throughput_change = (result["throughput"] / baseline_result["throughput"] - 1) * 100
+    max_rss_change = (result["max_rss"] - baseline_result["max_rss"]) / 1024**2
+
+    return f"{throughput_change:+.1f}% / {max_rss_change:+.0f} MiB"
+
+
+def main():
+    parser = ArgumentParser(description="Dumpyara benchmarks")
+
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"benchmarks to run, between {', '.join(BENCHMARKS)} (default: all)",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--size",
+        type=int,
+        default=64,
+        help="size of the partition data of each benchmark in MiB (default: 64)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of parallel jobs, the baseline is made with 1 (default: 1)",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="runs of each benchmark, the fastest one is kept (default: 3)",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--work-dir",
+        type=Path,
+        default=None,
+        help="folder where inputs are generated and kept for the next runs "
+        "(default: a temporary folder)",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=BASELINE_PATH,
+        help="baseline to compare the results with",
+    )
+
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="save the results as the new baseline"
+    )
+
+    args = parser.parse_args()
+
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+
+    size = args.size * 1024**2
+
+    baseline = _load_baseline(args.baseline, size, args.jobs)
+
+    with TemporaryDirectory() as temp_dir:
+        work_path = args.work_dir or Path(temp_dir)
+
+        results: Dict[str, Dict[str, Any]] = {}
+
+        # Every task runs in a new process, so that peak RSS is measured per run
+        with get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+            print(f"{'Benchmark':<12} {'Time':>9} {'Throughput':>13} {'Peak RSS':>9}  vs baseline")
+
+            for name in names:
+                input_path = work_path / f"{name}-{args.size}M"
+                output_path = work_path / f"{name}-{args.size}M-output"
+
+                pool.apply(_generate, (name, input_path, size))
+
+                entries = [
+                    pool.apply(_run, (name, input_path, output_path, args.jobs))
+                    for _ in range(args.repeat)
+                ]
+
+                wall_time = max(min(entry["wall_time"] for entry in entries), 0.001)
+                result = {
+                    "wall_time": wall_time,
+                    "cpu_time": min(entry["cpu_time"] for entry in entries),
+                    "throughput": round(size / wall_time),
+                    "max_rss": max(entry["max_rss"] for entry in entries),
+                }
+                results[name] = result
+
+                comparison = "-"
+                if baseline is not None and name in baseline["benchmarks"]:
+                    comparison = _format_comparison(result, baseline["benchmarks"][name])
+
+                print(
+                    f"{name:<12} {wall_time:>7.3f} s {result['throughput'] / 1024**2:>7.1f} MiB/s "
+                    f"{result['max_rss'] / 1024**2:>5.0f} MiB  {comparison}"
+                )
+
+    if args.save_baseline:
+        if baseline is None:
+            baseline = {
+                "version": BASELINE_VERSION,
+                "size": size,
+                "jobs": args.jobs,
+                "benchmarks": {},
+            }
+
+        baseline["benchmarks"].update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2) + "\n")
+
+        print(f"Baseline saved to {args.baseline}")
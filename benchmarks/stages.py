@@ -0,0 +1,124 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""
+Benchmarked pipeline stages.
+
+Each benchmark has a function generating its input in a folder from the
+size of the partition data, returning the expected SHA-256 of each image
+the stage writes (by file name), and a function running the stage on it
+(input folder, output folder, jobs).
+"""
+
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+from benchmarks.generators import (
+    TAR_MD5_NAME,
+    generate_dz,
+    generate_kdz,
+    generate_payload,
+    generate_sdat,
+    generate_sparse_image,
+    generate_super_image,
+    generate_tar_md5,
+    get_partition_sizes,
+)
+from dumpyara.lib.libkdz import unpack_dz, unpack_kdz
+from dumpyara.lib.libpayload import extract_android_ota_payload
+from dumpyara.lib.libsparse import unsparse_images
+from dumpyara.lib.libsuper import extract_super_image
+from dumpyara.steps.extract_archive import extract_archive
+from dumpyara.utils.archive_index import ArchiveIndex
+from dumpyara.utils.raw_image import get_raw_image
+from dumpyara.utils.shutil import setup_shutil_formats
+
+
+def _get_images(hashes: Dict[str, str], suffix: str = ""):
+    """Get the hashes of the images of the partitions by file name."""
+    return {f"{name}{suffix}.img": image_hash for name, image_hash in hashes.items()}
+
+
+def _run_sparse(input_path: Path, output_path: Path, jobs: int):
+    unsparse_images([input_path / "system.img"], output_path / "system.img")
+
+
+def _run_sdat(input_path: Path, output_path: Path, jobs: int):
+    get_raw_image(ArchiveIndex(input_path).images["system"], output_path / "system.img")
+
+
+def _run_payload(input_path: Path, output_path: Path, jobs: int):
+    extract_android_ota_payload(input_path / "payload.bin", output_path, jobs)
+
+
+def _run_super(input_path: Path, output_path: Path, jobs: int):
+    extract_super_image(input_path / "super.img", output_path, jobs)
+
+
+def _run_dz(input_path: Path, output_path: Path, jobs: int):
+    unpack_dz(str(input_path / "firmware.dz"), str(output_path), jobs=jobs)
+
+
+def _run_kdz(input_path: Path, output_path: Path, jobs: int):
+    unpack_kdz(str(input_path / "firmware.kdz"), str(output_path), jobs=jobs)
+
+
+def _run_tar_md5(input_path: Path, output_path: Path, jobs: int):
+    setup_shutil_formats()
+    extract_archive(input_path / TAR_MD5_NAME, output_path)
+
+
+# name: (generate, run)
+BENCHMARKS: Dict[
+    str, Tuple[Callable[[Path, int], Dict[str, str]], Callable[[Path, Path, int], None]]
+] = {
+    "sparse": (
+        lambda path, size: {"system.img": generate_sparse_image(path / "system.img", size)},
+        _run_sparse,
+    ),
+    "sdat": (
+        lambda path, size: {"system.img": generate_sdat(path, "system", size)},
+        _run_sdat,
+    ),
+    "sdat_brotli": (
+        lambda path, size: {"system.img": generate_sdat(path, "system", size, use_brotli=True)},
+        _run_sdat,
+    ),
+    "payload": (
+        lambda path, size: _get_images(
+            generate_payload(path / "payload.bin", get_partition_sizes(size))
+        ),
+        _run_payload,
+    ),
+    "super": (
+        lambda path, size: _get_images(
+            generate_super_image(path / "super.img", get_partition_sizes(size)), "_a"
+        ),
+        _run_super,
+    ),
+    "dz": (
+        lambda path, size: _get_images(
+            generate_dz(path / "firmware.dz", get_partition_sizes(size))
+        ),
+        _run_dz,
+    ),
+    "dz_zlib": (
+        lambda path, size: _get_images(
+            generate_dz(path / "firmware.dz", get_partition_sizes(size), compression="zlib")
+        ),
+        _run_dz,
+    ),
+    "kdz": (
+        lambda path, size: _get_images(
+            generate_kdz(path / "firmware.kdz", get_partition_sizes(size))
+        ),
+        _run_kdz,
+    ),
+    "tar_md5": (
+        lambda path, size: _get_images(
+            generate_tar_md5(path / TAR_MD5_NAME, get_partition_sizes(size))
+        ),
+        _run_tar_md5,
+    ),
+}
@@ -0,0 +1,267 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from pathlib import Path
+from sebaubuntu_libs.libexception import format_exception
+from sebaubuntu_libs.liblogging import LOGE, LOGI
+from threading import Condition, Semaphore
+from time import monotonic
+from typing import Any, Dict, List, Optional
+from zipfile import ZipFile, is_zipfile
+
+from dumpyara.dumpyara import dumpyara
+from dumpyara.utils.cache import DumpCache
+from dumpyara.utils.partitions import ALL_PARTITIONS, PartitionFilter
+from dumpyara.utils.stats import DumpStats
+from dumpyara.utils.workers import set_shared_executor
+
+BATCH_REPORT_FILE_NAME = "batch_report.json"
+
+# Files listing firmwares, one path per line
+LIST_FILE_SUFFIXES = [".list", ".txt"]
+
+# Assumed compression ratio of archives we can't look into
+ARCHIVE_COMPRESSION_RATIO = 2
+
+
+def get_batch_files(inputs: List[Path]):
+    """
+    Get the firmwares to dump.
+
+    An input can be a folder (all the files in it), a list of firmwares
+    (one path per line, relative to the list, # for comments) or a firmware.
+    """
+    files: List[Path] = []
+
+    for path in inputs:
+        if path.is_dir():
+            files.extend(
+                sorted(
+                    file
+                    for file in path.iterdir()
+                    if file.is_file() and not file.name.startswith(".")
+                )
+            )
+        elif path.suffix in LIST_FILE_SUFFIXES:
+            for line in path.read_text().splitlines():
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+
+                files.append(path.parent / line)
+        else:
+            files.append(path)
+
+    return [file.absolute() for file in files]
+
+
+def get_scratch_size(file: Path):
+    """Estimate the disk space needed by the temporary files of a dump."""
+    if is_zipfile(file):
+        with ZipFile(file) as zip_file:
+            extracted_size = sum(info.file_size for info in zip_file.infolist())
+    else:
+        extracted_size = file.stat().st_size * ARCHIVE_COMPRESSION_RATIO
+
+    # The extracted archive and the raw images, which are about as big
+    return extracted_size * 2
+
+
+class ScratchSpace:
+    """
+    Disk space shared by the temporary files of the dumps.
+
+    Reservations wait until there's enough free space, one bigger than
+    the whole space is only made when nothing else is reserved.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size
+        self.reserved = 0
+
+        self._condition = Condition()
+
+    def reserve(self, size: int):
+        with self._condition:
+            if self.max_size is not None:
+                max_size = self.max_size
+                self._condition.wait_for(
+                    lambda: self.reserved == 0 or self.reserved + size <= max_size
+                )
+
+            self.reserved += size
+
+    def release(self, size: int):
+        with self._condition:
+            self.reserved -= size
+            self._condition.notify_all()
+
+
+class BatchJob:
+    """A firmware dumped in a batch and its result."""
+
+    def __init__(self, file: Path, output_path: Path):
+        self.file = file
+        self.output_path = output_path
+
+        self.scratch_size = 0
+        self.stats = DumpStats(process_wide=False)
+        self.wall_time: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "file": str(self.file),
+            "output_path": str(self.output_path),
+            "success": self.error is None,
+            "error": self.error,
+            "wall_time": self.wall_time,
+            "scratch_size": self.scratch_size,
+            "stats": self.stats.to_dict(),
+        }
+
+
+def get_batch_jobs(files: List[Path], output_path: Path):
+    """Get the jobs of the files, each one gets its own folder in output_path."""
+    jobs: List[BatchJob] = []
+    names = set()
+
+    for file in files:
+        # Firmwares from different folders may have the same name
+        name = file.stem
+        index = 1
+        while name in names:
+            index += 1
+            name = f"{file.stem}-{index}"
+        names.add(name)
+
+        jobs.append(BatchJob(file, output_path / name))
+
+    return jobs
+
+
+def _run_job(
+    job: BatchJob,
+    debug: bool,
+    jobs: Optional[int],
+    partition_filter: PartitionFilter,
+    cache: Optional[DumpCache],
+    resume: bool,
+):
+    LOGI(f"Dumping {job.file.name}")
+
+    # Don't account the time spent waiting for a slot
+    job.stats = DumpStats(process_wide=False)
+
+    start = monotonic()
+    try:
+        dumpyara(
+            job.file,
+            job.output_path,
+            debug,
+            jobs,
+            partition_filter,
+            cache,
+            resume,
+            job.stats,
+        )
+    except Exception as e:
+        LOGE(f"Failed to dump {job.file.name}:\n{format_exception(e)}")
+        job.error = str(e) or type(e).__name__
+    else:
+        LOGI(f"Dumped {job.file.name}")
+    finally:
+        job.wall_time = round(monotonic() - start, 3)
+
+
+def dumpyara_batch(
+    files: List[Path],
+    output_path: Path,
+    debug: bool = False,
+    jobs: Optional[int] = None,
+    parallel_dumps: int = 2,
+    max_scratch_size: Optional[int] = None,
+    partition_filter: PartitionFilter = ALL_PARTITIONS,
+    cache: Optional[DumpCache] = None,
+    resume: bool = False,
+):
+    """
+    Dump many firmwares, each one in its own folder in output_path.
+
+    Up to parallel_dumps firmwares are dumped at the same time, and the
+    parallel work of all of them (partitions, payload operations...) goes
+    through one pool of jobs workers (by default the number of CPUs), so
+    that the CPUs are kept busy by the other dumps while one is extracting
+    its archive or copying images.
+    If max_scratch_size is set, a dump only starts once the estimated size
+    of its temporary files fits along the ones of the running dumps.
+    A failed dump doesn't stop the others. The result of each one is
+    returned and written to batch_report.json in output_path.
+    As the dumps share the process, their stats only have the wall time of
+    the steps, CPU time and I/O are only measured per partition and tool.
+    """
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    batch_jobs = get_batch_jobs(files, output_path)
+
+    scratch_space = ScratchSpace(max_scratch_size)
+    dump_slots = Semaphore(parallel_dumps)
+
+    def run_job(job: BatchJob):
+        try:
+            _run_job(job, debug, jobs, partition_filter, cache, resume)
+        finally:
+            scratch_space.release(job.scratch_size)
+            dump_slots.release()
+
+    shared_executor = ThreadPoolExecutor(max_workers=jobs or cpu_count() or 1)
+    set_shared_executor(shared_executor)
+
+    try:
+        with ThreadPoolExecutor(max_workers=parallel_dumps) as dumps_executor:
+            futures = []
+            for job in batch_jobs:
+                try:
+                    job.scratch_size = get_scratch_size(job.file)
+                except OSError as e:
+                    job.error = str(e)
+                    LOGE(f"Skipping {job.file.name}: {e}")
+                    continue
+
+                dump_slots.acquire()
+                scratch_space.reserve(job.scratch_size)
+
+                futures.append(dumps_executor.submit(run_job, job))
+
+            for future in futures:
+                future.result()
+    finally:
+        set_shared_executor(None)
+        shared_executor.shutdown()
+
+    (output_path / BATCH_REPORT_FILE_NAME).write_text(
+        json.dumps([job.to_dict() for job in batch_jobs], indent=2) + "\n"
+    )
+
+    return batch_jobs
+
+
+def get_batch_summary(batch_jobs: List[BatchJob]):
+    """Get a human readable summary of the results of a batch."""
+    lines = []
+    for job in batch_jobs:
+        wall_time = f"{job.wall_time:.1f}s" if job.wall_time is not None else "-"
+        if job.error is None:
+            lines.append(f"  OK     {wall_time:>8}  {job.file.name}")
+        else:
+            lines.append(f"  FAILED {wall_time:>8}  {job.file.name}: {job.error}")
+
+    failed = sum(1 for job in batch_jobs if job.error is not None)
+    lines.append(f"{len(batch_jobs) - failed} dumped, {failed} failed")
+
+    return "\n".join(lines)
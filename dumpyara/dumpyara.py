@@ -7,23 +7,54 @@ from pathlib import Path
 from sebaubuntu_libs.liblogging import LOGI
 from sebaubuntu_libs.libreorder import strcoll_files_key
 from shutil import which
+from typing import Optional
 
 from dumpyara.lib.libsevenzip import SEVEN_ZIP_EXECUTABLE, P7ZIP_EXECUTABLE
+from dumpyara.utils.cache import DumpCache, get_cache_key, hash_file
 from dumpyara.utils.files import get_recursive_files_list, rmtree_recursive
+from dumpyara.utils.partitions import ALL_PARTITIONS, PartitionFilter
+from dumpyara.utils.state import STATE_FILE_NAME, DumpState
+from dumpyara.utils.stats import STATS_FILE_NAME, STATS_STEPS, DumpStats
+from dumpyara.utils.workers import get_executor
 from dumpyara.steps.extract_archive import extract_archive
-from dumpyara.steps.extract_images import extract_images
+from dumpyara.steps.extract_images import ImageExtractor, extract_images
 from dumpyara.steps.prepare_images import prepare_images
 
 # Package name to package commands
 REQUIRED_TOOLS = {
     "7-zip or p7zip": [SEVEN_ZIP_EXECUTABLE, P7ZIP_EXECUTABLE],
     "erofs-utils": ["fsck.erofs"],
-    "android-sdk-libsparse-utils or platform-utils": ["simg2img"],
 }
 
 
-def dumpyara(file: Path, output_path: Path, debug: bool = False):
-    """Dump an Android firmware."""
+def dumpyara(
+    file: Path,
+    output_path: Path,
+    debug: bool = False,
+    jobs: Optional[int] = None,
+    partition_filter: PartitionFilter = ALL_PARTITIONS,
+    cache: Optional[DumpCache] = None,
+    resume: bool = False,
+    stats: Optional[DumpStats] = None,
+):
+    """
+    Dump an Android firmware.
+
+    jobs is the number of parallel jobs (partitions to extract, payload
+    operations to decode), by default it's the number of CPUs.
+    partition_filter selects which partitions get extracted.
+    If cache is set, partitions shared with other firmwares are reused
+    from it. If cache.dumps is also True, the file is hashed before step 1
+    and a previous dump of the same file is restored without extracting
+    anything, the result is stored in it otherwise.
+    If resume is True, the progress is saved in the output folder and the
+    temporary files are kept on failure, so that a new call with the same
+    file can skip the work that has already been done.
+    Timings and I/O of the dump are recorded in stats (a new one is used
+    if not set) and written to dump_stats.json.
+    """
+    if stats is None:
+        stats = DumpStats()
 
     # Temporary directories
     extracted_archive_path = output_path / "temp_extracted_archive"
@@ -40,40 +71,148 @@ def dumpyara(file: Path, output_path: Path, debug: bool = False):
             f"You are missing {tools[0]}, please install {package} from your distro's repositories"
         )
 
-    try:
-        # Make output and temporary directories
-        output_path.mkdir(exist_ok=True)
-        extracted_archive_path.mkdir()
-        raw_images_path.mkdir()
-
-        LOGI("Step 1 - Extracting archive")
-        extract_archive(file, extracted_archive_path)
+    # Make output directory
+    output_path.mkdir(exist_ok=True)
 
-        LOGI("Step 2 - Preparing partition images")
-        prepare_images(extracted_archive_path, raw_images_path)
+    state = DumpState(output_path, file, partition_filter) if resume else None
+    finished = False
 
-        LOGI("Step 3 - Extracting partitions")
-        extract_images(raw_images_path, output_path)
+    try:
+        cache_key = None
+        if cache is not None and cache.dumps:
+            with stats.measure(STATS_STEPS, "hash_file"):
+                cache_key = get_cache_key(hash_file(file), partition_filter)
+
+            if cache.restore(cache_key, output_path):
+                finished = True
+                if state is not None:
+                    state.remove()
+
+                stats.write(output_path)
+
+                return output_path
+
+        # Make temporary directories, leftovers are only reused when resuming
+        for temp_path in (extracted_archive_path, raw_images_path):
+            if temp_path.exists() and (state is None or not state.resumed):
+                rmtree_recursive(temp_path)
+            temp_path.mkdir(exist_ok=True)
+
+        stored_members = state.get_stored_members(file) if state is not None else None
+        if stored_members is None:
+            LOGI("Step 1 - Extracting archive")
+            with stats.measure(STATS_STEPS, "extract_archive"):
+                stored_members = extract_archive(
+                    file,
+                    extracted_archive_path,
+                    partition_filter=partition_filter,
+                    jobs=jobs,
+                    index_dir=cache.indexes_dir if cache is not None else None,
+                )
+
+            if state is not None:
+                state.set_archive_extracted(stored_members)
+        else:
+            LOGI("Step 1 - Archive already extracted, skipping")
+
+        if state is not None and state.are_raw_images_prepared(raw_images_path):
+            LOGI("Step 2 - Partition images already prepared, skipping")
+
+            LOGI("Step 3 - Extracting partitions")
+            with stats.measure(STATS_STEPS, "extract_images"):
+                extract_images(
+                    raw_images_path, output_path, jobs, partition_filter, cache, state, stats
+                )
+        else:
+            # Each partition is extracted as soon as its raw image is ready
+            LOGI("Step 2 and 3 - Preparing and extracting partition images")
+
+            prepare_partition_filter = partition_filter
+            if state is not None:
+                # Start over, multipartitions may have been partially unpacked
+                rmtree_recursive(raw_images_path)
+                raw_images_path.mkdir()
+
+                # Don't prepare again the partitions already extracted
+                prepare_partition_filter = PartitionFilter(
+                    partition_filter.partitions,
+                    [*partition_filter.exclude_partitions, *state.get_extracted_partitions()],
+                )
+
+            with stats.measure(STATS_STEPS, "prepare_and_extract_images"):
+                with get_executor(jobs) as executor:
+                    extractor = ImageExtractor(
+                        executor, output_path, partition_filter, cache, state, stats
+                    )
+
+                    # One pool for everything, so that jobs bounds the whole dump.
+                    # When resuming, the raw images are made again from the
+                    # archive files, they must be kept
+                    prepare_images(
+                        extracted_archive_path,
+                        raw_images_path,
+                        jobs,
+                        stored_members,
+                        prepare_partition_filter,
+                        cache,
+                        extractor.submit,
+                        executor,
+                        keep_inputs=state is not None,
+                    )
+
+                    if state is not None:
+                        state.set_raw_images_prepared(raw_images_path)
+
+                    extractor.wait()
 
         # Make sure system folder exists and it's not empty
-        assert (output_path / "system").exists(), "System folder doesn't exist"
-        assert len(list((output_path / "system").iterdir())) > 0, "System folder is empty"
+        if partition_filter.is_wanted("system"):
+            assert (output_path / "system").exists(), "System folder doesn't exist"
+            assert len(list((output_path / "system").iterdir())) > 0, "System folder is empty"
 
         LOGI("Step 4 - Finalizing")
-        # Update files list
-        files_list = sorted(
-            get_recursive_files_list(output_path, relative=True), key=strcoll_files_key
-        )
-
-        # Create all_files.txt
-        LOGI("Creating all_files.txt")
-        (output_path / "all_files.txt").write_text(
-            "\n".join([str(file) for file in files_list]) + "\n"
-        )
+        with stats.measure(STATS_STEPS, "finalize"):
+            # Update files list, the state is only removed once the dump is finished
+            files_list = sorted(
+                (
+                    file
+                    for file in get_recursive_files_list(output_path, relative=True)
+                    if str(file) != STATE_FILE_NAME
+                ),
+                key=strcoll_files_key,
+            )
+
+            # Create all_files.txt
+            LOGI("Creating all_files.txt")
+            (output_path / "all_files.txt").write_text(
+                "\n".join([str(file) for file in files_list]) + "\n"
+            )
+
+            if cache is not None:
+                if cache_key is not None:
+                    cache.publish(
+                        cache_key,
+                        output_path,
+                        exclude=[
+                            extracted_archive_path.name,
+                            raw_images_path.name,
+                            STATS_FILE_NAME,
+                            STATE_FILE_NAME,
+                        ],
+                    )
+
+                cache.evict(keep=cache.dumps_dir / cache_key if cache_key is not None else None)
+
+        stats.write(output_path)
+
+        finished = True
+        if state is not None:
+            state.remove()
 
         return output_path
     finally:
-        if not debug:
+        # Keep the temporary files of a failed dump to resume it later
+        if not debug and (finished or state is None):
             # Remove temporary directories if they exist
             if extracted_archive_path.exists():
                 rmtree_recursive(extracted_archive_path)
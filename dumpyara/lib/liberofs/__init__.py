@@ -5,8 +5,9 @@
 """fsck.erofs wrapper."""
 
 from pathlib import Path
-from subprocess import STDOUT, check_output
+
+from dumpyara.utils.stats import check_tool_output
 
 
 def extract_erofs(image: Path, output_dir: Path):
-    return check_output(["fsck.erofs", f"--extract={output_dir}", f"{image}"], stderr=STDOUT)
+    return check_tool_output(["fsck.erofs", f"--extract={output_dir}", f"{image}"])
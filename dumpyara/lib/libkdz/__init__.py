@@ -2,30 +2,120 @@
 # SPDX-FileCopyrightText: Dumpyara Project
 # SPDX-License-Identifier: GPL-3.0-or-later
 #
-"""kdz wrapper."""
+"""
+kdz wrapper.
+
+Everything is written in the given folder and all the state is per call,
+so many files can be extracted at the same time from different threads.
+Errors raise KDZError.
+
+The chunk headers of a DZ file can be saved in an index file, so that
+opening the same file again doesn't have to walk and check them all.
+"""
 
 import os
-from pathlib import Path
+from typing import Callable, List, Optional
+from dumpyara.lib.libkdz.dz import KDZError as KDZError
 from dumpyara.lib.libkdz.unkdz import KDZFileTools
-from dumpyara.lib.libkdz.undz import DZFileTools, UNDZFile
+from dumpyara.lib.libkdz.undz import DZ_INDEX_SUFFIX, DZFileTools, UNDZFile
+from dumpyara.utils.workers import get_executor
+
+
+def get_index_path(filename: str, index_dir: str):
+    """
+    Get the path of the index file of a DZ (or KDZ) file in index_dir
+    (e.g. the folder of the file or a cache folder).
 
+    Files with the same name share it, an index made from another file
+    is detected and replaced.
+    """
+    return os.path.join(index_dir, os.path.basename(filename) + DZ_INDEX_SUFFIX)
 
-def unpack_kdz(filename: str, work_dir: str):
-    kdztools = KDZFileTools()
-    kdztools.outdir = work_dir
+
+def unpack_kdz(
+    filename: str,
+    work_dir: str,
+    partition_filter: Optional[Callable[[str], bool]] = None,
+    jobs: Optional[int] = None,
+    index_dir: Optional[str] = None,
+):
+    """
+    Extract a KDZ file into work_dir.
+
+    The slices of the DZ file are extracted straight from the KDZ file
+    (see unpack_dz()), the other files are copied out of it.
+    """
+    kdztools = KDZFileTools(work_dir)
     kdztools.kdzfile = filename
     kdztools.openFile(kdztools.kdzfile)
-    kdztools.partList = kdztools.getPartitions()
-    kdztools.cmdExtractAll()
-    # Now we should have .dz file
-    dz_file = list(Path(work_dir).glob("*.dz"))
-    if dz_file:
-        # Just take the first found file
-        unpack_dz(str(dz_file[0].absolute()), work_dir)
-
-
-def unpack_dz(filename: str, work_dir: str):
-    dztools = DZFileTools()
-    dztools.dz_file = UNDZFile(filename)
-    os.chdir(work_dir)
-    dztools.cmdExtractSlice([])
+    try:
+        kdztools.partList = kdztools.getPartitions()
+
+        # Just take the first DZ file, it's read in place
+        dz_index = next(
+            (index for index, (name, _) in enumerate(kdztools.partList) if name.endswith(b".dz")),
+            None,
+        )
+
+        kdztools.cmdExtractAll(exclude=[dz_index])
+    finally:
+        kdztools.closeFile()
+
+    if dz_index is not None:
+        dz_partition = kdztools.partitions[dz_index]
+        unpack_dz(
+            filename,
+            work_dir,
+            partition_filter,
+            jobs,
+            dz_partition["offset"],
+            dz_partition["length"],
+            index_dir,
+        )
+
+
+def unpack_dz(
+    filename: str,
+    work_dir: str,
+    partition_filter: Optional[Callable[[str], bool]] = None,
+    jobs: Optional[int] = None,
+    offset: int = 0,
+    length: Optional[int] = None,
+    index_dir: Optional[str] = None,
+):
+    """
+    Extract the slices of a DZ file into work_dir.
+
+    The DZ file can be a window of filename (e.g. a KDZ file), starting
+    at offset and length bytes long, it's then read in place.
+
+    If partition_filter is set, only the slices it accepts are extracted.
+    Chunks are decompressed in parallel by up to jobs workers, each one
+    written in place in its preallocated slice image.
+    If index_dir is set, the index of the DZ file is used and saved there
+    (see get_index_path()).
+    """
+    dztools = DZFileTools(work_dir)
+    dztools.dz_file = UNDZFile(
+        filename,
+        offset,
+        length,
+        get_index_path(filename, index_dir) if index_dir is not None else None,
+    )
+    try:
+        slices: List[int] = []
+        if partition_filter is not None:
+            slices = [
+                dz_slice.getIndex()
+                for dz_slice in dztools.dz_file.slices
+                if dz_slice.getIndex() is not None and partition_filter(dz_slice.getSliceName())
+            ]
+            if not slices:
+                return
+
+        os.makedirs(work_dir, exist_ok=True)
+
+        with get_executor(jobs) as executor:
+            dztools.cmdExtractSlice(slices, executor)
+    finally:
+        dztools.dz_file.close()
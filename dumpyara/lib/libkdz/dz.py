@@ -12,7 +12,13 @@ from struct import Struct
 from collections import OrderedDict
 from typing import Any, Dict, List, Optional, Type
 
-from sebaubuntu_libs.liblogging import LOGD
+
+class KDZError(Exception):
+    """
+    Error while reading a KDZ or DZ file
+    """
+
+    pass
 
 
 class DZStruct(object):
@@ -46,12 +52,11 @@ class DZStruct(object):
 
             # Sanity check
             if self._dz_struct.size != self._dz_length:
-                LOGD(
-                    "[!] Internal error!  Chunk format wrong! (computed={:d}, specified={:d})".format(
+                raise KDZError(
+                    "Internal error!  Chunk format wrong! (computed={:d}, specified={:d})".format(
                         self._dz_struct.size, self._dz_length
                     )
                 )
-                sys.exit(-1)
 
         # Generate list of items that can be collapsed (truncated)
         try:
@@ -13,6 +13,9 @@ import zlib
 import zstandard as zstd
 import argparse
 import hashlib
+import json
+import tempfile
+from concurrent.futures import as_completed, wait
 
 # from binascii import crc32
 from binascii import b2a_hex
@@ -20,9 +23,53 @@ from uuid import UUID
 from typing import Dict, List, Optional
 
 from dumpyara.lib.libkdz import dz, gpt
+from dumpyara.lib.libkdz.dz import KDZError
 from sebaubuntu_libs.liblogging import LOGD
 
 
+# Header of zlib compressed chunks, the other ones use zstandard
+ZLIB_MAGIC = bytes([0x78, 0x01])
+
+# Amount of compressed data read at once
+DZ_READ_SIZE = 1024 * 1024
+
+# Maximum amount of decompressed data returned at once
+DZ_PIECE_SIZE = 4 * 1024 * 1024
+
+# Version of the index files, to be bumped when their content changes
+DZ_INDEX_VERSION = 1
+
+# Suffix of the index files
+DZ_INDEX_SUFFIX = ".dzindex"
+
+
+class _DZDataReader(io.RawIOBase):
+    """
+    Read-only stream of a range of the DZ file.
+
+    Positional reads are used, so the position of the DZ file isn't
+    touched.
+    """
+
+    def __init__(self, fd: int, offset: int, length: int):
+        super().__init__()
+
+        self._fd = fd
+        self._offset = offset
+        self._end = offset + length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        data = os.pread(self._fd, min(len(view), self._end - self._offset), self._offset)
+        view[: len(data)] = data
+        self._offset += len(data)
+
+        return len(data)
+
+
 class UNDZUtils(object):
     """
     Common class for unpacking DZ file structures
@@ -52,8 +99,7 @@ class UNDZUtils(object):
 
         # Verify DZ area header
         if dz_item is None:
-            LOGD("[!] Bad DZ {:s} header!".format(self._dz_area))
-            sys.exit(1)
+            raise KDZError("Bad DZ {:s} header".format(self._dz_area))
 
         # some paths want to take a look at the raw data
         dz_item["buffer"] = buffer
@@ -67,17 +113,15 @@ class UNDZUtils(object):
                     # sys.exit(1)
             elif type(dz_item[key]) is int:
                 if dz_item[key] != 0:
-                    LOGD(
-                        '[!] Error: Value supposed to be zero in field "'
+                    raise KDZError(
+                        'Value supposed to be zero in field "'
                         + key
                         + '" is non-zero ('
                         + hex(dz_item[key])
                         + ")"
                     )
-                    sys.exit(1)
             else:
-                LOGD("[!] Error: internal error")
-                sys.exit(-1)
+                raise KDZError("Internal error")
 
         # To my knowledge this is supposed to be blank (for now...)
         if len(dz_item["pad"]) != 0:
@@ -156,12 +200,12 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
         for m in self.messages:
             LOGD(m, file=file)  # type: ignore
 
-    def display(self, sliceIdx, selfIdx):
+    def display(self, sliceIdx, selfIdx, batchMode=False):
         """
         Display information about our chunk
         """
 
-        if cmd.batchMode:
+        if batchMode:
             LOGD("{:d}:{:s}:data".format(sliceIdx, self.sliceName.decode("utf8")))
         else:
             LOGD(
@@ -172,19 +216,14 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
         self.Messages()
         return ++selfIdx
 
-    def extract(self):
+    def iterData(self):
         """
-        Extracts our payload from the compressed DZ file using ZLIB.
-        self function could be particularly memory-intensive when used
-        with large chunks, as the entire compressed chunk is loaded
-        into RAM and decompressed.
+        Decompress our payload from the DZ file piece by piece.
 
-        A better way to do self would be to chunk the zlib compressed
-        data and decompress it with zlib.decompressor() and a while
-        loop.
-
-        I'm lazy though, and y'all have fast computers, so self is good
-        enough.
+        Only DZ_READ_SIZE bytes of compressed data and up to
+        DZ_PIECE_SIZE bytes of decompressed data are in memory at once,
+        whatever the size of the chunk, and the MD5 is computed as the
+        pieces go.
 
         Starting with G7 KDZs, LG switched to zstandard compression.
         To keep comparibility with older KDZs, we are going to compare
@@ -192,26 +231,37 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
         use zlib .. if not, we use zstandard.
         """
 
-        # Seek to the beginning of the compressed data in the specified partition
-        self.dz.dzfile.seek(self.dataOffset, io.SEEK_SET)
-
-        zlib_magic = {"zlib": bytes([0x78, 0x01])}
-        cmp_header = self.dz.dzfile.read(2)
-
-        # Reset to the beginning of the compressed data
-        self.dz.dzfile.seek(self.dataOffset, io.SEEK_SET)
-
-        # Read the whole compressed segment into RAM
-        zdata = self.dz.dzfile.read(self.dataSize)
+        reader = io.BufferedReader(
+            _DZDataReader(self.dz.dzfile.fileno(), self.dataOffset, self.dataSize), DZ_READ_SIZE
+        )
+        md5 = hashlib.md5()
 
-        if cmp_header.startswith(zlib_magic["zlib"]):
+        if reader.peek(len(ZLIB_MAGIC))[: len(ZLIB_MAGIC)] == ZLIB_MAGIC:
             # Decompress the data with zlib
-            buf = zlib.decompress(zdata)
-
+            decompressor = zlib.decompressobj()
+            while not decompressor.eof:
+                data = decompressor.unconsumed_tail or reader.read(DZ_READ_SIZE)
+                if not data:
+                    # Whatever is left in the decompressor
+                    piece = decompressor.flush()
+                    md5.update(piece)
+                    yield piece
+                    break
+
+                piece = decompressor.decompress(data, DZ_PIECE_SIZE)
+                md5.update(piece)
+                yield piece
         else:
             # decompress with zstandard
             dctx = zstd.ZstdDecompressor()
-            buf = dctx.decompress(zdata, max_output_size=200000000)
+            with dctx.stream_reader(reader, read_size=DZ_READ_SIZE, closefd=False) as stream:
+                while True:
+                    piece = stream.read(DZ_PIECE_SIZE)
+                    if not piece:
+                        break
+
+                    md5.update(piece)
+                    yield piece
 
         # crc = crc32(buf) & 0xFFFFFFFF
 
@@ -219,34 +269,27 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
         ##              LOGD("[!] Error: CRC32 of data doesn't match header ({:08X} vs {:08X})".format(crc, self.crc32))
         #               sys.exit(1)
 
-        md5 = hashlib.md5()
-        md5.update(buf)
-
         if md5.digest() != self.md5:
-            LOGD(
-                "[!] Error: MD5 of data doesn't match header ({:32s} vs {:32s})".format(
-                    md5.hexdigest(), b2a_hex(self.md5)
+            raise KDZError(
+                "MD5 of {:s} doesn't match header ({:s} vs {:s})".format(
+                    self.chunkName.decode("utf8"), md5.hexdigest(), b2a_hex(self.md5).decode()
                 )
             )
-            sys.exit(1)
 
-        return buf
+    def extract(self):
+        """
+        Extracts our payload from the compressed DZ file into memory.
+
+        Only meant for small chunks (e.g. the GPT), see iterData().
+        """
+        return b"".join(self.iterData())
 
     def extractChunk(self, file, name):
         """
         Extract the payload of our chunk into the file with the name
 
-        Extracts our payload from the compressed DZ file using ZLIB.
-        self function could be particularly memory-intensive when used
-        with large chunks, as the entire compressed chunk is loaded
-        into RAM and decompressed.
-
-        A better way to do self would be to chunk the zlib compressed
-        data and decompress it with zlib.decompressor() and a while
-        loop.
-
-        I'm lazy though, and y'all have fast computers, so self is good
-        enough.
+        The payload is decompressed and written piece by piece, so the
+        memory used doesn't depend on the size of the chunk.
         """
 
         if name:
@@ -265,7 +308,26 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
             file.truncate(current + (self.trimCount << self.dz.shiftLBA))
 
         # Write it to file
-        file.write(self.extract())
+        for piece in self.iterData():
+            file.write(piece)
+
+        # LOGD our messages
+        self.Messages()
+
+    def extractChunkAt(self, fd, offset):
+        """
+        Extract the payload of our chunk at offset in the file descriptor fd
+
+        Positional writes are used, so chunks of the same file can be
+        extracted in parallel. The trim area isn't touched, the file is
+        expected to be preallocated with holes.
+        """
+
+        for piece in self.iterData():
+            while piece:
+                written = os.pwrite(fd, piece, offset)
+                offset += written
+                piece = piece[written:]
 
         # LOGD our messages
         self.Messages()
@@ -277,13 +339,64 @@ class UNDZChunk(dz.DZChunk, UNDZUtils):
 
         LOGD("[+] Extracting {:s} to {:s}".format(self.chunkName.decode("utf8"), name))
 
-        self.dz.dzfile.seek(self.dataOffset - self._dz_length, io.SEEK_SET)
-        buffer = self.dz.dzfile.read(self.dataSize + self._dz_length)
-        file.write(buffer)
+        reader = _DZDataReader(
+            self.dz.dzfile.fileno(),
+            self.dataOffset - self._dz_length,
+            self.dataSize + self._dz_length,
+        )
+        while True:
+            buffer = reader.read(DZ_READ_SIZE)
+            if not buffer:
+                break
+
+            file.write(buffer)
 
         # LOGD our messages
         self.Messages()
 
+    # Fields saved in index files, names are bytes
+    _dz_index_fields = [
+        "sliceName",
+        "chunkName",
+        "targetAddr",
+        "targetSize",
+        "dataSize",
+        "md5",
+        "trimCount",
+        "crc32",
+        "dev",
+        "dataOffset",
+        "messages",
+    ]
+
+    def getIndexEntry(self):
+        """
+        Return what's needed to load us again without reading the DZ file
+        """
+        entry = {}
+        for key in self._dz_index_fields:
+            value = getattr(self, key)
+            # bytes don't go in JSON
+            entry[key] = value.decode("latin-1") if isinstance(value, bytes) else value
+        return entry
+
+    @classmethod
+    def fromIndexEntry(cls, dzFile, entry):
+        """
+        Load a chunk from its index entry, see getIndexEntry()
+        """
+        chunk = cls.__new__(cls)
+        super(UNDZChunk, chunk).__init__()
+
+        # Save a pointer to the UNDZFile
+        chunk.dz = dzFile
+
+        for key in cls._dz_index_fields:
+            value = entry[key]
+            setattr(chunk, key, value.encode("latin-1") if isinstance(value, str) else value)
+
+        return chunk
+
     def __init__(self, dz, file):
         """
         Loads the DZ header in the form as defined by self._dz_chunk_dict
@@ -396,7 +509,7 @@ class UNDZSlice(object):
         """
         return self.index
 
-    def display(self, sliceIdx, chunkIdx):
+    def display(self, sliceIdx, chunkIdx, batchMode=False):
         """
         Display information on the various chunks in our slice
         Return the last index we used
@@ -405,14 +518,14 @@ class UNDZSlice(object):
             if not self.index:
                 chunkIdx = None
                 sliceIdx = -1
-            if cmd.batchMode:
+            if batchMode:
                 LOGD("{:2d}:{:s}:empty".format(sliceIdx, self.name))
                 # elif sliceIdx != -1:
             else:
                 LOGD("{:2d}/?? : {:s} (<empty>)".format(sliceIdx, self.name))
         else:
             for chunk in self.chunks:
-                chunk.display(sliceIdx, chunkIdx)
+                chunk.display(sliceIdx, chunkIdx, batchMode)
                 chunkIdx += 1
         return chunkIdx
 
@@ -440,26 +553,67 @@ class UNDZSlice(object):
         """
         self.chunks[idx].extractChunkfile(file, name)
 
+    def canExtractInParallel(self):
+        """
+        Check whether our chunks can be extracted independently
+        (no chunk starts in front of us, like the backup GPT)
+        """
+        return all(chunk.getTargetStart() >= self.start for chunk in self.chunks)
+
+    def getImageSize(self):
+        """
+        Get the size of the extracted slice, trim areas included
+        """
+        if self.getLength() >= 0:
+            return self.getLength()
+
+        # it is possible for chunks wipe area to extend beyond slice
+        return max(
+            [
+                chunk.getTargetStart()
+                - self.start
+                + max(chunk.trimCount << self.dz.shiftLBA, chunk.targetSize)
+                for chunk in self.chunks
+            ],
+            default=0,
+        )
+
+    def submitSlice(self, fd, executor):
+        """
+        Extract the whole slice to the file descriptor fd, each chunk
+        in its own task of executor
+
+        The file is preallocated, so trim areas are left as holes.
+        Return the futures of the chunks, the file must be truncated
+        to getImageSize() again once they're done.
+        """
+
+        os.ftruncate(fd, self.getImageSize())
+
+        return [
+            executor.submit(chunk.extractChunkAt, fd, chunk.getTargetStart() - self.start)
+            for chunk in self.chunks
+        ]
+
     def extractSlice(self, file, name):
         """
         Extract the whole slice to the FileIO file named name
         """
 
         start = self.getStart()
-        end = self.getEnd()
 
         for chunk in self.chunks:
             cur = chunk.getTargetStart()
             # Mostly happens for the backup GPT (large pad at start)
             if cur < start:
-                # this ensures messages from extraction show up
-                chunk.extractChunk(file, name)
                 file.seek(0, io.SEEK_SET)
                 file.truncate(0)
-                # in case the long buffer was reeeally looong
 
                 buf = chunk.extract()
                 file.write(buf[cur - start :])
+
+                # LOGD the messages of the chunk
+                chunk.Messages()
             else:
                 file.seek(cur - start, io.SEEK_SET)
                 chunk.extractChunk(file, name)
@@ -468,9 +622,19 @@ class UNDZSlice(object):
         if self.getLength() >= 0:
             file.truncate(self.getLength())
 
-        # write a params file for saving values used during recreate
+        self.saveParams(name)
+
+    def saveParams(self, name):
+        """
+        Write a params file for saving values used during recreate
+        next to the file named name
+        """
+
+        start = self.getStart()
+        end = self.getEnd()
+
         params = io.open(name + ".params", "wt")
-        params.write('# saved parameters for the file "{:s}"\n'.format(name))
+        params.write('# saved parameters for the file "{:s}"\n'.format(os.path.basename(name)))
         params.write("startLBA={:d}\n".format(start >> self.dz.shiftLBA))
         params.write("startAddr={:d}\n".format(start))
         params.write("endLBA={:d}\n".format(end >> self.dz.shiftLBA))
@@ -519,21 +683,24 @@ class UNDZFile(dz.DZFile, UNDZUtils):
     Representation of the data parsed from a LGE DZ file
     """
 
-    def open(self, name):
+    def open(self, name, offset=0, length=None):
         """
         What do you expect? Open file and check the header
+
+        The DZ file can be a window of the file (e.g. inside a KDZ file),
+        starting at offset and length bytes long (by default until the
+        end of the file). Data offsets are always in the whole file.
         """
 
         # Open the file
-        try:
-            self.dzfile = io.open(name, "rb")
-        except IOError as err:
-            LOGD(err)
-            sys.exit(1)
+        self.dzfile = io.open(name, "rb")
 
-        # Get length of whole file
-        self.length = self.dzfile.seek(0, io.SEEK_END)
-        self.dzfile.seek(0, io.SEEK_SET)
+        # Get length of whole DZ file
+        self.offset = offset
+        if length is None:
+            length = self.dzfile.seek(0, io.SEEK_END) - offset
+        self.length = length
+        self.dzfile.seek(offset, io.SEEK_SET)
 
         # Load the header, does common checking
         dz_file = self.loadHeader(self.dzfile)
@@ -555,8 +722,7 @@ class UNDZFile(dz.DZFile, UNDZUtils):
 
         # Appears to be version numbers for the format
         if dz_file["formatMajor"] > 2:
-            LOGD("[!] Error: DZ format version too high! (please report)")
-            sys.exit(1)
+            raise KDZError("DZ format version too high! (please report)")
         elif dz_file["formatMinor"] > 1:
             LOGD("[!] Warning: DZ format more recent than previous versions, output unreliable")
 
@@ -619,7 +785,7 @@ class UNDZFile(dz.DZFile, UNDZUtils):
             # Would seeking the file to the end of the compressed
             # data bring us to the end of the file, or beyond it?
             next = chunk.getNext()
-            if next >= int(self.length):
+            if next >= self.offset + self.length:
                 break
 
             # Seek to next DZ header
@@ -708,19 +874,17 @@ class UNDZFile(dz.DZFile, UNDZUtils):
 
         # This does look like a count of chunks
         if len(self.chunks) != self.chunkCount:
-            LOGD("[!] Error: chunks in header differs from chunks found (please report)")
-            sys.exit(-1)
+            raise KDZError("Chunks in header differs from chunks found (please report)")
 
         # Checking this field for what is expected
         md5Headers = self.md5Headers.digest()
 
         if md5Headers != self.md5:
-            LOGD(
-                "[!] Error: MD5 of chunk headers doesn't match header ({:32s} vs {:32s})".format(
-                    self.md5Headers.hexdigest(), b2a_hex(self.md5)
+            raise KDZError(
+                "MD5 of chunk headers doesn't match header ({:s} vs {:s})".format(
+                    self.md5Headers.hexdigest(), b2a_hex(self.md5).decode()
                 )
             )
-            sys.exit(-1)
 
         # these are speculative, disabled for others
         return 0
@@ -780,14 +944,14 @@ class UNDZFile(dz.DZFile, UNDZUtils):
         # Add it
         slice.addChunk(chunk)
 
-    def display(self):
+    def display(self, batchMode=False):
         """
         Display information on the various chunks that were found
         """
         chunkIdx = 0
         sliceIdx = 0
         for slice in self.slices:
-            count = slice.display(sliceIdx, chunkIdx)
+            count = slice.display(sliceIdx, chunkIdx, batchMode)
             if count is not None:
                 chunkIdx = count
                 sliceIdx += 1
@@ -865,11 +1029,11 @@ class UNDZFile(dz.DZFile, UNDZUtils):
             file.seek(chunk.getTargetStart(), io.SEEK_SET)
             chunk.extractChunk(file, name)
 
-    def saveHeader(self, name):
+    def saveHeader(self, name, outdir="."):
         """
         Dump the header from the original file into the output dir
         """
-        params = open(".dz.params", "wt")
+        params = open(os.path.join(outdir, ".dz.params"), "wt")
         params.write('# saved parameters from the file "{:s}"\n'.format(name))
         params.write("format_major={:d}\n".format(self.formatMajor))
         params.write("format_minor={:d}\n".format(self.formatMinor))
@@ -902,9 +1066,111 @@ class UNDZFile(dz.DZFile, UNDZUtils):
 
         params.close()
 
-    def __init__(self, name):
+    def close(self):
+        """
+        Close the DZ file
+        """
+        self.dzfile.close()
+
+    def getIndexFingerprint(self):
+        """
+        Return what identifies the DZ file an index file was made from
+        """
+        stat = os.fstat(self.dzfile.fileno())
+
+        return {
+            "version": DZ_INDEX_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "offset": self.offset,
+            "length": self.length,
+        }
+
+    def saveIndex(self, name):
+        """
+        Save the map of chunks and slices to the index file named name,
+        so that it doesn't have to be loaded from the DZ file again
+        """
+        chunkIdx = {id(chunk): idx for idx, chunk in enumerate(self.chunks)}
+
+        index = {
+            "fingerprint": self.getIndexFingerprint(),
+            "shiftLBA": self.shiftLBA,
+            "messages": sorted(self.messages),
+            "chunks": [chunk.getIndexEntry() for chunk in self.chunks],
+            "slices": [
+                {
+                    "index": slice.getIndex(),
+                    "name": slice.getSliceName(),
+                    "start": slice.getStart(),
+                    "end": slice.getEnd(),
+                    "chunks": [chunkIdx[id(chunk)] for chunk in slice.chunks],
+                }
+                for slice in self.slices
+            ],
+        }
+
+        # The index is only an optimization, don't fail if it can't be written.
+        # Other threads and processes may save the same index at the same time
+        temp_name = None
+        try:
+            fd, temp_name = tempfile.mkstemp(
+                prefix=os.path.basename(name) + ".", suffix=".tmp", dir=os.path.dirname(name) or "."
+            )
+            with os.fdopen(fd, "wt") as f:
+                json.dump(index, f)
+            os.replace(temp_name, name)
+        except OSError as err:
+            LOGD("[!] Warning: Unable to save index {:s}: {:s}".format(name, str(err)))
+            if temp_name is not None and os.path.exists(temp_name):
+                os.unlink(temp_name)
+
+    def loadIndex(self, name):
+        """
+        Load the map of chunks and slices from the index file named name
+        Return whether it was valid for this DZ file
+        """
+        try:
+            with open(name, "rt") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(index, dict) or index.get("fingerprint") != self.getIndexFingerprint():
+            LOGD("[ ] Index {:s} is outdated, ignoring it".format(name))
+            return False
+
+        try:
+            self.shiftLBA = index["shiftLBA"]
+            self.messages = set(index["messages"])
+            self.chunks = [UNDZChunk.fromIndexEntry(self, entry) for entry in index["chunks"]]
+
+            self.slices = []
+            self.sliceIdx = {}
+            for entry in index["slices"]:
+                slice = UNDZSlice(self, entry["index"], entry["name"], entry["start"], entry["end"])
+                slice.chunks = [self.chunks[idx] for idx in entry["chunks"]]
+                self.slices.append(slice)
+                self.sliceIdx[slice.getSliceName()] = slice
+        except (KeyError, TypeError, IndexError, AttributeError, UnicodeError):
+            LOGD("[!] Warning: Index {:s} is corrupted, ignoring it".format(name))
+            self.chunks = []
+            self.slices = []
+            self.sliceIdx = {}
+            self.messages = set()
+            return False
+
+        return True
+
+    def __init__(self, name, offset=0, length=None, index=None):
         """
         Constructing this class opens the file and loads map of chunks
+
+        See open() for offset and length
+        If index is set, the map of chunks is loaded from the index file
+        with that name when it was made from this very DZ file (same size,
+        modification time and window), otherwise it's saved there once
+        loaded.
         """
 
         super(UNDZFile, self).__init__()
@@ -937,18 +1203,31 @@ class UNDZFile(dz.DZFile, UNDZUtils):
         #               self.crcAll = crc32(b"")
         #               # try crc32 ?
 
-        self.open(name)
-        self.loadChunks()
-        self.checkValues()
+        self.open(name, offset, length)
+        try:
+            if index is None or not self.loadIndex(index):
+                self.loadChunks()
+                self.checkValues()
+
+                if index is not None:
+                    self.saveIndex(index)
+        except BaseException:
+            self.close()
+            raise
 
 
 class DZFileTools:
     """
     LGE Compressed DZ File tools
+
+    Everything is extracted in outdir, the working directory isn't used.
     """
 
-    # Setup variables
-    outdir = "dzextracted"
+    dz_file: "UNDZFile"
+
+    def __init__(self, outdir="dzextracted", batchMode=False):
+        self.outdir = outdir
+        self.batchMode = batchMode
 
     def parseArgs(self):
         # Parse arguments
@@ -996,13 +1275,36 @@ class DZFileTools:
         parser.add_argument(
             "-d", "--dir", "-o", "--out", help="output location", action="store", dest="outdir"
         )
+        parser.add_argument(
+            "-I",
+            "--index",
+            help="use and save an index of the chunks next to the DZ file",
+            action="store_true",
+            dest="index",
+        )
 
         return parser.parse_known_args()
 
+    def getIndex(self, idx, count, kind):
+        """
+        Check an index given on the command line
+        """
+        try:
+            idx = int(idx)
+        except ValueError:
+            raise KDZError('Bad value "{:s}" (must be number)'.format(str(idx)))
+        if idx < 0 or idx >= count:
+            raise KDZError(
+                "Cannot extract out of range {:s} {:d} (min=0 max={:d})".format(
+                    kind, idx, count - 1
+                )
+            )
+        return idx
+
     def cmdListPartitions(self):
-        if not cmd.batchMode:
+        if not self.batchMode:
             LOGD("[+] DZ Partition List\n=========================================")
-        self.dz_file.display()
+        self.dz_file.display(self.batchMode)
 
     def cmdExtractChunk(self, files):
         if len(files) == 0:
@@ -1014,19 +1316,8 @@ class DZFileTools:
             LOGD("[+] Extracting {:d} chunks!\n".format(len(files)))
 
         for idx in files:
-            try:
-                idx = int(idx)
-            except ValueError:
-                LOGD('[!] Bad value "{:s}" (must be number)'.format(idx))
-                sys.exit(1)
-            if idx < 0 or idx >= self.dz_file.getChunkCount():
-                LOGD(
-                    "[!] Cannot extract out of range chunk {:d} (min=0 max={:d})".format(
-                        idx, self.dz_file.getChunkCount() - 1
-                    )
-                )
-                sys.exit(1)
-            name = self.dz_file.getChunkName(idx)
+            idx = self.getIndex(idx, self.dz_file.getChunkCount(), "chunk")
+            name = os.path.join(self.outdir, self.dz_file.getChunkName(idx))
             file = io.FileIO(name, "wb")
             self.dz_file.extractChunk(file, name, idx)
             file.close()
@@ -1041,24 +1332,19 @@ class DZFileTools:
             LOGD("[+] Extracting {:d} chunkfiles!\n".format(len(files)))
 
         for idx in files:
-            try:
-                idx = int(idx)
-            except ValueError:
-                LOGD('[!] Bad value "{:s}" (must be number)'.format(idx))
-                sys.exit(1)
-            if idx < 0 or idx >= self.dz_file.getChunkCount():
-                LOGD(
-                    "[!] Cannot extract out of range chunkfile {:d} (min=0 max={:d})".format(
-                        idx, self.dz_file.getChunkCount() - 1
-                    )
-                )
-                sys.exit(1)
-            name = self.dz_file.getChunkName(idx) + ".chunk"
+            idx = self.getIndex(idx, self.dz_file.getChunkCount(), "chunkfile")
+            name = os.path.join(self.outdir, self.dz_file.getChunkName(idx) + ".chunk")
             file = io.open(name, "wb")
             self.dz_file.extractChunkfile(file, name, idx)
             file.close()
 
-    def cmdExtractSlice(self, files):
+    def cmdExtractSlice(self, files, executor=None):
+        """
+        Extract the given slices (all of them if none given)
+
+        If executor is set, the chunks of all the slices are decompressed
+        in parallel in it, each one written in place in its slice image.
+        """
         if len(files) == 0:
             LOGD("[+] Extracting all slices/partitions\n")
             files = range(0, self.dz_file.getSlice(-1).getIndex() + 1)
@@ -1067,19 +1353,10 @@ class DZFileTools:
         else:
             LOGD("[+] Extracting {:d} slices^Wpartitions!\n".format(len(files)))
 
+        # slice index, image name
+        slices = []
         for idx in files:
-            try:
-                idx = int(idx)
-            except ValueError:
-                LOGD('[!] Bad value "{:s}" (must be number)'.format(idx))
-                sys.exit(1)
-            if idx < 0 or idx > self.dz_file.getSlice(-1).getIndex():
-                LOGD(
-                    "[!] Cannot extract out of range slice {:d} (min=0 max={:d})".format(
-                        idx, self.dz_file.getSlice(-1).getIndex()
-                    )
-                )
-                sys.exit(1)
+            idx = self.getIndex(idx, self.dz_file.getSlice(-1).getIndex() + 1, "slice")
 
             cur = idx
             slice = self.dz_file.getSlice(cur)
@@ -1090,16 +1367,56 @@ class DZFileTools:
                     if slice.getIndex() is None:
                         slice = self.dz_file.getSlice(idx)
 
-            name = slice.getSliceName() + ".img"
-            file = io.FileIO(name, "wb")
-            self.dz_file.extractSlice(file, name, cur)
-            file.close()
+            slices.append((cur, os.path.join(self.outdir, slice.getSliceName() + ".img")))
+
+        if executor is None:
+            for cur, name in slices:
+                file = io.FileIO(name, "wb")
+                self.dz_file.extractSlice(file, name, cur)
+                file.close()
+
+            return
+
+        # slice index, name, file descriptor
+        parallel_slices = []
+        futures = []
+        try:
+            for cur, name in slices:
+                slice = self.dz_file.getSlice(cur)
+                if not slice.canExtractInParallel():
+                    continue
+
+                fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                parallel_slices.append((cur, name, fd))
+                futures.extend(slice.submitSlice(fd, executor))
+
+            # The other ones are extracted meanwhile
+            for cur, name in slices:
+                if not self.dz_file.getSlice(cur).canExtractInParallel():
+                    file = io.FileIO(name, "wb")
+                    self.dz_file.extractSlice(file, name, cur)
+                    file.close()
+
+            for future in as_completed(futures):
+                future.result()
+
+            for cur, name, fd in parallel_slices:
+                slice = self.dz_file.getSlice(cur)
+                os.ftruncate(fd, slice.getImageSize())
+                slice.saveParams(name)
+        finally:
+            # Don't close the files while chunks are still being written
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+            for _, _, fd in parallel_slices:
+                os.close(fd)
 
     def cmdExtractImage(self, files):
         if len(files) > 0:
-            LOGD("[!] Cannot specify specific portions to extract when outputting image")
-            sys.exit(1)
-        name = "image.img"
+            raise KDZError("Cannot specify specific portions to extract when outputting image")
+        name = os.path.join(self.outdir, "image.img")
         try:
             file = io.open(name, "r+b")
         except IOError:
@@ -1108,7 +1425,6 @@ class DZFileTools:
         file.close()
 
     def main(self):
-        global cmd
         args = self.parseArgs()
         cmd = args[0]
         files = args[1]
@@ -1116,7 +1432,11 @@ class DZFileTools:
         if cmd.outdir:
             self.outdir = cmd.outdir
 
-        self.dz_file = UNDZFile(cmd.dzfile)
+        self.batchMode = cmd.batchMode
+
+        self.dz_file = UNDZFile(
+            cmd.dzfile, index=cmd.dzfile + DZ_INDEX_SUFFIX if cmd.index else None
+        )
 
         if cmd.listOnly:
             self.cmdListPartitions()
@@ -1126,9 +1446,6 @@ class DZFileTools:
         if not os.path.exists(self.outdir):
             os.makedirs(self.outdir)
 
-        # Change to the output directory
-        os.chdir(self.outdir)
-
         # Extracting slice(s)
         if cmd.extractSlice:
             self.cmdExtractSlice(files)
@@ -1146,9 +1463,13 @@ class DZFileTools:
             self.cmdExtractChunk(files)
 
         # Save the header for later reconstruction
-        self.dz_file.saveHeader(cmd.dzfile)
+        self.dz_file.saveHeader(cmd.dzfile, self.outdir)
 
 
 if __name__ == "__main__":
     dztools = DZFileTools()
-    dztools.main()
+    try:
+        dztools.main()
+    except KDZError as err:
+        LOGD("[!] Error: {:s}".format(str(err)))
+        sys.exit(1)
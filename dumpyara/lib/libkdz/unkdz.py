@@ -12,18 +12,17 @@ import sys
 from binascii import b2a_hex
 
 from dumpyara.lib.libkdz import kdz
+from dumpyara.lib.libkdz.dz import KDZError
+from dumpyara.lib.libsparse import copy_file_data
 from sebaubuntu_libs.liblogging import LOGD
 
 
 class KDZFileTools(kdz.KDZFile):
     """
     LGE KDZ File tools
-    """
 
-    # Setup variables
-    partitions = []
-    outdir = "kdzextracted"
-    infile = None
+    Everything is extracted in outdir, the working directory isn't used.
+    """
 
     kdz_header = {
         b"\x28\x05\x00\x00\x34\x31\x25\x80": 0,
@@ -57,17 +56,11 @@ class KDZFileTools(kdz.KDZFile):
                     # sys.exit(1)
             elif type(kdz_item[key]) is int:
                 if kdz_item[key] != 0:
-                    LOGD(
-                        '[!] Error: field "'
-                        + str(key)
-                        + '" is non-zero ('
-                        + str(b2a_hex(kdz_item[key]))
-                        + ")"
+                    raise KDZError(
+                        'Field "' + str(key) + '" is non-zero (' + hex(kdz_item[key]) + ")"
                     )
-                    sys.exit(1)
             else:
-                LOGD("[!] Error: internal error")
-                sys.exit(-1)
+                raise KDZError("Internal error")
 
         return kdz_item
 
@@ -137,35 +130,21 @@ class KDZFileTools(kdz.KDZFile):
 
         currentPartition = self.partitions[index]
 
-        # Seek to the beginning of the compressed data in the specified partition
-        self.infile.seek(currentPartition["offset"], os.SEEK_SET)
-
         # Ensure that the output directory exists
         if not os.path.exists(self.outdir):
             os.makedirs(self.outdir)
 
-        # Open the new file for writing
-        outfile = open(os.path.join(self.outdir, currentPartition["name"].decode("utf8")), "wb")
-
-        # Use 1024 byte chunks
-        chunkSize = 1024
-
-        # uncomment to prevent runaways
-        # for x in xrange(10):
-
-        while True:
-            # Read file in 1024 byte chunks
-            outfile.write(self.infile.read(chunkSize))
-
-            # If the output file + chunkSize would be larger than the input data
-            if outfile.tell() + chunkSize >= currentPartition["length"]:
-                # Change the chunk size to be the difference between the length of the input and the current length of the output
-                outfile.write(self.infile.read(currentPartition["length"] - outfile.tell()))
-                # Prevent runaways!
-                break
-
-        # Close the file
-        outfile.close()
+        # Copy the data in large blocks, in the kernel when possible
+        with open(
+            os.path.join(self.outdir, currentPartition["name"].decode("utf8")), "wb"
+        ) as outfile:
+            copy_file_data(
+                self.infile.fileno(),
+                outfile.fileno(),
+                currentPartition["length"],
+                currentPartition["offset"],
+                0,
+            )
 
     def saveExtra(self):
         """
@@ -264,11 +243,7 @@ class KDZFileTools(kdz.KDZFile):
 
     def openFile(self, kdzfile):
         # Open the file
-        try:
-            self.infile = open(kdzfile, "rb")
-        except IOError as err:
-            LOGD(err)
-            sys.exit(1)
+        self.infile = open(kdzfile, "rb")
 
         # Get length of whole file
         self.infile.seek(0, os.SEEK_END)
@@ -280,12 +255,19 @@ class KDZFileTools(kdz.KDZFile):
         verify_header = self.infile.read(8)
 
         if verify_header not in self.kdz_header:
-            LOGD("[!] Error: Unsupported KDZ file format.")
-            LOGD('[ ] Received header "{:s}".'.format(b2a_hex(verify_header)))
-            sys.exit(1)
+            raise KDZError(
+                'Unsupported KDZ file format, received header "{:s}"'.format(
+                    b2a_hex(verify_header).decode()
+                )
+            )
 
         self.header_type = self.kdz_header[verify_header]
 
+    def closeFile(self):
+        if self.infile is not None:
+            self.infile.close()
+            self.infile = None
+
     def cmdExtractSingle(self, partID):
         LOGD("[+] Extracting single partition from v{:d} file!\n".format(self.header_type))
         LOGD(
@@ -296,9 +278,15 @@ class KDZFileTools(kdz.KDZFile):
         )
         self.extractPartition(partID)
 
-    def cmdExtractAll(self):
+    def cmdExtractAll(self, exclude=()):
+        """
+        Extract all partitions but the ones with the indexes in exclude
+        (e.g. the ones read in place)
+        """
         LOGD("[+] Extracting all partitions from v{:d} file!\n".format(self.header_type))
         for part in enumerate(self.partList):
+            if part[0] in exclude:
+                continue
             LOGD(
                 "[+] Extracting "
                 + part[1][0].decode("utf8")
@@ -339,7 +327,18 @@ class KDZFileTools(kdz.KDZFile):
         elif args.extractAll:
             self.cmdExtractAll()
 
+    def __init__(self, outdir="kdzextracted"):
+        super(KDZFileTools, self).__init__()
+
+        self.partitions = []
+        self.outdir = outdir
+        self.infile = None
+
 
 if __name__ == "__main__":
     kdztools = KDZFileTools()
-    kdztools.main()
+    try:
+        kdztools.main()
+    except KDZError as err:
+        LOGD("[!] Error: {:s}".format(str(err)))
+        sys.exit(1)
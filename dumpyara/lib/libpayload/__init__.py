@@ -3,18 +3,28 @@
 # SPDX-License-Identifier: MIT
 #
 
+import bz2
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
 import hashlib
+import lzma
+import mmap
 import os
 from pathlib import Path
 import struct
-import subprocess
+import threading
+import zstandard
 from google.protobuf import message
+from typing import Callable, Optional
 
 # from https://android.googlesource.com/platform/system/update_engine/+/refs/heads/master/scripts/update_payload/
 from . import update_metadata_pb2
 
 BRILLO_MAJOR_PAYLOAD_VERSION = 2
 
+# Amount of data hashed at once when verifying an image
+VERIFY_CHUNK_SIZE = 4 * 1024 * 1024
+
 
 class PayloadError(Exception):
     pass
@@ -43,8 +53,10 @@ class Payload(object):
             self.size += 4
             self.metadata_signature_len = struct.unpack(">I", payload_file.read(4))[0]
 
-    def __init__(self, payload_file):
+    def __init__(self, payload_file, offset=0):
         self.payload_file = payload_file
+        # Where the payload starts inside the file (e.g. inside an OTA zip)
+        self.offset = offset
         self.header = None
         self.manifest = None
         self.data_offset = None
@@ -55,15 +67,16 @@ class Payload(object):
         return self.payload_file.read(self.header.manifest_len)
 
     def _ReadMetadataSignature(self):
-        self.payload_file.seek(self.header.size + self.header.manifest_len)
+        self.payload_file.seek(self.offset + self.header.size + self.header.manifest_len)
         return self.payload_file.read(self.header.metadata_signature_len)
 
     def ReadDataBlob(self, offset, length):
-        self.payload_file.seek(self.data_offset + offset)
-        return self.payload_file.read(length)
+        # Positional reads, so that blobs can be read from multiple threads
+        return os.pread(self.payload_file.fileno(), length, self.data_offset + offset)
 
     def Init(self):
         self.header = self._PayloadHeader()
+        self.payload_file.seek(self.offset)
         self.header.ReadFromPayload(self.payload_file)
         manifest_raw = self._ReadManifest()
         self.manifest = update_metadata_pb2.DeltaArchiveManifest()
@@ -76,59 +89,263 @@ class Payload(object):
             self.metadata_signature = update_metadata_pb2.Signatures()
             self.metadata_signature.ParseFromString(metadata_signature_raw)
         self.metadata_size = self.header.size + self.header.manifest_len
-        self.data_offset = self.metadata_size + self.header.metadata_signature_len
+        self.data_offset = self.offset + self.metadata_size + self.header.metadata_signature_len
+
+
+class MmapPayload(Payload):
+    """
+    Payload backed by a read-only memory mapping of the file.
+
+    Data blobs are handed out as memoryview slices of the mapping, so they
+    can be written or decompressed without intermediate copies, and the
+    page cache is shared by all the worker threads.
+    """
+
+    def __init__(self, payload_file, offset=0):
+        self.mapping = mmap.mmap(payload_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mapping)
+        super().__init__(self.mapping, offset)
+
+    def ReadDataBlob(self, offset, length):
+        start = self.data_offset + offset
+        return self.view[start : start + length]
+
+    def close(self):
+        self.view.release()
+        try:
+            self.mapping.close()
+        except BufferError:
+            # Some blob views are still alive, the mapping will be closed with them
+            pass
+
+
+_thread_local = threading.local()
+
 
+def get_zstd_decompressor():
+    # Decompression contexts are reusable but not thread-safe, keep one per worker
+    dctx = getattr(_thread_local, "zstd_decompressor", None)
+    if dctx is None:
+        dctx = zstandard.ZstdDecompressor()
+        _thread_local.zstd_decompressor = dctx
+    return dctx
 
-def decompress_payload(command, data, size, hash):
-    p = subprocess.Popen([command, "-"], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
-    r = p.communicate(data)[0]
+
+def decompress_payload(operation_type, data, size, hash):
+    try:
+        if operation_type == update_metadata_pb2.InstallOperation.REPLACE_XZ:
+            r = lzma.decompress(data)
+        elif operation_type == update_metadata_pb2.InstallOperation.REPLACE_BZ:
+            r = bz2.decompress(data)
+        elif operation_type == update_metadata_pb2.InstallOperation.ZSTD:
+            r = get_zstd_decompressor().decompress(data, max_output_size=size)
+        else:
+            raise PayloadError(f"Unhandled compressed operation type ({operation_type})")
+    except (lzma.LZMAError, OSError, ValueError, zstandard.ZstdError) as e:
+        raise PayloadError(f"Failed to decompress operation data: {e}")
     if len(r) != size:
-        print(f"Unexpected size {len(r)} {size}")
-    elif hashlib.sha256(data).digest() != hash:
-        print("Hash mismatch")
+        raise PayloadError(f"Unexpected size {len(r)} {size}")
+    elif hash and hashlib.sha256(data).digest() != hash:
+        raise PayloadError("Operation data hash mismatch")
     return r
 
 
-def parse_payload(payload_f, partition, out_f):
-    BLOCK_SIZE = 4096
-    for operation in partition.operations:
-        e = operation.dst_extents[0]
+def verify_partition_image(fname, partition_hash):
+    image_hash = hashlib.sha256()
+    with open(fname, "rb") as f:
+        while True:
+            data = f.read(VERIFY_CHUNK_SIZE)
+            if not data:
+                break
+            image_hash.update(data)
+
+    if image_hash.digest() != partition_hash:
+        raise PayloadError(f"Hash mismatch in {fname.name}")
+
+
+def get_partition_size(partition, block_size):
+    if partition.new_partition_info.size:
+        return partition.new_partition_info.size
+
+    return (
+        max(
+            (e.start_block + e.num_blocks for op in partition.operations for e in op.dst_extents),
+            default=0,
+        )
+        * block_size
+    )
+
+
+def write_extents(out_fd, extents, data, block_size):
+    """Write data to the extents, in order."""
+    data = memoryview(data)
+    for e in extents:
+        length = e.num_blocks * block_size
+        os.pwrite(out_fd, data[:length], e.start_block * block_size)
+        data = data[length:]
+
+
+def parse_operation(payload_f, operation, out_fd, block_size):
+    dst_length = sum(e.num_blocks for e in operation.dst_extents) * block_size
+    if operation.type == update_metadata_pb2.InstallOperation.REPLACE:
         data = payload_f.ReadDataBlob(operation.data_offset, operation.data_length)
-        out_f.seek(e.start_block * BLOCK_SIZE)
-        if operation.type == update_metadata_pb2.InstallOperation.REPLACE:
-            out_f.write(data)
-        elif operation.type == update_metadata_pb2.InstallOperation.REPLACE_XZ:
-            r = decompress_payload(
-                "xzcat", data, e.num_blocks * BLOCK_SIZE, operation.data_sha256_hash
-            )
-            out_f.write(r)
-        elif operation.type == update_metadata_pb2.InstallOperation.REPLACE_BZ:
-            r = decompress_payload(
-                "bzcat", data, e.num_blocks * BLOCK_SIZE, operation.data_sha256_hash
-            )
-            out_f.write(r)
-        elif operation.type == update_metadata_pb2.InstallOperation.ZERO:
-            out_f.write(b"\x00" * (e.num_blocks * BLOCK_SIZE))
-        else:
-            raise PayloadError(
-                f"Unhandled operation type ({operation.type} - {update_metadata_pb2.InstallOperation.Type.Name(operation.type)})"
-            )
+        write_extents(out_fd, operation.dst_extents, data, block_size)
+    elif operation.type in (
+        update_metadata_pb2.InstallOperation.REPLACE_XZ,
+        update_metadata_pb2.InstallOperation.REPLACE_BZ,
+        update_metadata_pb2.InstallOperation.ZSTD,
+    ):
+        data = payload_f.ReadDataBlob(operation.data_offset, operation.data_length)
+        r = decompress_payload(operation.type, data, dst_length, operation.data_sha256_hash)
+        write_extents(out_fd, operation.dst_extents, r, block_size)
+    elif operation.type in (
+        update_metadata_pb2.InstallOperation.ZERO,
+        update_metadata_pb2.InstallOperation.DISCARD,
+    ):
+        # The output file is preallocated, the extents are already holes
+        pass
+    else:
+        raise PayloadError(
+            f"Unhandled operation type ({operation.type} - {update_metadata_pb2.InstallOperation.Type.Name(operation.type)})"
+        )
+
+
+def get_payload_partitions(filename: Path, offset: int = 0):
+    """Get the names of the partitions in a payload, only its manifest is read."""
+    with open(filename, "rb") as payload_file:
+        payload = Payload(payload_file, offset)
+        payload.Init()
+
+    return [p.partition_name for p in payload.manifest.partitions]
+
+
+def extract_android_ota_payload(
+    filename: Path,
+    output_dir: Path,
+    jobs: Optional[int] = None,
+    offset: int = 0,
+    partition_filter: Optional[Callable[[str], bool]] = None,
+    restore_partition: Optional[Callable[[str, bytes], bool]] = None,
+    executor: Optional[Executor] = None,
+    on_partition_extracted: Optional[Callable[[str, bytes], None]] = None,
+    verify: bool = False,
+):
+    """
+    Extract all the partitions from a payload.
+
+    offset is where the payload starts inside the file, this allows reading
+    a payload stored uncompressed in an OTA zip without extracting it.
+
+    If partition_filter is set, only the partitions it accepts are extracted.
+
+    If restore_partition is set, it's called with the name and the expected
+    SHA-256 of each partition image, when it returns True the image has
+    already been put in output_dir (e.g. from a cache) and isn't extracted.
+
+    Returns the expected SHA-256 of each extracted partition image.
+
+    Operations target disjoint extents, so up to jobs of them (from any
+    partition) are decoded at the same time and written with positional
+    writes into preallocated images.
+    If executor is set, operations are run in it instead of a new pool
+    of jobs workers.
+
+    If on_partition_extracted is set, it's called with the name and the
+    expected SHA-256 of each partition image as soon as it's complete
+    (restored ones included), while the other ones are still extracted.
 
+    If verify is set, each extracted image is checked against its expected
+    SHA-256 before being reported, PayloadError is raised on a mismatch.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
 
-def extract_android_ota_payload(filename: Path, output_dir: Path):
-    payload_file = open(filename, "rb")
+    with open(filename, "rb") as payload_file:
+        payload = MmapPayload(payload_file, offset)
+        payload.Init()
 
-    payload = Payload(payload_file)
-    payload.Init()
+        block_size = payload.manifest.block_size
+
+        out_files = {}
+        hashes = {}
+        futures = {}
+        remaining_operations = {}
+        failed = set()
+
+        def partition_complete(fname):
+            name, partition_hash = hashes[fname]
+            if verify and partition_hash:
+                verify_partition_image(fname, partition_hash)
+            if on_partition_extracted:
+                on_partition_extracted(name, partition_hash)
 
-    for p in payload.manifest.partitions:
-        name = f"{p.partition_name}.img"
-        print(f"Extracting '{name}'")
-        fname = output_dir / name
-        out_f = open(fname, "wb")
         try:
-            parse_payload(payload, p, out_f)
-        except PayloadError as e:
-            print(f"Failed: {e}")
-            out_f.close()
+            with (
+                ThreadPoolExecutor(max_workers=jobs) if executor is None else nullcontext(executor)
+            ) as executor:
+                for p in payload.manifest.partitions:
+                    if partition_filter and not partition_filter(p.partition_name):
+                        print(f"Skipping '{p.partition_name}'")
+                        continue
+
+                    partition_hash = bytes(p.new_partition_info.hash)
+                    if (
+                        restore_partition
+                        and partition_hash
+                        and restore_partition(p.partition_name, partition_hash)
+                    ):
+                        print(f"Reusing '{p.partition_name}'")
+                        if on_partition_extracted:
+                            on_partition_extracted(p.partition_name, partition_hash)
+                        continue
+
+                    name = f"{p.partition_name}.img"
+                    print(f"Extracting '{name}'")
+                    fname = output_dir / name
+                    out_f = open(fname, "wb")
+                    out_f.truncate(get_partition_size(p, block_size))
+                    out_files[fname] = out_f
+                    hashes[fname] = (p.partition_name, partition_hash)
+
+                    remaining_operations[fname] = len(p.operations)
+                    for operation in p.operations:
+                        future = executor.submit(
+                            parse_operation, payload, operation, out_f.fileno(), block_size
+                        )
+                        futures[future] = fname
+
+                    if not p.operations:
+                        partition_complete(fname)
+
+                for future in as_completed(futures):
+                    fname = futures[future]
+                    remaining_operations[fname] -= 1
+                    try:
+                        future.result()
+                    except PayloadError as e:
+                        if fname not in failed:
+                            print(f"Failed: {e}")
+                            failed.add(fname)
+                    else:
+                        if not remaining_operations[fname] and fname not in failed:
+                            partition_complete(fname)
+        finally:
+            # Operations may still be running in a shared executor
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+            for out_f in out_files.values():
+                out_f.close()
+
+            futures.clear()
+            payload.close()
+
+        for fname in failed:
             os.unlink(fname)
+
+        return {
+            name: partition_hash
+            for fname, (name, partition_hash) in hashes.items()
+            if fname not in failed
+        }
@@ -10,131 +10,238 @@
 #          DATE: 2018-10-27 10:33:21 CEST
 # ====================================================
 
-from __future__ import print_function
-import sys
 import os
-import errno
+import sys
+from pathlib import Path
+from sebaubuntu_libs.liblogging import LOGD
+from typing import BinaryIO, List, Tuple, Union
+
+BLOCK_SIZE = 4096
+
+# Maximum amount of data copied at once when the kernel can't do it for us
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+TRANSFER_LIST_VERSIONS = {
+    1: "Android Lollipop 5.0",
+    2: "Android Lollipop 5.1",
+    3: "Android Marshmallow 6.x",
+    4: "Android Nougat 7.x / Oreo 8.x",
+}
+
+
+class Sdat2ImgError(Exception):
+    pass
+
+
+class TransferList:
+    """A parsed transfer list."""
+
+    def __init__(
+        self, version: int, new_blocks: int, commands: List[Tuple[str, List[Tuple[int, int]]]]
+    ):
+        self.version = version
+        self.new_blocks = new_blocks
+        self.commands = commands
+
+    def get_size(self):
+        """Get the size of the output image in bytes."""
+        return (
+            max(
+                (end for _, ranges in self.commands for _, end in ranges),
+                default=0,
+            )
+            * BLOCK_SIZE
+        )
+
+    @staticmethod
+    def parse_rangeset(src: str):
+        num_set = [int(item) for item in src.split(",")]
+        if len(num_set) != num_set[0] + 1:
+            raise Sdat2ImgError(f"Error on parsing following data to rangeset: {src}")
+
+        return [(num_set[i], num_set[i + 1]) for i in range(1, len(num_set), 2)]
+
+    @classmethod
+    def from_file(cls, path: Path):
+        with open(path, "r") as trans_list:
+            # First line in transfer list is the version number
+            version = int(trans_list.readline())
+
+            # Second line in transfer list is the total number of blocks we expect to write
+            new_blocks = int(trans_list.readline())
+
+            if version >= 2:
+                # Third line is how many stash entries are needed simultaneously
+                trans_list.readline()
+                # Fourth line is the maximum number of blocks that will be stashed simultaneously
+                trans_list.readline()
+
+            # Subsequent lines are all individual transfer commands
+            commands = []
+            for line in trans_list:
+                line = line.split(" ")
+                cmd = line[0]
+                if cmd in ["erase", "new", "zero"]:
+                    commands.append((cmd, cls.parse_rangeset(line[1])))
+                # Skip lines starting with numbers, they are not commands anyway
+                elif not cmd[0].isdigit():
+                    raise Sdat2ImgError(f'Command "{cmd.strip()}" is not valid')
 
+        return cls(version, new_blocks, commands)
 
-def main(TRANSFER_LIST_FILE, NEW_DATA_FILE, OUTPUT_IMAGE_FILE):
-    __version__ = "1.2"
 
-    print("sdat2img binary - version: {}\n".format(__version__))
+class Sdat2ImgResult:
+    """The result of a sdat2img conversion."""
+
+    def __init__(self, version: int, blocks_written: int, size: int):
+        self.version = version
+        self.blocks_written = blocks_written
+        self.size = size
+
+    def __str__(self):
+        return (
+            f"version: {self.version}\nblocks written: {self.blocks_written}\nsize: {self.size}\n"
+        )
+
+
+def _copy_range(
+    new_data_file: BinaryIO,
+    new_data_offset: int,
+    output_fd: int,
+    output_offset: int,
+    length: int,
+    use_copy_file_range: bool,
+):
+    """
+    Copy length bytes of new data to output_offset.
+
+    Returns whether copy_file_range() can still be used.
+    """
+    if use_copy_file_range:
+        try:
+            while length > 0:
+                copied = os.copy_file_range(
+                    new_data_file.fileno(), output_fd, length, new_data_offset, output_offset
+                )
+                if copied == 0:
+                    raise Sdat2ImgError("New data file is too short")
+
+                new_data_offset += copied
+                output_offset += copied
+                length -= copied
+
+            return True
+        except OSError:
+            # Not supported between these files, fall back to userspace copies
+            pass
+
+    new_data_file.seek(new_data_offset)
+    while length > 0:
+        buffer = new_data_file.read(min(length, COPY_BUFFER_SIZE))
+        if not buffer:
+            raise Sdat2ImgError("New data file is too short")
+
+        os.pwrite(output_fd, buffer, output_offset)
+        output_offset += len(buffer)
+        length -= len(buffer)
+
+    return False
+
+
+def _copy_stream(new_data_file: BinaryIO, output_fd: int, output_offset: int, length: int):
+    """Copy length bytes from a non seekable stream to output_offset."""
+    while length > 0:
+        buffer = new_data_file.read(min(length, COPY_BUFFER_SIZE))
+        if not buffer:
+            raise Sdat2ImgError("New data stream is too short")
+
+        os.pwrite(output_fd, buffer, output_offset)
+        output_offset += len(buffer)
+        length -= len(buffer)
+
+
+def sdat2img(transfer_list_file: Path, new_data: Union[Path, BinaryIO], output_image_file: Path):
+    """
+    Convert a sparse data image to a raw image.
+
+    new_data can either be the path of a .new.dat file or an already opened
+    stream (e.g. a decompressor), which is read sequentially.
+
+    Each range of a new command is copied at once (using copy_file_range()
+    when possible), while erase and zero ranges are left as holes.
+    """
+    transfer_list = TransferList.from_file(transfer_list_file)
+
+    LOGD(
+        f"Transfer list version {transfer_list.version} "
+        f"({TRANSFER_LIST_VERSIONS.get(transfer_list.version, 'Unknown Android version')})"
+    )
+
+    size = transfer_list.get_size()
+    blocks_written = 0
+
+    new_data_file = open(new_data, "rb") if isinstance(new_data, Path) else new_data
 
-    def rangeset(src):
-        src_set = src.split(",")
-        num_set = [int(item) for item in src_set]
-        if len(num_set) != num_set[0] + 1:
-            print("Error on parsing following data to rangeset:\n{}".format(src), file=sys.stderr)
-            sys.exit(1)
-
-        return tuple([(num_set[i], num_set[i + 1]) for i in range(1, len(num_set), 2)])
-
-    def parse_transfer_list_file(path):
-        trans_list = open(TRANSFER_LIST_FILE, "r")
-
-        # First line in transfer list is the version number
-        version = int(trans_list.readline())
-
-        # Second line in transfer list is the total number of blocks we expect to write
-        new_blocks = int(trans_list.readline())
-
-        if version >= 2:
-            # Third line is how many stash entries are needed simultaneously
-            trans_list.readline()
-            # Fourth line is the maximum number of blocks that will be stashed simultaneously
-            trans_list.readline()
-
-        # Subsequent lines are all individual transfer commands
-        commands = []
-        for line in trans_list:
-            line = line.split(" ")
-            cmd = line[0]
-            if cmd in ["erase", "new", "zero"]:
-                commands.append([cmd, rangeset(line[1])])
-            else:
-                # Skip lines starting with numbers, they are not commands anyway
-                if not cmd[0].isdigit():
-                    print('Command "{}" is not valid.'.format(cmd), file=sys.stderr)
-                    trans_list.close()
-                    sys.exit(1)
-
-        trans_list.close()
-        return version, new_blocks, commands
-
-    BLOCK_SIZE = 4096
-
-    version, new_blocks, commands = parse_transfer_list_file(TRANSFER_LIST_FILE)
-
-    if version == 1:
-        print("Android Lollipop 5.0 detected!\n")
-    elif version == 2:
-        print("Android Lollipop 5.1 detected!\n")
-    elif version == 3:
-        print("Android Marshmallow 6.x detected!\n")
-    elif version == 4:
-        print("Android Nougat 7.x / Oreo 8.x detected!\n")
-    else:
-        print("Unknown Android version!\n")
-
-    # Don't clobber existing files to avoid accidental data loss
     try:
-        output_img = open(OUTPUT_IMAGE_FILE, "wb")
-    except IOError as e:
-        if e.errno == errno.EEXIST:
-            print('Error: the output file "{}" already exists'.format(e.filename), file=sys.stderr)
-            print("Remove it, rename it, or choose a different file name.", file=sys.stderr)
-            sys.exit(e.errno)
-        else:
-            raise
-
-    new_data_file = open(NEW_DATA_FILE, "rb")
-    all_block_sets = [i for command in commands for i in command[1]]
-    max_file_size = max(pair[1] for pair in all_block_sets) * BLOCK_SIZE
-
-    for command in commands:
-        if command[0] == "new":
-            for block in command[1]:
-                begin = block[0]
-                end = block[1]
-                block_count = end - begin
-                print("Copying {} blocks into position {}...".format(block_count, begin))
-
-                # Position output file
-                output_img.seek(begin * BLOCK_SIZE)
-
-                # Copy one block at a time
-                while block_count > 0:
-                    output_img.write(new_data_file.read(BLOCK_SIZE))
-                    block_count -= 1
-        else:
-            print("Skipping command {}...".format(command[0]))
-
-    # Make file larger if necessary
-    if output_img.tell() < max_file_size:
-        output_img.truncate(max_file_size)
-
-    output_img.close()
-    new_data_file.close()
-    print("Done! Output image: {}".format(os.path.realpath(output_img.name)))
+        # Only regular files can be copied by the kernel
+        use_copy_file_range = hasattr(os, "copy_file_range") and isinstance(new_data, Path)
+        new_data_offset = 0
+
+        with open(output_image_file, "wb") as output_image:
+            output_fd = output_image.fileno()
+
+            for cmd, ranges in transfer_list.commands:
+                if cmd != "new":
+                    continue
+
+                for begin, end in ranges:
+                    length = (end - begin) * BLOCK_SIZE
+
+                    if isinstance(new_data, Path):
+                        use_copy_file_range = _copy_range(
+                            new_data_file,
+                            new_data_offset,
+                            output_fd,
+                            begin * BLOCK_SIZE,
+                            length,
+                            use_copy_file_range,
+                        )
+                    else:
+                        _copy_stream(new_data_file, output_fd, begin * BLOCK_SIZE, length)
+
+                    new_data_offset += length
+                    blocks_written += end - begin
+
+            # Make file larger if necessary, unwritten ranges are holes
+            output_image.truncate(size)
+    finally:
+        if new_data_file is not new_data:
+            new_data_file.close()
+
+    return Sdat2ImgResult(transfer_list.version, blocks_written, size)
 
 
 if __name__ == "__main__":
     try:
-        TRANSFER_LIST_FILE = str(sys.argv[1])
-        NEW_DATA_FILE = str(sys.argv[2])
+        TRANSFER_LIST_FILE = Path(sys.argv[1])
+        NEW_DATA_FILE = Path(sys.argv[2])
     except IndexError:
         print("\nUsage: sdat2img.py <transfer_list> <system_new_file> [system_img]\n")
         print("    <transfer_list>: transfer list file")
         print("    <system_new_file>: system new dat file")
         print("    [system_img]: output system image\n\n")
-        print("Visit xda thread for more information.\n")
-        input("Press ENTER to exit...")
-        sys.exit()
+        sys.exit(1)
 
     try:
-        OUTPUT_IMAGE_FILE = str(sys.argv[3])
+        OUTPUT_IMAGE_FILE = Path(sys.argv[3])
     except IndexError:
-        OUTPUT_IMAGE_FILE = "system.img"
+        OUTPUT_IMAGE_FILE = Path("system.img")
+
+    try:
+        result = sdat2img(TRANSFER_LIST_FILE, NEW_DATA_FILE, OUTPUT_IMAGE_FILE)
+    except Sdat2ImgError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
-    main(TRANSFER_LIST_FILE, NEW_DATA_FILE, OUTPUT_IMAGE_FILE)
+    print(result)
+    print(f"Done! Output image: {os.path.realpath(OUTPUT_IMAGE_FILE)}")
@@ -6,9 +6,10 @@
 
 from sebaubuntu_libs.liblogging import LOGW
 from shutil import which
-from subprocess import STDOUT, check_output
 from typing import List
 
+from dumpyara.utils.stats import check_tool_output
+
 SEVEN_ZIP_EXECUTABLE = "7zz"
 P7ZIP_EXECUTABLE = "7z"
 
@@ -32,7 +33,7 @@ def get_sevenzip_command():
 
 
 def sevenzip(commands: List[str]):
-    return check_output([get_sevenzip_command(), *commands], stderr=STDOUT)
+    return check_tool_output([get_sevenzip_command(), *commands])
 
 
 def unpack_sevenzip(filename: str, work_dir: str):
@@ -0,0 +1,363 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""Android sparse image decoder."""
+
+import os
+from bisect import bisect_right
+from io import SEEK_CUR, SEEK_END, SEEK_SET, RawIOBase
+from pathlib import Path
+from struct import Struct
+from typing import BinaryIO, Iterator, List, Tuple
+
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+CHUNK_TYPE_CRC32 = 0xCAC4
+
+# magic, major_version, minor_version, file_hdr_sz, chunk_hdr_sz,
+# blk_sz, total_blks, total_chunks, image_checksum
+SPARSE_HEADER = Struct("<IHHHHIIII")
+
+# chunk_type, reserved1, chunk_sz, total_sz
+CHUNK_HEADER = Struct("<HHII")
+
+# Size of the buffer used to copy RAW chunks
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class SparseImageError(Exception):
+    pass
+
+
+def is_sparse_image(image: Path):
+    """Check whether a file is an Android sparse image."""
+    with image.open("rb") as f:
+        header = f.read(4)
+
+    return len(header) == 4 and int.from_bytes(header, "little") == SPARSE_HEADER_MAGIC
+
+
+def copy_file_data(in_fd: int, out_fd: int, length: int, in_offset: int, out_offset: int):
+    """
+    Copy length bytes between two files at the given offsets.
+
+    copy_file_range() is used when possible, so that the kernel (or the
+    filesystem, with reflinks) does the copy.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            while length > 0:
+                copied = os.copy_file_range(in_fd, out_fd, length, in_offset, out_offset)
+                if copied == 0:
+                    raise SparseImageError("Unexpected end of file")
+
+                in_offset += copied
+                out_offset += copied
+                length -= copied
+
+            return
+        except OSError:
+            # Not supported between these files, fall back to userspace copies
+            pass
+
+    while length > 0:
+        buffer = os.pread(in_fd, min(length, COPY_BUFFER_SIZE), in_offset)
+        if not buffer:
+            raise SparseImageError("Unexpected end of file")
+
+        os.pwrite(out_fd, buffer, out_offset)
+        in_offset += len(buffer)
+        out_offset += len(buffer)
+        length -= len(buffer)
+
+
+def _read_header(sparse_file: BinaryIO):
+    """Read the sparse header, leaving the file at the first chunk header."""
+    header = sparse_file.read(SPARSE_HEADER.size)
+    if len(header) != SPARSE_HEADER.size:
+        raise SparseImageError("Truncated sparse header")
+
+    (
+        magic,
+        major_version,
+        _,
+        file_hdr_sz,
+        chunk_hdr_sz,
+        blk_sz,
+        total_blks,
+        total_chunks,
+        _,
+    ) = SPARSE_HEADER.unpack(header)
+
+    if magic != SPARSE_HEADER_MAGIC:
+        raise SparseImageError(f"Invalid sparse magic: {magic:#x}")
+
+    if major_version != 1:
+        raise SparseImageError(f"Unsupported sparse version ({major_version})")
+
+    # Headers may be larger than what we know about, skip the rest
+    sparse_file.seek(file_hdr_sz, SEEK_SET)
+
+    return chunk_hdr_sz, blk_sz, total_blks, total_chunks
+
+
+def _unsparse(sparse_file: BinaryIO, output_file: BinaryIO, write_zero_fills: bool):
+    chunk_hdr_sz, blk_sz, total_blks, total_chunks = _read_header(sparse_file)
+
+    offset = 0
+    for _ in range(total_chunks):
+        chunk_header = sparse_file.read(chunk_hdr_sz)
+        if len(chunk_header) != chunk_hdr_sz:
+            raise SparseImageError("Truncated chunk header")
+
+        chunk_type, _, chunk_sz, total_sz = CHUNK_HEADER.unpack(chunk_header[: CHUNK_HEADER.size])
+        data_sz = total_sz - chunk_hdr_sz
+        chunk_len = chunk_sz * blk_sz
+
+        if chunk_type == CHUNK_TYPE_RAW:
+            if data_sz != chunk_len:
+                raise SparseImageError(f"Invalid RAW chunk size ({data_sz} != {chunk_len})")
+
+            output_file.seek(offset, SEEK_SET)
+            remaining = chunk_len
+            while remaining > 0:
+                buffer = sparse_file.read(min(remaining, COPY_BUFFER_SIZE))
+                if not buffer:
+                    raise SparseImageError("Truncated RAW chunk")
+
+                output_file.write(buffer)
+                remaining -= len(buffer)
+        elif chunk_type == CHUNK_TYPE_FILL:
+            if data_sz != 4:
+                raise SparseImageError(f"Invalid FILL chunk size ({data_sz} != 4)")
+
+            fill = sparse_file.read(4)
+
+            # A zero fill over a fresh file is a hole
+            if fill != b"\x00\x00\x00\x00" or write_zero_fills:
+                output_file.seek(offset, SEEK_SET)
+                buffer = fill * (min(chunk_len, COPY_BUFFER_SIZE) // 4)
+                remaining = chunk_len
+                while remaining > 0:
+                    remaining -= output_file.write(buffer[:remaining])
+        elif chunk_type == CHUNK_TYPE_DONT_CARE:
+            pass
+        elif chunk_type == CHUNK_TYPE_CRC32:
+            sparse_file.seek(data_sz, SEEK_CUR)
+            continue
+        else:
+            raise SparseImageError(f"Unknown chunk type: {chunk_type:#x}")
+
+        offset += chunk_len
+
+    if offset != total_blks * blk_sz:
+        raise SparseImageError(f"Chunks cover {offset} bytes, expected {total_blks * blk_sz}")
+
+    return total_blks * blk_sz
+
+
+def unsparse_images(sparse_images: List[Path], output_image: Path):
+    """
+    Convert one or more sparse images to a single raw image.
+
+    Multiple images (e.g. sparsechunks) are written on top of each other,
+    like a single logical stream. DONT_CARE and zero FILL chunks are left
+    as holes, so the output file stays sparse on disk.
+    """
+    size = 0
+
+    with output_image.open("wb") as output_file:
+        for index, sparse_image in enumerate(sparse_images):
+            with sparse_image.open("rb") as sparse_file:
+                # Holes are only zeroes as long as nothing has been written there
+                size = max(size, _unsparse(sparse_file, output_file, write_zero_fills=index > 0))
+
+        output_file.truncate(size)
+
+    return output_image
+
+
+class SparseChunk:
+    """
+    A chunk of a sparse image.
+
+    offset and size are in the raw image, data_offset is the position of
+    the RAW data in the sparse file and fill is the FILL pattern.
+    """
+
+    def __init__(self, chunk_type: int, offset: int, size: int, data_offset: int, fill: bytes):
+        self.chunk_type = chunk_type
+        self.offset = offset
+        self.size = size
+        self.data_offset = data_offset
+        self.fill = fill
+
+    def is_zero(self):
+        """Check whether this chunk only contains zeroes."""
+        return self.chunk_type == CHUNK_TYPE_DONT_CARE or (
+            self.chunk_type == CHUNK_TYPE_FILL and self.fill == b"\x00\x00\x00\x00"
+        )
+
+
+def _read_chunks(sparse_file: BinaryIO):
+    """Read all the chunk headers of a sparse image, skipping the data."""
+    chunk_hdr_sz, blk_sz, total_blks, total_chunks = _read_header(sparse_file)
+
+    chunks: List[SparseChunk] = []
+    offset = 0
+    for _ in range(total_chunks):
+        chunk_header = sparse_file.read(chunk_hdr_sz)
+        if len(chunk_header) != chunk_hdr_sz:
+            raise SparseImageError("Truncated chunk header")
+
+        chunk_type, _, chunk_sz, total_sz = CHUNK_HEADER.unpack(chunk_header[: CHUNK_HEADER.size])
+        data_sz = total_sz - chunk_hdr_sz
+        chunk_len = chunk_sz * blk_sz
+
+        fill = b""
+        if chunk_type == CHUNK_TYPE_RAW:
+            if data_sz != chunk_len:
+                raise SparseImageError(f"Invalid RAW chunk size ({data_sz} != {chunk_len})")
+        elif chunk_type == CHUNK_TYPE_FILL:
+            if data_sz != 4:
+                raise SparseImageError(f"Invalid FILL chunk size ({data_sz} != 4)")
+
+            fill = sparse_file.read(4)
+            data_sz = 0
+        elif chunk_type == CHUNK_TYPE_CRC32:
+            sparse_file.seek(data_sz, SEEK_CUR)
+            continue
+        elif chunk_type != CHUNK_TYPE_DONT_CARE:
+            raise SparseImageError(f"Unknown chunk type: {chunk_type:#x}")
+
+        if chunk_len:
+            chunks.append(SparseChunk(chunk_type, offset, chunk_len, sparse_file.tell(), fill))
+
+        sparse_file.seek(data_sz, SEEK_CUR)
+        offset += chunk_len
+
+    if offset != total_blks * blk_sz:
+        raise SparseImageError(f"Chunks cover {offset} bytes, expected {total_blks * blk_sz}")
+
+    return chunks, total_blks * blk_sz
+
+
+class SparseImage(RawIOBase):
+    """
+    Read-only view of the raw content of a sparse image.
+
+    Only the chunk headers are read when opening the image, data is read
+    on demand from the sparse file, so any part of the raw image can be
+    accessed without unsparsing it first.
+    """
+
+    def __init__(self, image: Path):
+        super().__init__()
+
+        self._file = image.open("rb")
+        try:
+            self.chunks, self.size = _read_chunks(self._file)
+        except Exception:
+            self._file.close()
+            raise
+
+        self._chunk_offsets = [chunk.offset for chunk in self.chunks]
+        self._position = 0
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset: int, whence: int = SEEK_SET):
+        if whence == SEEK_SET:
+            self._position = offset
+        elif whence == SEEK_CUR:
+            self._position += offset
+        elif whence == SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def get_chunks(self, offset: int, length: int) -> Iterator[Tuple[SparseChunk, int, int]]:
+        """
+        Get the chunks covering a range of the raw image.
+
+        Yields (chunk, offset in the chunk, length) tuples.
+        """
+        index = bisect_right(self._chunk_offsets, offset) - 1
+        end = min(offset + length, self.size)
+
+        while offset < end and index < len(self.chunks):
+            chunk = self.chunks[index]
+            chunk_offset = offset - chunk.offset
+            chunk_length = min(chunk.size - chunk_offset, end - offset)
+
+            yield chunk, chunk_offset, chunk_length
+
+            offset += chunk_length
+            index += 1
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        written = 0
+
+        for chunk, chunk_offset, length in self.get_chunks(self._position, len(view)):
+            if chunk.chunk_type == CHUNK_TYPE_RAW:
+                data = os.pread(self._file.fileno(), length, chunk.data_offset + chunk_offset)
+                if len(data) != length:
+                    raise SparseImageError("Truncated RAW chunk")
+            elif chunk.chunk_type == CHUNK_TYPE_FILL:
+                start = chunk_offset % 4
+                data = (chunk.fill * ((start + length) // 4 + 1))[start : start + length]
+            else:
+                data = bytes(length)
+
+            view[written : written + length] = data
+            written += length
+
+        self._position += written
+
+        return written
+
+    def copy_to(self, output_fd: int, offset: int, output_offset: int, length: int):
+        """
+        Copy a range of the raw image to output_offset of a file.
+
+        The output file is expected to be zero filled in that range
+        (e.g. freshly truncated), zero chunks are left as holes.
+        """
+        for chunk, chunk_offset, chunk_length in self.get_chunks(offset, length):
+            chunk_output_offset = output_offset + chunk.offset + chunk_offset - offset
+
+            if chunk.chunk_type == CHUNK_TYPE_RAW:
+                copy_file_data(
+                    self._file.fileno(),
+                    output_fd,
+                    chunk_length,
+                    chunk.data_offset + chunk_offset,
+                    chunk_output_offset,
+                )
+            elif not chunk.is_zero():
+                start = chunk_offset % 4
+                buffer = chunk.fill * (min(chunk_length, COPY_BUFFER_SIZE) // 4 + 2)
+                remaining = chunk_length
+                while remaining > 0:
+                    data = buffer[start : start + min(remaining, COPY_BUFFER_SIZE)]
+                    os.pwrite(output_fd, data, chunk_output_offset)
+                    chunk_output_offset += len(data)
+                    remaining -= len(data)
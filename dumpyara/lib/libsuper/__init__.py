@@ -0,0 +1,182 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+"""Super image (dynamic partitions) extractor."""
+
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+from liblp import (
+    LP_SECTOR_SIZE,
+    LP_TARGET_TYPE_LINEAR,
+    LP_TARGET_TYPE_ZERO,
+    GetPartitionName,
+    IPartitionOpener,
+    LpMetadata,
+    ReadMetadata,
+)
+from os import cpu_count
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+from dumpyara.lib.libsparse import SparseImage, copy_file_data, is_sparse_image
+
+
+class SuperImageError(Exception):
+    pass
+
+
+class LogicalPartition:
+    """
+    A logical partition inside a super image.
+
+    extents is a list of (super offset, partition offset, size) tuples,
+    ranges of the partition not covered by them are zeroes.
+    """
+
+    def __init__(self, name: str, size: int, extents: List[Tuple[int, int, int]]):
+        self.name = name
+        self.size = size
+        self.extents = extents
+
+
+class _SuperImageOpener(IPartitionOpener):
+    """Opener that lets liblp read the metadata from an already opened super image."""
+
+    def __init__(self, super_file: Union[BinaryIO, SparseImage]):
+        self.super_file = super_file
+
+    def Open(self, partition_name: str, flags):  # type: ignore
+        return self.super_file
+
+
+def open_super_image(image: Path) -> Union[BinaryIO, SparseImage]:
+    """Open a super image for reading, sparse images are read without unsparsing them."""
+    if is_sparse_image(image):
+        return SparseImage(image)
+
+    return image.open("rb")
+
+
+def get_logical_partitions(metadata: LpMetadata):
+    """Get the logical partitions described by the metadata."""
+    partitions: List[LogicalPartition] = []
+
+    for partition in metadata.partitions:
+        name = GetPartitionName(partition)
+        extents: List[Tuple[int, int, int]] = []
+        size = 0
+
+        for index in range(
+            partition.first_extent_index, partition.first_extent_index + partition.num_extents
+        ):
+            extent = metadata.extents[index]
+            extent_size = extent.num_sectors * LP_SECTOR_SIZE
+
+            if extent.target_type == LP_TARGET_TYPE_LINEAR:
+                # Other block devices are different files
+                if extent.target_source != 0:
+                    raise SuperImageError(f"{name} is on a split super device")
+
+                extents.append((extent.target_data * LP_SECTOR_SIZE, size, extent_size))
+            elif extent.target_type != LP_TARGET_TYPE_ZERO:
+                raise SuperImageError(f"Unsupported target type in extent: {extent.target_type}")
+
+            size += extent_size
+
+        partitions.append(LogicalPartition(name, size, extents))
+
+    return partitions
+
+
+def _read_metadata(image: Path, super_file: Union[BinaryIO, SparseImage], slot: int):
+    try:
+        return ReadMetadata(image.name, slot, _SuperImageOpener(super_file))
+    except Exception as e:
+        raise SuperImageError(f"Failed to read metadata of {image.name}: {e}") from e
+
+
+def get_super_image_partitions(image: Path, slot: int = 0):
+    """Get the names of the logical partitions extract_super_image() would extract."""
+    with open_super_image(image) as super_file:
+        metadata = _read_metadata(image, super_file, slot)
+
+    return [partition.name for partition in get_logical_partitions(metadata) if partition.size > 0]
+
+
+def _extract_logical_partition(
+    super_file: Union[BinaryIO, SparseImage], partition: LogicalPartition, output_image: Path
+):
+    with output_image.open("wb") as f:
+        # Everything that isn't written is a hole
+        f.truncate(partition.size)
+
+        for super_offset, partition_offset, size in partition.extents:
+            if isinstance(super_file, SparseImage):
+                super_file.copy_to(f.fileno(), super_offset, partition_offset, size)
+            else:
+                copy_file_data(
+                    super_file.fileno(), f.fileno(), size, super_offset, partition_offset
+                )
+
+
+def extract_super_image(
+    image: Path,
+    output_dir: Path,
+    jobs: Optional[int] = None,
+    partition_filter: Optional[Callable[[str], bool]] = None,
+    slot: int = 0,
+    executor: Optional[Executor] = None,
+    on_partition_extracted: Optional[Callable[[str], None]] = None,
+):
+    """
+    Extract the logical partitions of a super image.
+
+    Only the metadata is parsed, then each partition is copied straight
+    from its extents in the super image (with copy_file_range() when
+    possible), sparse super images don't need to be unsparsed first.
+    Empty partitions (e.g. the inactive slot) are skipped.
+    If executor is set, partitions are extracted in it instead of a new
+    pool of jobs workers.
+    If on_partition_extracted is set, it's called with the name of each
+    partition as soon as its image is complete.
+
+    Returns the list of extracted partitions.
+    """
+    if jobs is None:
+        jobs = cpu_count() or 1
+
+    with open_super_image(image) as super_file:
+        metadata = _read_metadata(image, super_file, slot)
+
+        partitions = [
+            partition
+            for partition in get_logical_partitions(metadata)
+            if partition.size > 0 and (partition_filter is None or partition_filter(partition.name))
+        ]
+
+        futures: Dict[Future, str] = {}
+        try:
+            with (
+                ThreadPoolExecutor(max_workers=jobs) if executor is None else nullcontext(executor)
+            ) as executor:
+                for partition in partitions:
+                    future = executor.submit(
+                        _extract_logical_partition,
+                        super_file,
+                        partition,
+                        output_dir / f"{partition.name}.img",
+                    )
+                    futures[future] = partition.name
+
+                for future in as_completed(futures):
+                    future.result()
+                    if on_partition_extracted:
+                        on_partition_extracted(futures[future])
+        finally:
+            # Don't close the super image while a shared executor is still reading it
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+    return [partition.name for partition in partitions]
@@ -3,38 +3,224 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 #
 
-from argparse import ArgumentParser
+import sys
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from os import cpu_count
+from dumpyara.batch import dumpyara_batch, get_batch_files, get_batch_summary
 from dumpyara.dumpyara import dumpyara
+from dumpyara.utils.cache import DumpCache
+from dumpyara.utils.partitions import PartitionFilter, is_known_partition
+from dumpyara.utils.stats import DumpStats
 from dumpyara.utils.shutil import setup_shutil_formats
 from pathlib import Path
 from sebaubuntu_libs.liblocale import setup_locale
 from sebaubuntu_libs.liblogging import setup_logging
 
 
-def main():
-    parser = ArgumentParser(description="Dumpyara")
+def partition_list(value: str):
+    """Parse a comma separated list of partitions, rejecting unknown ones."""
+    partitions = value.split(",")
 
-    # Main arguments
-    parser.add_argument("file", type=Path, help="path to a device OTA")
-    parser.add_argument("-o", "--output", type=Path, default=None, help="custom output folder")
+    unknown_partitions = [
+        partition for partition in partitions if not is_known_partition(partition)
+    ]
+    if unknown_partitions:
+        raise ArgumentTypeError(f"unknown partitions: {', '.join(unknown_partitions)}")
 
-    # Optional arguments
+    return partitions
+
+
+def add_common_arguments(parser: ArgumentParser):
     parser.add_argument("-v", "--verbose", action="store_true", help="enable verbose output")
 
     parser.add_argument("-d", "--debug", action="store_true", help="enable debugging features")
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=cpu_count(),
+        help="number of parallel jobs (default: number of CPUs)",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--partitions",
+        type=partition_list,
+        default=None,
+        help="comma separated list of partitions to extract (default: all)",
+    )
+
+    parser.add_argument(
+        "-x",
+        "--exclude-partitions",
+        type=partition_list,
+        default=None,
+        help="comma separated list of partitions to not extract",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="reuse and store extracted partitions in this folder",
+    )
+
+    parser.add_argument(
+        "--cache-dumps",
+        action="store_true",
+        help="also reuse and store whole dumps in the cache, the firmware is read once more "
+        "to hash it before the dump",
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=None,
+        help="maximum size of the cache in GiB, least recently used dumps are removed "
+        "(default: unlimited)",
+    )
 
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="save progress and resume an interrupted dump of the same file",
+    )
+
+
+def setup(args: Namespace):
     setup_locale()
 
     setup_logging(args.debug or args.verbose)
 
     setup_shutil_formats()
 
+
+def get_partition_filter(args: Namespace):
+    return PartitionFilter(args.partitions, args.exclude_partitions)
+
+
+def get_cache(args: Namespace):
+    if not args.cache_dir:
+        return None
+
+    cache_max_size = args.cache_size * 1024**3 if args.cache_size is not None else None
+
+    return DumpCache(args.cache_dir, cache_max_size, args.cache_dumps)
+
+
+def batch_main(argv: list):
+    parser = ArgumentParser(prog="dumpyara batch", description="Dump many firmwares at once")
+
+    parser.add_argument(
+        "inputs",
+        type=Path,
+        nargs="+",
+        help="firmwares, folders of firmwares or lists of firmwares (.txt or .list files, "
+        "one path per line)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="folder where the dumps are created (default: current folder)",
+    )
+
+    add_common_arguments(parser)
+
+    parser.add_argument(
+        "-J",
+        "--parallel-dumps",
+        type=int,
+        default=2,
+        help="number of firmwares dumped at the same time, they share the jobs (default: 2)",
+    )
+
+    parser.add_argument(
+        "--max-scratch-size",
+        type=int,
+        default=None,
+        help="maximum estimated size in GiB of the temporary files of the running dumps "
+        "(default: unlimited)",
+    )
+
+    args = parser.parse_args(argv)
+
+    setup(args)
+
+    output = (args.output or Path.cwd()).absolute()
+
+    files = get_batch_files(args.inputs)
+    if not files:
+        parser.error("no firmwares found")
+
+    max_scratch_size = (
+        args.max_scratch_size * 1024**3 if args.max_scratch_size is not None else None
+    )
+
+    batch_jobs = dumpyara_batch(
+        files,
+        output,
+        args.debug,
+        args.jobs,
+        args.parallel_dumps,
+        max_scratch_size,
+        get_partition_filter(args),
+        get_cache(args),
+        args.resume,
+    )
+
+    print(f"\n{get_batch_summary(batch_jobs)}")
+
+    print(f"\nDone! You can find the dumps in {str(output)}")
+
+    if any(job.error is not None for job in batch_jobs):
+        sys.exit(1)
+
+
+def main():
+    if sys.argv[1:2] == ["batch"]:
+        batch_main(sys.argv[2:])
+        return
+
+    parser = ArgumentParser(
+        description="Dumpyara", epilog="Use 'dumpyara batch' to dump many firmwares at once"
+    )
+
+    # Main arguments
+    parser.add_argument("file", type=Path, help="path to a device OTA")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="custom output folder")
+
+    # Optional arguments
+    add_common_arguments(parser)
+
+    parser.add_argument(
+        "--stats", action="store_true", help="print a summary of the time spent in each step"
+    )
+
+    args = parser.parse_args()
+
+    setup(args)
+
     output = Path.cwd() / args.file.stem
     if args.output:
         output = args.output
 
-    output_path = dumpyara(args.file, output, args.debug)
+    stats = DumpStats()
+
+    output_path = dumpyara(
+        args.file,
+        output,
+        args.debug,
+        args.jobs,
+        get_partition_filter(args),
+        get_cache(args),
+        args.resume,
+        stats,
+    )
+
+    if args.stats:
+        print(f"\n{stats.get_summary()}")
 
     print(f"\nDone! You can find the dump in {str(output_path)}")
@@ -12,19 +12,100 @@ from pathlib import Path
 from re import Pattern, compile
 from shutil import unpack_archive
 from sebaubuntu_libs.liblogging import LOGD, LOGI
-from typing import Callable, Dict
-
-from dumpyara.utils.files import get_recursive_files_list
+from typing import Callable, Dict, List, Optional
 
+from zipfile import ZipFile, is_zipfile
 
-def extract_archive(archive_path: Path, extracted_archive_path: Path, is_nested: bool = False):
+from dumpyara.lib.libkdz import unpack_dz, unpack_kdz
+from dumpyara.utils.files import get_recursive_files_list
+from dumpyara.utils.multipartitions import IN_ARCHIVE_MULTIPARTITIONS
+from dumpyara.utils.partitions import (
+    ALL_PARTITIONS,
+    PartitionFilter,
+    get_filename_without_extensions,
+    is_known_partition,
+)
+from dumpyara.utils.zip_members import StoredZipMember, extract_zip, get_stored_zip_member
+
+
+def get_unwanted_zip_members(archive_path: Path, partition_filter: PartitionFilter):
+    """Get the members of a zip that are images of partitions we don't want."""
+    if partition_filter.is_everything():
+        return []
+
+    with ZipFile(archive_path) as zip_file:
+        names = zip_file.namelist()
+
+    unwanted_members = []
+    for name in names:
+        partition = get_filename_without_extensions(Path(name))
+        if is_known_partition(partition) and not partition_filter.is_wanted(partition):
+            LOGD(f"Skipping {name}")
+            unwanted_members.append(name)
+
+    return unwanted_members
+
+
+def extract_archive(
+    archive_path: Path,
+    extracted_archive_path: Path,
+    is_nested: bool = False,
+    partition_filter: PartitionFilter = ALL_PARTITIONS,
+    jobs: Optional[int] = None,
+    index_dir: Optional[Path] = None,
+) -> List[StoredZipMember]:
     """
     Extract the archive into a folder.
+
+    Multipartition images stored uncompressed in a zip (e.g. payload.bin in
+    A/B OTAs) are left in the archive, they're returned so that they
+    can be read in place.
+    Zip members and DZ slices of partitions not accepted by partition_filter
+    aren't extracted.
+    DZ chunks are decompressed by up to jobs workers.
+    If index_dir is set, the index of DZ files is kept there, so that
+    dumping the same file again doesn't have to read all its chunk headers.
     """
     LOGD(f"Extracting archive: {archive_path.name}")
 
+    # Nested archives are deleted after extraction, their members can't be read in place
+    stored_members: List[StoredZipMember] = []
+    if not is_nested and is_zipfile(archive_path):
+        for name in IN_ARCHIVE_MULTIPARTITIONS:
+            member = get_stored_zip_member(archive_path, name)
+            if member is None:
+                continue
+
+            LOGI(f"{name} is stored uncompressed, reading it in place")
+            stored_members.append(member)
+
     # Extract the archive
-    unpack_archive(archive_path, extracted_archive_path)
+    if is_zipfile(archive_path):
+        extract_zip(
+            archive_path,
+            extracted_archive_path,
+            exclude=[member.name for member in stored_members]
+            + get_unwanted_zip_members(archive_path, partition_filter),
+        )
+    elif archive_path.suffix == ".kdz":
+        unpack_kdz(
+            str(archive_path),
+            str(extracted_archive_path),
+            partition_filter.is_wanted,
+            jobs,
+            str(index_dir) if index_dir is not None else None,
+        )
+    elif archive_path.suffix == ".dz":
+        unpack_dz(
+            str(archive_path),
+            str(extracted_archive_path),
+            partition_filter.is_wanted,
+            jobs,
+            index_dir=str(index_dir) if index_dir is not None else None,
+        )
+    else:
+        unpack_archive(archive_path, extracted_archive_path)
+
     if is_nested:
         LOGD("Archive is nested, unlinking")
         archive_path.unlink()
@@ -58,12 +139,17 @@ def extract_archive(archive_path: Path, extracted_archive_path: Path, is_nested:
                 LOGD(f"Nested archive {nested_archive.name} probably already handled, skipping")
                 continue
 
-            func(nested_archive, extracted_archive_path, True)
+            func(nested_archive, extracted_archive_path, True, partition_filter, jobs)
 
     LOGD(f"Extracted archive: {archive_path.name}")
 
+    return stored_members
+
 
-NESTED_ARCHIVES: Dict[Pattern[str], Callable[[Path, Path, bool], None]] = {
+NESTED_ARCHIVES: Dict[
+    Pattern[str],
+    Callable[[Path, Path, bool, PartitionFilter, Optional[int]], List[StoredZipMember]],
+] = {
     compile(key): value
     for key, value in {
         ".*\\.tar\\.md5": extract_archive,
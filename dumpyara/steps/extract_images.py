@@ -8,55 +8,212 @@ Step 3.
 This step will extract the raw images.
 """
 
+from concurrent.futures import Executor, Future, as_completed
 from pathlib import Path
 from dumpyara.lib.liberofs import extract_erofs
 from sebaubuntu_libs.libexception import format_exception
-from sebaubuntu_libs.liblogging import LOGD, LOGE, LOGI
+from sebaubuntu_libs.liblogging import LOGI
 from shutil import copyfile
 from subprocess import CalledProcessError
+from threading import Lock
+from typing import List, Optional
 
 from dumpyara.lib.libsevenzip import unpack_sevenzip
 from dumpyara.utils.bootimg import extract_bootimg
+from dumpyara.utils.cache import DumpCache
+from dumpyara.utils.files import rmtree_recursive
+from dumpyara.utils.image_formats import EROFS, UNKNOWN, get_image_format
+from dumpyara.utils.log_buffer import LogBuffer
 from dumpyara.utils.partitions import (
+    ALL_PARTITIONS,
     BOOTIMAGE,
     FILESYSTEM,
     RAW,
     PARTITIONS,
+    PartitionFilter,
     get_partition_names,
 )
+from dumpyara.utils.state import DumpState
+from dumpyara.utils.stats import STATS_PARTITIONS, STATS_TOOLS, DumpStats, measure
+from dumpyara.utils.workers import get_executor
 
 
-def extract_images(raw_images_path: Path, output_path: Path):
+def extract_image(
+    partition: str,
+    image_path: Path,
+    output_path: Path,
+    log: LogBuffer,
+    cache: Optional[DumpCache] = None,
+    stats: Optional[DumpStats] = None,
+):
     """
-    Extract the raw images.
-    """
-    # At this point aliases shouldn't be used anymore
-    for partition in get_partition_names():
-        partition_type = PARTITIONS[partition]
+    Extract a single raw image.
 
-        image_path = raw_images_path / f"{partition}.img"
-        if not image_path.exists():
-            continue
+    If cache is set, the extracted tree is reused from there when the same
+    image has already been extracted, and added to it otherwise. The image
+    is only hashed when its hash isn't known (e.g. from a payload) and a
+    cached tree can match, or when its tree is added.
+    If stats is set, the partition and the external tools are measured there.
 
-        LOGI(f"Extracting {partition}")
+    Returns whether the image was extracted, failures are logged.
+    """
+    partition_type = PARTITIONS[partition]
+    tree_path = output_path / partition
+    extracted = True
 
-        if partition_type == BOOTIMAGE:
+    with measure(stats, STATS_PARTITIONS, partition, thread=True):
+        log.LOGI(f"Extracting {partition}")
+
+        if (
+            cache is not None
+            and partition_type in (BOOTIMAGE, FILESYSTEM)
+            and cache.restore_tree(image_path, tree_path)
+        ):
+            log.LOGI(f"Reused {partition} from cache")
+        elif partition_type == BOOTIMAGE:
             try:
-                extract_bootimg(image_path, output_path / partition)
+                with measure(stats, STATS_TOOLS, "aik", thread=True, partition=partition):
+                    extract_bootimg(image_path, tree_path)
             except Exception as e:
-                LOGE(f"Failed to extract {image_path.name}")
-                LOGE(f"{format_exception(e)}")
+                log.LOGE(f"Failed to extract {image_path.name}")
+                log.LOGE(f"{format_exception(e)}")
+                extracted = False
+            else:
+                if cache is not None:
+                    cache.publish_tree(image_path, tree_path)
         elif partition_type == FILESYSTEM:
-            try:
-                extract_erofs(image_path, output_path / partition)
-            except CalledProcessError as e:
-                LOGD(f"Failed to extract {image_path.name} with erofs, trying 7z")
-                LOGD(format_exception(e))
+            image_format = get_image_format(image_path)
+
+            # Only try fsck.erofs when the image can be an EROFS one
+            extracted = False
+            if image_format in (EROFS, UNKNOWN):
+                try:
+                    with measure(
+                        stats, STATS_TOOLS, "fsck.erofs", thread=True, partition=partition
+                    ):
+                        extract_erofs(image_path, tree_path)
+                except CalledProcessError as e:
+                    log.LOGD(f"Failed to extract {image_path.name} with erofs, trying 7z")
+                    log.LOGD(format_exception(e))
+                else:
+                    extracted = True
+
+            if not extracted:
                 try:
-                    unpack_sevenzip(str(image_path), str(output_path / partition))
+                    with measure(stats, STATS_TOOLS, "7z", thread=True, partition=partition):
+                        unpack_sevenzip(str(image_path), str(tree_path))
                 except CalledProcessError as e:
-                    LOGE(f"Error extracting {image_path.name}")
-                    LOGE(f"{e.output.decode('UTF-8', errors='ignore')}")
+                    log.LOGE(f"Error extracting {image_path.name}")
+                    log.LOGE(f"{e.output.decode('UTF-8', errors='ignore')}")
+                else:
+                    extracted = True
+
+            if extracted and cache is not None and tree_path.is_dir():
+                cache.publish_tree(image_path, tree_path)
 
         if partition_type in (RAW, BOOTIMAGE):
             copyfile(image_path, output_path / f"{partition}.img", follow_symlinks=True)
+
+        if cache is not None:
+            # The raw image is removed with the temporary files
+            cache.forget_image(image_path)
+
+    return extracted
+
+
+class ImageExtractor:
+    """
+    Extract raw images in an executor as soon as they're submitted.
+
+    Only the partitions accepted by partition_filter are extracted.
+    If state is set, partitions already extracted are skipped and the
+    others are recorded there once done.
+    If stats is set, each partition is measured there.
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        output_path: Path,
+        partition_filter: PartitionFilter = ALL_PARTITIONS,
+        cache: Optional[DumpCache] = None,
+        state: Optional[DumpState] = None,
+        stats: Optional[DumpStats] = None,
+    ):
+        self.executor = executor
+        self.output_path = output_path
+        self.partition_filter = partition_filter
+        self.cache = cache
+        self.state = state
+        self.stats = stats
+
+        self._lock = Lock()
+        self._futures: List[Future] = []
+
+    def _extract_image(self, partition: str, image_path: Path):
+        log = LogBuffer()
+        try:
+            extracted = extract_image(
+                partition, image_path, self.output_path, log, self.cache, self.stats
+            )
+        finally:
+            log.flush()
+
+        # Failed ones are tried again when resuming
+        if extracted and self.state is not None:
+            self.state.set_partition_extracted(partition)
+
+    def submit(self, partition: str, image_path: Path):
+        """Extract the raw image of partition, this can be called from any thread."""
+        if not self.partition_filter.is_wanted(partition):
+            return
+
+        if self.state is not None:
+            if self.state.is_partition_extracted(partition):
+                LOGI(f"{partition} already extracted, skipping")
+                return
+
+            # Remove leftovers of an interrupted extraction
+            if (self.output_path / partition).exists():
+                rmtree_recursive(self.output_path / partition)
+
+        future = self.executor.submit(self._extract_image, partition, image_path)
+
+        with self._lock:
+            self._futures.append(future)
+
+    def wait(self):
+        """Wait for all the submitted images to be extracted."""
+        with self._lock:
+            futures = list(self._futures)
+
+        for future in as_completed(futures):
+            future.result()
+
+
+def extract_images(
+    raw_images_path: Path,
+    output_path: Path,
+    jobs: Optional[int] = None,
+    partition_filter: PartitionFilter = ALL_PARTITIONS,
+    cache: Optional[DumpCache] = None,
+    state: Optional[DumpState] = None,
+    stats: Optional[DumpStats] = None,
+):
+    """
+    Extract the raw images.
+
+    Partitions are independent from each other, so up to `jobs` of them
+    (CPU count by default) are extracted at the same time.
+    See ImageExtractor for the other arguments.
+    """
+    with get_executor(jobs) as executor:
+        extractor = ImageExtractor(executor, output_path, partition_filter, cache, state, stats)
+
+        # At this point aliases shouldn't be used anymore
+        for partition in get_partition_names():
+            image_path = raw_images_path / f"{partition}.img"
+            if image_path.exists():
+                extractor.submit(partition, image_path)
+
+        extractor.wait()
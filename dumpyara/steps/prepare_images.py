@@ -8,35 +8,219 @@ Step 2.
 This step will convert the archive files to raw images ready to be extracted.
 """
 
+from concurrent.futures import Executor
+from functools import partial
 from pathlib import Path
 from sebaubuntu_libs.liblogging import LOGI
+from shutil import move
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+from dumpyara.utils.archive_index import IMAGE, SPARSECHUNK, ArchiveIndex, ImageFiles
+from dumpyara.utils.cache import DumpCache
 from dumpyara.utils.files import get_recursive_files_list
-from dumpyara.utils.multipartitions import MULTIPARTITIONS
+from dumpyara.utils.multipartitions import IN_ARCHIVE_MULTIPARTITIONS, MULTIPARTITIONS
 from dumpyara.utils.partitions import (
-    correct_ab_filenames,
-    fix_aliases,
-    prepare_raw_images,
+    ALL_PARTITIONS,
+    LOGICAL,
+    PARTITIONS,
+    PartitionFilter,
+    get_generic_partition_name,
+    get_image_precedence,
+    get_partition_image_names,
+    is_known_partition,
 )
-from dumpyara.utils.sparsed_images import prepare_sparsed_images
+from dumpyara.utils.raw_image import get_raw_image
+from dumpyara.utils.sparsed_images import unsparse_sparsechunk_images
+from dumpyara.utils.workers import get_executor
+from dumpyara.utils.zip_members import StoredZipMember
 
 
-def prepare_images(extracted_archive_path: Path, raw_images_path: Path):
+# Source of the images found in the archive, multipartition images are numbered from 0
+ARCHIVE_SOURCE = -1
+
+
+def _get_preferred_images(names: Iterable[str]):
+    """Get the preferred image name of each partition between names."""
+    preferred_images: Dict[str, str] = {}
+
+    for name in names:
+        partition = get_generic_partition_name(name)
+        preferred_image = preferred_images.get(partition)
+        if preferred_image is None or get_image_precedence(name) < get_image_precedence(
+            preferred_image
+        ):
+            preferred_images[partition] = name
+
+    return preferred_images
+
+
+class _RawImages:
+    """
+    Raw images prepared so far.
+
+    The image of each partition is chosen in advance, but the partitions of
+    some multipartition images can't be known before extracting them
+    (e.g. super images lpunpack has to deal with). Until those are done, an
+    image is only final once no image with a more preferred name (see
+    get_partition_image_names()) can show up anymore.
+    Final images are moved to the partition name, the other ones are removed.
+    """
+
+    def __init__(
+        self,
+        raw_images_path: Path,
+        expected_images: Iterable[str],
+        unexpected_images: bool,
+        on_image_ready: Optional[Callable[[str, Path], None]],
+    ):
+        self.raw_images_path = raw_images_path
+        self.on_image_ready = on_image_ready
+
+        self._lock = Lock()
+        self._pending_images = set(expected_images)
+        self._unexpected_images = unexpected_images
+        # Images not chosen yet
+        self._images: Set[str] = set()
+        # partition: chosen image
+        self._partitions: Dict[str, str] = {}
+
+    def _update(self, partition: str):
+        image_names = get_partition_image_names(partition)
+
+        if partition not in self._partitions:
+            for name in image_names:
+                if name in self._images:
+                    break
+
+                if self._unexpected_images or name in self._pending_images:
+                    return
+            else:
+                return
+
+            self._images.remove(name)
+            self._partitions[partition] = name
+
+            image_path = self.raw_images_path / f"{partition}.img"
+            if name != partition:
+                LOGI(f"Using {name}.img as {image_path.name}")
+                move(self.raw_images_path / f"{name}.img", image_path)
+
+            if self.on_image_ready is not None:
+                self.on_image_ready(partition, image_path)
+
+        for name in image_names:
+            if name not in self._images:
+                continue
+
+            LOGI(f"Ignoring {name}.img ({partition} already prepared)")
+            self._images.remove(name)
+            (self.raw_images_path / f"{name}.img").unlink()
+
+    def add(self, name: str, found: bool = True):
+        """Record that the preparation of an image is done, found is whether it was there."""
+        with self._lock:
+            self._pending_images.discard(name)
+
+            if found:
+                self._images.add(name)
+
+            self._update(get_generic_partition_name(name))
+
+    def set_multipartitions_done(self):
+        """Record that the multipartition images are done, their missing images won't show up."""
+        with self._lock:
+            self._unexpected_images = False
+            self._pending_images.clear()
+
+            for name in list(self._images):
+                if name in self._images:
+                    self._update(get_generic_partition_name(name))
+
+
+def _prepare_archive_image(image: ImageFiles, raw_images: _RawImages, keep_inputs: bool):
+    found = False
+    try:
+        found = get_raw_image(image, raw_images.raw_images_path / f"{image.name}.img", keep_inputs)
+    finally:
+        raw_images.add(image.name, found)
+
+
+def _is_extractable(name: str, partition_filter: PartitionFilter):
+    """Check whether the image of a partition should be prepared."""
+    if not is_known_partition(name) or not partition_filter.is_wanted(name):
+        return False
+
+    # Logical partitions are unpacked by the multipartition handlers
+    return PARTITIONS[get_generic_partition_name(name)] != LOGICAL
+
+
+def prepare_images(
+    extracted_archive_path: Path,
+    raw_images_path: Path,
+    jobs: Optional[int] = None,
+    stored_members: Optional[List[StoredZipMember]] = None,
+    partition_filter: PartitionFilter = ALL_PARTITIONS,
+    cache: Optional[DumpCache] = None,
+    on_image_ready: Optional[Callable[[str, Path], None]] = None,
+    executor: Optional[Executor] = None,
+    keep_inputs: bool = False,
+):
     """
     Convert the archive files to raw images ready to be extracted.
+
+    stored_members are the multipartition images left inside the archive by step 1.
+    Only the partitions accepted by partition_filter are prepared.
+    If cache is set, payload partitions already in it aren't decoded again.
+    If executor is set, the parallel work runs in it instead of a new pool
+    of jobs workers, and the caller waits for it.
+    If keep_inputs is True, the archive files consumed by the conversion
+    (LZ4 and sparsechunk images) are kept, so that the raw images can be
+    prepared again (e.g. when resuming).
+
+    When a partition has more than one image (e.g. system_a and system_b,
+    or an alias), the preferred one is chosen before converting anything,
+    the other ones aren't prepared at all.
+
+    Partitions are prepared independently: the images in the archive are
+    converted in parallel while the multipartition images are unpacked,
+    and on_image_ready is called with the name and the raw image of each
+    partition as soon as it's final, so that it can be extracted while the
+    other ones are still being prepared. It's called from worker threads.
     """
+    archive_index = ArchiveIndex(extracted_archive_path)
+
+    # Logical partitions are found with the multipartitions, merge their sparsechunks first
+    for image in archive_index.images.values():
+        if PARTITIONS.get(image.partition) != LOGICAL or not partition_filter.is_wanted(image.name):
+            continue
 
-    # Check for sparsed images
-    prepare_sparsed_images(extracted_archive_path)
+        sparsechunk_images = image.get_files(SPARSECHUNK)
+        if sparsechunk_images and image.get_file(IMAGE) is None:
+            # An interrupted merge mustn't leave an image behind, it would
+            # be taken as the merged one when resuming
+            merged_image = extracted_archive_path / f"{image.name}.img"
+            temp_merged_image = merged_image.with_name(f".{merged_image.name}.tmp")
+            unsparse_sparsechunk_images(sparsechunk_images, temp_merged_image)
+            move(temp_merged_image, merged_image)
 
-    # Check for partitions
-    prepare_raw_images(extracted_archive_path, raw_images_path)
+    unknown_files = [
+        file.name
+        for file in archive_index.unknown_files
+        if not any(pattern.match(file.name) for pattern in MULTIPARTITIONS)
+    ]
+    if unknown_files:
+        LOGI(f"Ignoring unknown files: {', '.join(sorted(unknown_files))}")
+
+    # name, partitions it would give (None if unknown),
+    # extractor taking the partition filter, the cache and the callback
+    multipartitions: List[Tuple[str, Optional[List[str]], Callable[..., None]]] = []
 
     # Check for multipartitions
     extracted_archive_tempdir_files_list = list(
         get_recursive_files_list(extracted_archive_path, True)
     )
-    for pattern, func in MULTIPARTITIONS.items():
+    for pattern, (get_partitions, func) in MULTIPARTITIONS.items():
         matches = [
             file for file in extracted_archive_tempdir_files_list if pattern.match(str(file))
         ]
@@ -48,13 +232,87 @@ def prepare_images(extracted_archive_path: Path, raw_images_path: Path):
         for file in matches:
             multipart_image = extracted_archive_path / file
             LOGI(f"Found multipartition image: {multipart_image.name}")
-            func(multipart_image, raw_images_path)
+            multipartitions.append(
+                (
+                    multipart_image.name,
+                    get_partitions(multipart_image),
+                    partial(func, multipart_image, raw_images_path, jobs, executor),
+                )
+            )
+
+    # Check for multipartitions left inside the archive
+    for member in stored_members or []:
+        LOGI(f"Found multipartition image inside the archive: {member.name}")
+        get_partitions, func = IN_ARCHIVE_MULTIPARTITIONS[member.name]
+        multipartitions.append(
+            (
+                member.name,
+                get_partitions(member),
+                partial(func, member, raw_images_path, jobs, executor),
+            )
+        )
+
+    # Choose the image of each partition, the ones in the archive come first
+    # for the same name
+    image_sources: Dict[str, int] = {
+        name: ARCHIVE_SOURCE
+        for name, image in archive_index.images.items()
+        if _is_extractable(name, partition_filter) and image.is_convertible()
+    }
+    for source, (_, partitions, _) in enumerate(multipartitions):
+        for name in partitions or []:
+            if _is_extractable(name, partition_filter):
+                image_sources.setdefault(name, source)
+
+    preferred_images = _get_preferred_images(image_sources)
+    chosen_images = set(preferred_images.values())
+
+    for name in image_sources:
+        if name not in chosen_images:
+            partition = get_generic_partition_name(name)
+            LOGI(f"Skipping {name}, {preferred_images[partition]} is preferred for {partition}")
+
+    archive_images = [
+        archive_index.images[name]
+        for name, source in image_sources.items()
+        if source == ARCHIVE_SOURCE and name in chosen_images
+    ]
+
+    def get_multipartition_filter(source: int):
+        if multipartitions[source][1] is not None:
+            return lambda name: name in chosen_images and image_sources[name] == source
+
+        # Only take what the other images don't give better
+        def multipartition_filter(name: str):
+            if not _is_extractable(name, partition_filter):
+                return False
+
+            preferred_image = preferred_images.get(get_generic_partition_name(name))
+
+            return preferred_image is None or get_image_precedence(name) < get_image_precedence(
+                preferred_image
+            )
+
+        return multipartition_filter
+
+    raw_images = _RawImages(
+        raw_images_path,
+        chosen_images,
+        any(partitions is None for _, partitions, _ in multipartitions),
+        on_image_ready,
+    )
+
+    with get_executor(jobs, executor) as archive_executor:
+        futures = [
+            archive_executor.submit(_prepare_archive_image, image, raw_images, keep_inputs)
+            for image in archive_images
+        ]
 
-    # Check for partitions again, in case of multipartitions
-    prepare_raw_images(extracted_archive_path, raw_images_path)
+        for source, (name, _, extract) in enumerate(multipartitions):
+            LOGI(f"Extracting multipartition image: {name}")
+            extract(get_multipartition_filter(source), cache, raw_images.add)
 
-    # Fix slotted filenames if needed
-    correct_ab_filenames(raw_images_path)
+        raw_images.set_multipartitions_done()
 
-    # Fix aliases
-    fix_aliases(raw_images_path)
+        for future in futures:
+            future.result()
@@ -0,0 +1,144 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import os
+from pathlib import Path
+from re import compile
+from typing import Dict, List, Optional, Tuple
+
+from dumpyara.utils.partitions import (
+    get_partition_name,
+    get_unslotted_partition_name,
+    is_known_partition,
+)
+
+# Kinds of image files
+(
+    IMAGE,
+    SDAT,
+    SDAT_BROTLI,
+    TRANSFER_LIST,
+    LZ4,
+    SPARSECHUNK,
+) = range(6)
+
+# suffix: kind
+# Images are in order of preference
+IMAGE_FILE_SUFFIXES = {
+    ".new.dat.br": SDAT_BROTLI,
+    ".new.dat": SDAT,
+    ".transfer.list": TRANSFER_LIST,
+    ".img.lz4": LZ4,
+    "": IMAGE,
+    ".bin": IMAGE,
+    ".ext4": IMAGE,
+    ".image": IMAGE,
+    ".img": IMAGE,
+    ".img.ext4": IMAGE,
+    ".mbn": IMAGE,
+    ".raw": IMAGE,
+    ".raw.img": IMAGE,
+}
+
+SPARSECHUNK_PATTERN = compile(r"(.+)\.img_sparsechunk\.(\d+)")
+
+
+class ImageFiles:
+    """
+    Files of a partition image.
+
+    name is the name of the image (e.g. system_a or NON-HLOS), partition
+    is the generic unslotted partition name (e.g. system or modem), slot
+    is the A/B suffix of name, if any, and alias is whether name is an
+    alternative name of the partition.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+        unslotted_name = get_unslotted_partition_name(name)
+        self.slot = name[len(unslotted_name) :]
+        self.partition = get_partition_name(unslotted_name)
+        self.alias = unslotted_name != self.partition
+
+        # kind: [(order, file)]
+        self._files: Dict[int, List[Tuple[int, Path]]] = {}
+
+    def __repr__(self):
+        return f"ImageFiles({self.name}, {self._files})"
+
+    def add_file(self, kind: int, file: Path, order: int = 0):
+        self._files.setdefault(kind, []).append((order, file))
+
+    def get_files(self, kind: int):
+        """Get the files of a kind, in order (of preference or of sparsechunk)."""
+        return [file for _, file in sorted(self._files.get(kind, []))]
+
+    def get_file(self, kind: int) -> Optional[Path]:
+        files = self.get_files(kind)
+        return files[0] if files else None
+
+    def is_convertible(self):
+        """Check whether a raw image can be made from these files."""
+        if TRANSFER_LIST in self._files and (SDAT in self._files or SDAT_BROTLI in self._files):
+            return True
+
+        return any(kind in self._files for kind in (LZ4, IMAGE, SPARSECHUNK))
+
+
+def parse_image_file_name(file_name: str) -> Optional[Tuple[str, int, int]]:
+    """
+    Get the image name, kind and order of a file, None if the file
+    isn't part of a known partition image.
+    """
+    match = SPARSECHUNK_PATTERN.fullmatch(file_name)
+    if match is not None:
+        if not is_known_partition(match.group(1)):
+            return None
+
+        return match.group(1), SPARSECHUNK, int(match.group(2))
+
+    for order, (suffix, kind) in enumerate(IMAGE_FILE_SUFFIXES.items()):
+        if not file_name.endswith(suffix):
+            continue
+
+        name = file_name[: len(file_name) - len(suffix)]
+        if is_known_partition(name):
+            return name, kind, order
+
+    return None
+
+
+class ArchiveIndex:
+    """
+    Index of the partition images in a folder (e.g. the extracted archive).
+
+    The folder is listed once and every file name is parsed, images
+    holds the files of each image by name (slotted or aliased names
+    included), the files not belonging to any image are in unknown_files.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+        self.images: Dict[str, ImageFiles] = {}
+        self.unknown_files: List[Path] = []
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+
+                file = path / entry.name
+
+                image_file = parse_image_file_name(entry.name)
+                if image_file is None:
+                    self.unknown_files.append(file)
+                    continue
+
+                name, kind, order = image_file
+                if name not in self.images:
+                    self.images[name] = ImageFiles(name)
+                self.images[name].add_file(kind, file, order)
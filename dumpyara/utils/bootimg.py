@@ -7,9 +7,22 @@ from pathlib import Path
 from sebaubuntu_libs.libcompat.distutils.dir_util import copy_tree
 from sebaubuntu_libs.libaik import AIKManager
 
+from dumpyara.utils.stats import check_tool_output
+
+
+class _AIKManager(AIKManager):
+    """AIKManager running its scripts with check_tool_output(), so that they're measured."""
+
+    # Not a public hook of sebaubuntu_libs, keep its version pinned in
+    # pyproject.toml and check that this still matches when bumping it
+    def _execute_script(self, script: str, *args):
+        return check_tool_output(
+            [str(self.path / script), "--nosudo", *map(str, args)], encoding="utf-8"
+        )
+
 
 def extract_bootimg(file: Path, output_path: Path):
-    aik_manager = AIKManager()
+    aik_manager = _AIKManager()
 
     image_info = aik_manager.unpackimg(file, ignore_ramdisk_errors=True)
 
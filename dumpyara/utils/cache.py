@@ -0,0 +1,362 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import os
+from hashlib import sha256
+from pathlib import Path
+from sebaubuntu_libs.liblogging import LOGD, LOGI, LOGW
+from shutil import copy2, copytree, ignore_patterns
+from tempfile import mkdtemp
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from dumpyara.utils.files import rmtree_recursive
+from dumpyara.utils.partitions import PartitionFilter
+
+# Amount of data hashed at once
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Prefix of the entries being published
+TEMP_ENTRY_PREFIX = ".tmp-"
+
+# Names of the files of a partition entry
+PARTITION_IMAGE_NAME = "image.img"
+PARTITION_TREE_NAME = "tree"
+
+
+def hash_file(file: Path):
+    """Get the SHA-256 of a file."""
+    file_hash = sha256()
+
+    with file.open("rb") as f:
+        while True:
+            data = f.read(HASH_CHUNK_SIZE)
+            if not data:
+                break
+
+            file_hash.update(data)
+
+    return file_hash.hexdigest()
+
+
+def get_cache_key(file_hash: str, partition_filter: PartitionFilter):
+    """Get the cache key of a dump, the partition selection changes its content."""
+    if partition_filter.is_everything():
+        return file_hash
+
+    return f"{file_hash}-{sha256(repr(partition_filter).encode()).hexdigest()[:16]}"
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different filesystem or no hardlinks support
+        copy2(src, dst)
+
+
+def _link_tree(src: Path, dst: Path, exclude: Iterable[str] = ()):
+    copytree(
+        src,
+        dst,
+        symlinks=True,
+        ignore=ignore_patterns(*exclude),
+        copy_function=_link_or_copy,
+        dirs_exist_ok=True,
+    )
+
+
+def _get_tree_size(path: Path, seen: Set[Tuple[int, int]]):
+    """Get the size of the files in path, skipping and updating the (st_dev, st_ino) in seen."""
+    size = 0
+    for currentpath, _, files in os.walk(path):
+        for file in files:
+            try:
+                file_stat = os.lstat(os.path.join(currentpath, file))
+            except FileNotFoundError:
+                continue
+
+            inode = (file_stat.st_dev, file_stat.st_ino)
+            if inode in seen:
+                continue
+
+            seen.add(inode)
+            size += file_stat.st_size
+
+    return size
+
+
+class DumpCache:
+    """
+    On-disk cache of dumps.
+
+    It holds two kinds of entries:
+    - finished dumps, keyed by the hash of the input file, only if dumps
+      is True. Looking one up needs an extra full read of the input file
+      before step 1, which can't hash it as it doesn't read it
+      sequentially
+    - partitions, keyed by the hash of their raw image, holding the raw
+      image and the extracted tree. Those are shared between firmwares
+      (e.g. regional variants of the same build)
+    It also holds the indexes of the DZ files that were dumped (see
+    libkdz) and the sizes of the raw images with a cached tree, so that
+    an image is only hashed to look up its tree when one can match. Those
+    are small and not evicted.
+
+    Entries are made of hardlinks (falling back to copies across
+    filesystems) and published with atomic renames.
+    When max_size is set, the least recently used entries are evicted with
+    evict() once a dump is finished.
+    """
+
+    def __init__(self, cache_dir: Path, max_size: Optional[int] = None, dumps: bool = False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.dumps = dumps
+
+        self.dumps_dir = cache_dir / "dumps"
+        self.partitions_dir = cache_dir / "partitions"
+        self.indexes_dir = cache_dir / "indexes"
+        self.tree_sizes_dir = cache_dir / "tree_sizes"
+
+        self.dumps_dir.mkdir(parents=True, exist_ok=True)
+        self.partitions_dir.mkdir(parents=True, exist_ok=True)
+        self.indexes_dir.mkdir(parents=True, exist_ok=True)
+        self.tree_sizes_dir.mkdir(parents=True, exist_ok=True)
+
+        # path: (st_size, st_mtime_ns, key), raw images whose hash is already known
+        self._image_keys: Dict[str, Tuple[int, int, str]] = {}
+
+    def _publish(self, path: Path, populate: Callable[[Path], None]):
+        """
+        Create path atomically, populate is called with a temporary path.
+
+        The cache is only an optimization, failures are logged and never
+        fail the dump. Returns whether path exists.
+        """
+        temp_dir = None
+        try:
+            path.parent.mkdir(exist_ok=True)
+
+            # Unique per call, the dumps of a batch are threads of the same process
+            temp_dir = Path(mkdtemp(prefix=TEMP_ENTRY_PREFIX, dir=path.parent))
+            temp_path = temp_dir / path.name
+
+            populate(temp_path)
+
+            try:
+                temp_path.rename(path)
+            except OSError:
+                # Someone else published the same entry first
+                LOGD(f"Cache entry {path} already exists")
+        except OSError as e:
+            LOGW(f"Failed to add {path} to cache: {e}")
+        finally:
+            if temp_dir is not None:
+                rmtree_recursive(temp_dir)
+
+        return path.exists()
+
+    def restore(self, key: str, output_path: Path):
+        """
+        Restore a cached dump into output_path.
+
+        Returns whether the entry was found.
+        """
+        entry_path = self.dumps_dir / key
+        if not entry_path.is_dir():
+            return False
+
+        LOGI(f"Restoring dump from cache ({key})")
+
+        try:
+            _link_tree(entry_path, output_path)
+        except OSError as e:
+            # The entry may have been evicted in the meantime
+            LOGW(f"Failed to restore dump from cache: {e}")
+            return False
+
+        # Mark the entry as recently used
+        os.utime(entry_path)
+
+        return True
+
+    def publish(self, key: str, output_path: Path, exclude: Iterable[str] = ()):
+        """Add a dump to the cache, files matching exclude aren't cached."""
+        entry_path = self.dumps_dir / key
+        if entry_path.is_dir():
+            try:
+                os.utime(entry_path)
+            except OSError as e:
+                # The entry may have been evicted in the meantime
+                LOGW(f"Failed to update dump in cache: {e}")
+            return
+
+        LOGI(f"Adding dump to cache ({key})")
+        self._publish(entry_path, lambda path: _link_tree(output_path, path, exclude))
+
+    def _get_known_image_key(self, image_path: Path):
+        """Get the cache key of a raw image if it's known, None otherwise."""
+        known_key = self._image_keys.get(str(image_path))
+        if known_key is None:
+            return None
+
+        size, mtime_ns, key = known_key
+        stat = image_path.stat()
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+            # Another file took its place
+            return None
+
+        return key
+
+    def get_image_key(self, image_path: Path):
+        """Get the cache key of a raw image, hashing it if it isn't known yet."""
+        key = self._get_known_image_key(image_path)
+        if key is None:
+            key = hash_file(image_path)
+            self._set_image_key(image_path, key)
+
+        return key
+
+    def _set_image_key(self, image_path: Path, key: str):
+        stat = image_path.stat()
+        self._image_keys[str(image_path)] = (stat.st_size, stat.st_mtime_ns, key)
+
+    def forget_image(self, image_path: Path):
+        """Forget the cache key of a raw image, to be called once it's not used anymore."""
+        self._image_keys.pop(str(image_path), None)
+
+    def restore_image(self, key: str, image_path: Path):
+        """
+        Restore a cached raw image.
+
+        Returns whether the image was found.
+        """
+        entry_path = self.partitions_dir / key
+        cached_image_path = entry_path / PARTITION_IMAGE_NAME
+        if not cached_image_path.is_file():
+            return False
+
+        try:
+            if image_path.exists():
+                image_path.unlink()
+            _link_or_copy(str(cached_image_path), str(image_path))
+        except OSError as e:
+            LOGW(f"Failed to restore {image_path.name} from cache: {e}")
+            return False
+
+        self._set_image_key(image_path, key)
+        os.utime(entry_path)
+
+        return True
+
+    def publish_image(self, image_path: Path, key: Optional[str] = None):
+        """Add a raw image to the cache, key is its SHA-256 if already known."""
+        try:
+            if key is None:
+                key = self.get_image_key(image_path)
+            else:
+                self._set_image_key(image_path, key)
+        except OSError as e:
+            LOGW(f"Failed to add {image_path.name} to cache: {e}")
+            return
+
+        entry_path = self.partitions_dir / key
+        cached_image_path = entry_path / PARTITION_IMAGE_NAME
+        if cached_image_path.is_file():
+            return
+
+        LOGD(f"Adding {image_path.name} to cache ({key})")
+        self._publish(cached_image_path, lambda path: _link_or_copy(str(image_path), str(path)))
+
+    def restore_tree(self, image_path: Path, output_path: Path):
+        """
+        Restore the cached extracted tree of a raw image into output_path.
+
+        Returns whether the tree was found.
+        """
+        key = self._get_known_image_key(image_path)
+        if key is None:
+            if not (self.tree_sizes_dir / str(image_path.stat().st_size)).exists():
+                # No cached tree can match, don't hash the image to find that out
+                return False
+
+            key = self.get_image_key(image_path)
+
+        entry_path = self.partitions_dir / key
+        cached_tree_path = entry_path / PARTITION_TREE_NAME
+        if not cached_tree_path.is_dir():
+            return False
+
+        try:
+            _link_tree(cached_tree_path, output_path)
+        except OSError as e:
+            LOGW(f"Failed to restore {image_path.name} tree from cache: {e}")
+            return False
+
+        os.utime(entry_path)
+
+        return True
+
+    def publish_tree(self, image_path: Path, tree_path: Path):
+        """Add the extracted tree of a raw image to the cache."""
+        try:
+            entry_path = self.partitions_dir / self.get_image_key(image_path)
+        except OSError as e:
+            LOGW(f"Failed to add {image_path.name} tree to cache: {e}")
+            return
+
+        cached_tree_path = entry_path / PARTITION_TREE_NAME
+        if cached_tree_path.is_dir():
+            return
+
+        if not self._publish(cached_tree_path, lambda path: _link_tree(tree_path, path)):
+            return
+
+        try:
+            (self.tree_sizes_dir / str(image_path.stat().st_size)).touch()
+        except OSError as e:
+            LOGW(f"Failed to record the size of {image_path.name} in cache: {e}")
+
+    def evict(self, keep: Optional[Path] = None):
+        """Remove the least recently used entries until the cache fits in max_size."""
+        if self.max_size is None:
+            return
+
+        entries_mtimes: List[Tuple[float, Path]] = []
+        for entries_dir in (self.dumps_dir, self.partitions_dir):
+            for entry_path in entries_dir.iterdir():
+                if entry_path.name.startswith(TEMP_ENTRY_PREFIX) or not entry_path.is_dir():
+                    continue
+
+                try:
+                    entries_mtimes.append((entry_path.stat().st_mtime, entry_path))
+                except FileNotFoundError:
+                    continue
+
+        # Dumps share their files with the partitions they were made from,
+        # each file is counted once, in the most recently used entry holding it
+        entries: List[Tuple[float, int, Path]] = []
+        seen: Set[Tuple[int, int]] = set()
+        for mtime, entry_path in sorted(entries_mtimes, reverse=True):
+            entries.append((mtime, _get_tree_size(entry_path, seen), entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        # An entry only frees the files not held by more recently used ones
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            if entry_path == keep:
+                continue
+
+            LOGI(f"Evicting {entry_path.name} from cache")
+            try:
+                rmtree_recursive(entry_path)
+            except OSError as e:
+                LOGW(f"Failed to evict {entry_path.name} from cache: {e}")
+                continue
+
+            total_size -= size
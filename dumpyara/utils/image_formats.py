@@ -0,0 +1,61 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from dumpyara.lib.libsparse import SPARSE_HEADER_MAGIC
+
+(
+    UNKNOWN,
+    SPARSE,
+    EROFS,
+    EXT4,
+    F2FS,
+    SQUASHFS,
+    BOOTIMAGE,
+    VENDOR_BOOTIMAGE,
+    LZ4,
+    ZSTD,
+    GZIP,
+    XZ,
+) = range(12)
+
+# How many bytes to read from the start of an image, enough for all the magics below
+HEADER_SIZE = 4096
+
+# format: [(offset, magic)]
+# Brotli streams have no magic, those are recognized by their file extension
+MAGICS: Dict[int, List[Tuple[int, bytes]]] = {
+    SPARSE: [(0, SPARSE_HEADER_MAGIC.to_bytes(4, "little"))],
+    EROFS: [(1024, 0xE0F5E1E2.to_bytes(4, "little"))],
+    EXT4: [(0x438, 0xEF53.to_bytes(2, "little"))],
+    F2FS: [(1024, 0xF2F52010.to_bytes(4, "little"))],
+    SQUASHFS: [(0, b"hsqs")],
+    BOOTIMAGE: [(0, b"ANDROID!")],
+    VENDOR_BOOTIMAGE: [(0, b"VNDRBOOT")],
+    LZ4: [(0, 0x184D2204.to_bytes(4, "little"))],
+    ZSTD: [(0, 0xFD2FB528.to_bytes(4, "little"))],
+    GZIP: [(0, b"\x1f\x8b")],
+    XZ: [(0, b"\xfd7zXZ\x00")],
+}
+
+
+def get_image_format(image: Path):
+    """
+    Detect the format of an image by looking at its magic bytes.
+
+    Only the first few KB of the file are read.
+    Returns UNKNOWN if no known magic is found.
+    """
+    with image.open("rb") as f:
+        header = f.read(HEADER_SIZE)
+
+    for image_format, magics in MAGICS.items():
+        for offset, magic in magics:
+            if header[offset : offset + len(magic)] == magic:
+                return image_format
+
+    return UNKNOWN
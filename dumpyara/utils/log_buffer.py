@@ -0,0 +1,43 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+from sebaubuntu_libs.liblogging import LOGD, LOGE, LOGI, LOGW
+from threading import Lock
+from typing import Callable, List, Tuple
+
+# Keep the messages of a buffer together when flushed from different threads
+_flush_lock = Lock()
+
+
+class LogBuffer:
+    """
+    Collect log messages and emit them all at once.
+
+    This is used by parallel tasks to keep their output grouped
+    instead of interleaving it with the other running tasks.
+    """
+
+    def __init__(self):
+        self.messages: List[Tuple[Callable[[str], None], str]] = []
+
+    def LOGD(self, message: str):
+        self.messages.append((LOGD, message))
+
+    def LOGI(self, message: str):
+        self.messages.append((LOGI, message))
+
+    def LOGW(self, message: str):
+        self.messages.append((LOGW, message))
+
+    def LOGE(self, message: str):
+        self.messages.append((LOGE, message))
+
+    def flush(self):
+        """Emit the collected messages in order."""
+        with _flush_lock:
+            for log, message in self.messages:
+                log(message)
+
+        self.messages.clear()
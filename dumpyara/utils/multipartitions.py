@@ -3,43 +3,218 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 #
 
-from typing import Callable, Dict
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Tuple
+from liblp import GetPartitionName, ReadMetadata
 from liblp.partition_tools.lpunpack import lpunpack
 from pathlib import Path
 from re import Pattern, compile
-from sebaubuntu_libs.liblogging import LOGI
+from sebaubuntu_libs.liblogging import LOGI, LOGW
 from shutil import move
-from subprocess import STDOUT, check_output
 
-from dumpyara.lib.libpayload import extract_android_ota_payload
+from dumpyara.lib.libpayload import (
+    PayloadError,
+    extract_android_ota_payload,
+    get_payload_partitions,
+)
+from dumpyara.lib.libsparse import unsparse_images
+from dumpyara.lib.libsuper import (
+    SuperImageError,
+    extract_super_image,
+    get_super_image_partitions,
+)
+from dumpyara.utils.cache import DumpCache
+from dumpyara.utils.image_formats import SPARSE, get_image_format
+from dumpyara.utils.partitions import ALL_PARTITIONS
+from dumpyara.utils.workers import get_executor
+from dumpyara.utils.zip_members import StoredZipMember
 
 
-def extract_payload(image: Path, output_dir: Path):
-    extract_android_ota_payload(image, output_dir)
+def _extract_payload(
+    filename: Path,
+    output_dir: Path,
+    jobs: Optional[int],
+    executor: Optional[Executor],
+    offset: int,
+    partition_filter: Callable[[str], bool],
+    cache: Optional[DumpCache],
+    on_image_ready: Optional[Callable[[str], None]],
+):
+    def restore_partition(name: str, partition_hash: bytes):
+        assert cache is not None
+        return cache.restore_image(partition_hash.hex(), output_dir / f"{name}.img")
 
+    def partition_extracted(name: str, partition_hash: bytes):
+        # The payload tells us the hash of the images, they're verified
+        # against it before getting here
+        if cache is not None and partition_hash:
+            cache.publish_image(output_dir / f"{name}.img", partition_hash.hex())
 
-def extract_super(image: Path, output_dir: Path):
-    unsparsed_super = output_dir / "super.unsparsed.img"
+        if on_image_ready is not None:
+            on_image_ready(name)
 
+    with get_executor(jobs, executor) as executor:
+        extract_android_ota_payload(
+            filename,
+            output_dir,
+            jobs,
+            offset,
+            partition_filter,
+            restore_partition if cache is not None else None,
+            executor,
+            partition_extracted,
+            verify=cache is not None,
+        )
+
+
+def extract_payload(
+    image: Path,
+    output_dir: Path,
+    jobs: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    partition_filter: Callable[[str], bool] = ALL_PARTITIONS.is_wanted,
+    cache: Optional[DumpCache] = None,
+    on_image_ready: Optional[Callable[[str], None]] = None,
+):
+    _extract_payload(image, output_dir, jobs, executor, 0, partition_filter, cache, on_image_ready)
+
+
+def extract_payload_in_archive(
+    member: StoredZipMember,
+    output_dir: Path,
+    jobs: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    partition_filter: Callable[[str], bool] = ALL_PARTITIONS.is_wanted,
+    cache: Optional[DumpCache] = None,
+    on_image_ready: Optional[Callable[[str], None]] = None,
+):
+    _extract_payload(
+        member.archive,
+        output_dir,
+        jobs,
+        executor,
+        member.offset,
+        partition_filter,
+        cache,
+        on_image_ready,
+    )
+
+
+def extract_super(
+    image: Path,
+    output_dir: Path,
+    jobs: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    partition_filter: Callable[[str], bool] = ALL_PARTITIONS.is_wanted,
+    cache: Optional[DumpCache] = None,
+    on_image_ready: Optional[Callable[[str], None]] = None,
+):
     try:
-        check_output(
-            ["simg2img", image, unsparsed_super], stderr=STDOUT
-        )  # TODO: Rewrite libsparse...
-    except Exception:
-        LOGI(f"Failed to unsparse {image.name}")
-    else:
+        with get_executor(jobs, executor) as executor:
+            extract_super_image(
+                image,
+                output_dir,
+                jobs,
+                partition_filter,
+                executor=executor,
+                on_partition_extracted=on_image_ready,
+            )
+        return
+    except SuperImageError as e:
+        LOGW(f"{e}, falling back to lpunpack")
+
+    if get_image_format(image) == SPARSE:
+        LOGI(f"Unsparsing {image.name}")
+        unsparsed_super = output_dir / "super.unsparsed.img"
+        unsparse_images([image], unsparsed_super)
         move(unsparsed_super, image)
 
-    if unsparsed_super.is_file():
-        unsparsed_super.unlink()
+    partitions = [
+        name
+        for name in map(GetPartitionName, ReadMetadata(str(image), 0).partitions)
+        if partition_filter(name)
+    ]
+    if not partitions:
+        LOGI(f"No wanted partitions in {image.name}, skipping")
+        return
+
+    lpunpack(image, output_dir, partitions)
+
+    if on_image_ready is not None:
+        for name in partitions:
+            if (output_dir / f"{name}.img").is_file():
+                on_image_ready(name)
 
-    lpunpack(image, output_dir)
+
+def get_payload_partitions_in_file(image: Path):
+    try:
+        return get_payload_partitions(image)
+    except PayloadError as e:
+        LOGW(f"Failed to read the manifest of {image.name}: {e}")
+        return None
 
 
-MULTIPARTITIONS: Dict[Pattern[str], Callable[[Path, Path], None]] = {
+def get_payload_partitions_in_archive(member: StoredZipMember):
+    try:
+        return get_payload_partitions(member.archive, member.offset)
+    except PayloadError as e:
+        LOGW(f"Failed to read the manifest of {member.name}: {e}")
+        return None
+
+
+def get_super_partitions(image: Path):
+    try:
+        return get_super_image_partitions(image)
+    except SuperImageError:
+        # lpunpack will have a look at it
+        return None
+
+
+# image, output folder, jobs, executor to run the work in (a new one of jobs
+# workers if None), partition filter, cache, callback called with the name
+# of each partition as soon as its image is ready
+MultipartitionExtractor = Callable[
+    [
+        Path,
+        Path,
+        Optional[int],
+        Optional[Executor],
+        Callable[[str], bool],
+        Optional[DumpCache],
+        Optional[Callable[[str], None]],
+    ],
+    None,
+]
+
+# pattern: (function returning the names of the partitions the image would
+# give, None if they can't be known before extracting it, extractor)
+MULTIPARTITIONS: Dict[
+    Pattern[str], Tuple[Callable[[Path], Optional[List[str]]], MultipartitionExtractor]
+] = {
     compile(key): value
     for key, value in {
-        "payload.bin": extract_payload,
-        "super(?!.*(_empty)).*\\.img": extract_super,
+        "payload.bin": (get_payload_partitions_in_file, extract_payload),
+        "super(?!.*(_empty)).*\\.img": (get_super_partitions, extract_super),
     }.items()
 }
+
+InArchiveMultipartitionExtractor = Callable[
+    [
+        StoredZipMember,
+        Path,
+        Optional[int],
+        Optional[Executor],
+        Callable[[str], bool],
+        Optional[DumpCache],
+        Optional[Callable[[str], None]],
+    ],
+    None,
+]
+
+# Multipartition images that can be read in place when stored uncompressed in a zip
+IN_ARCHIVE_MULTIPARTITIONS: Dict[
+    str,
+    Tuple[Callable[[StoredZipMember], Optional[List[str]]], InArchiveMultipartitionExtractor],
+] = {
+    "payload.bin": (get_payload_partitions_in_archive, extract_payload_in_archive),
+}
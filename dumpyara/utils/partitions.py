@@ -4,12 +4,8 @@
 #
 
 from pathlib import Path
-from sebaubuntu_libs.liblogging import LOGI
 from sebaubuntu_libs.libstring import removesuffix
-from shutil import move
-from typing import List
-
-from dumpyara.utils.raw_image import get_raw_image
+from typing import Iterable, List, Optional
 
 (
     FILESYSTEM,
@@ -122,70 +118,102 @@ def get_partition_names_with_ab():
     return partitions
 
 
-def prepare_raw_images(files_path: Path, raw_images_path: Path):
-    """Prepare raw images for 7z extraction."""
-    for partition_name in get_partition_names_with_ab():
-        partition_output = raw_images_path / f"{partition_name}.img"
+def get_unslotted_partition_name(partition_name: str):
+    """Get the partition name without its A/B slot suffix, if any."""
+    for suffix in ("_a", "_b"):
+        unslotted_partition_name = removesuffix(partition_name, suffix)
+        if (
+            unslotted_partition_name != partition_name
+            and unslotted_partition_name in get_partition_names_with_alias()
+        ):
+            return unslotted_partition_name
 
-        get_raw_image(partition_name, files_path, partition_output)
+    return partition_name
 
 
-def fix_aliases(images_path: Path):
-    """Move aliased partitions to their generic name."""
-    for alt_name, name in ALTERNATIVE_PARTITION_NAMES.items():
-        alt_path = images_path / f"{alt_name}.img"
-        partition_path = images_path / f"{name}.img"
+def get_partition_image_names(partition: str):
+    """
+    Get the names the image of a partition can have, from the preferred one.
 
-        if not alt_path.exists():
-            continue
+    The unslotted name comes before the slotted ones (A before B),
+    the generic name before its aliases.
+    """
+    names: List[str] = []
+    for name in [partition] + [
+        alt_name
+        for alt_name, generic_name in ALTERNATIVE_PARTITION_NAMES.items()
+        if generic_name == partition
+    ]:
+        names.extend([name, f"{name}_a", f"{name}_b"])
 
-        if partition_path.exists():
-            LOGI(f"Ignoring {alt_name} ({name} already extracted)")
-            alt_path.unlink()
+    return names
 
-        LOGI(f"Fixing alias {alt_name} -> {name}")
-        move(alt_path, partition_path)
 
+def get_generic_partition_name(partition_name: str):
+    """Get the unslotted and unaliased partition name of a (possibly slotted or aliased) one."""
+    return get_partition_name(get_unslotted_partition_name(partition_name))
 
-def get_filename_suffixes(file: Path):
-    return "".join(file.suffixes)
 
+def get_image_precedence(partition_name: str):
+    """Get the precedence of an image name for its partition, lower is preferred."""
+    return get_partition_image_names(get_generic_partition_name(partition_name)).index(
+        partition_name
+    )
 
-def get_filename_without_extensions(file: Path):
-    return removesuffix(str(file.name), get_filename_suffixes(file))
 
+def is_known_partition(partition_name: str):
+    """Check whether a (possibly slotted or aliased) partition name is known."""
+    return get_unslotted_partition_name(partition_name) in get_partition_names_with_alias()
+
+
+class PartitionFilter:
+    """
+    Selection of the partitions to process.
+
+    If partitions is set, only those partitions are processed,
+    partitions in exclude_partitions are never processed.
+    Names can be slotted or aliased.
+    """
 
-def correct_ab_filenames(images_path: Path):
-    partitions = get_partition_names_with_alias()
-    for file in images_path.iterdir():
-        if not file.is_file():
-            continue
+    def __init__(
+        self,
+        partitions: Optional[Iterable[str]] = None,
+        exclude_partitions: Optional[Iterable[str]] = None,
+    ):
+        self.partitions = (
+            None if partitions is None else {get_generic_partition_name(p) for p in partitions}
+        )
+        self.exclude_partitions = {get_generic_partition_name(p) for p in exclude_partitions or []}
 
-        file_stem = get_filename_without_extensions(file)
+    def __repr__(self):
+        partitions = None if self.partitions is None else sorted(self.partitions)
+        return f"PartitionFilter({partitions}, {sorted(self.exclude_partitions)})"
 
-        if not file_stem.endswith("_a") and not file_stem.endswith("_b"):
-            continue
+    def is_everything(self):
+        """Check whether this filter doesn't skip anything."""
+        return self.partitions is None and not self.exclude_partitions
 
-        suffix = file_stem[-2:]
-        file_stem_unslotted = removesuffix(file_stem, suffix)
+    def is_wanted(self, partition_name: str):
+        """Check whether a partition should be processed."""
+        partition = get_generic_partition_name(partition_name)
 
-        if file_stem_unslotted not in partitions:
-            continue
+        if partition in self.exclude_partitions:
+            return False
 
-        LOGI(f"correct_ab_filenames: file: {file}, file_stem: {file_stem}")
+        # Logical partitions contain the other partitions, keep them unless excluded
+        if self.partitions is None or PARTITIONS.get(partition) == LOGICAL:
+            return True
 
-        non_ab_partition_path = images_path / f"{file_stem_unslotted}{get_filename_suffixes(file)}"
-        a_partition_path = images_path / f"{file_stem_unslotted}_a{get_filename_suffixes(file)}"
-        b_partition_path = images_path / f"{file_stem_unslotted}_b{get_filename_suffixes(file)}"
+        return partition in self.partitions
 
-        if non_ab_partition_path.is_file():
-            LOGI(f"correct_ab_filenames: {non_ab_partition_path} already exists, skipping")
-            file.unlink()
-            continue
 
-        if a_partition_path.is_file():
-            LOGI(f"correct_ab_filenames: {a_partition_path} -> {non_ab_partition_path}")
-            move(a_partition_path, non_ab_partition_path)
-        elif b_partition_path.is_file():
-            LOGI(f"correct_ab_filenames: {b_partition_path} -> {non_ab_partition_path}")
-            move(b_partition_path, non_ab_partition_path)
+# Filter that doesn't skip any partition
+ALL_PARTITIONS = PartitionFilter()
+
+
+def get_filename_suffixes(file: Path):
+    return "".join(file.suffixes)
+
+
+def get_filename_without_extensions(file: Path):
+    return removesuffix(str(file.name), get_filename_suffixes(file))
@@ -3,78 +3,88 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 #
 
-import brotli
-from dumpyara.lib.libsdat2img import main as sdat2img
+from dumpyara.lib.libsdat2img import sdat2img
 import io
 from lz4.frame import LZ4FrameFile
 from pathlib import Path
 from sebaubuntu_libs.liblogging import LOGD, LOGI
-from shutil import copyfile, move
-from subprocess import STDOUT, check_output
+from shutil import copyfile, copyfileobj, move
 
+from dumpyara.lib.libsparse import COPY_BUFFER_SIZE, unsparse_images
+from dumpyara.utils.archive_index import (
+    IMAGE,
+    LZ4,
+    SDAT,
+    SDAT_BROTLI,
+    SPARSECHUNK,
+    TRANSFER_LIST,
+    ImageFiles,
+)
+from dumpyara.utils.image_formats import SPARSE, get_image_format
+from dumpyara.utils.sparsed_images import unsparse_sparsechunk_images
+from dumpyara.utils.streams import BrotliReader
 
-def get_raw_image(partition: str, files_path: Path, output_image_path: Path):
+
+def get_raw_image(image: ImageFiles, output_image_path: Path, keep_inputs: bool = False):
     """
     Convert a partition image to a raw image.
 
-    This function handles brotli compression, sdat and sparse images.
+    This function handles brotli compression, sdat, LZ4, sparse and sparsechunk images.
+    LZ4 and sparsechunk images are removed once converted, unless keep_inputs is True.
+    Returns whether a raw image could be made from the files of image.
     """
-    brotli_image = files_path / f"{partition}.new.dat.br"
-    dat_image = files_path / f"{partition}.new.dat"
-    transfer_list = files_path / f"{partition}.transfer.list"
-    lz4_image = files_path / f"{partition}.img.lz4"
-    raw_image = files_path / f"{partition}.img"
-    unsparsed_image = files_path / f"{partition}.unsparsed.img"
-    possible_image_names = [
-        f"{partition}",
-        f"{partition}.bin",
-        f"{partition}.ext4",
-        f"{partition}.image",
-        f"{partition}.img",
-        f"{partition}.img.ext4",
-        f"{partition}.mbn",
-        f"{partition}.raw",
-        f"{partition}.raw.img",
-    ]
-
-    if brotli_image.is_file():
-        LOGI(f"Decompressing {brotli_image.name} as brotli image")
-        dat_image.write_bytes(brotli.decompress(brotli_image.read_bytes()))
-
-    if dat_image.is_file() and transfer_list.is_file():
-        LOGI(f"Converting {dat_image.name} to {raw_image.name}")
-        sdat2img(transfer_list, dat_image, raw_image)
-
-    if lz4_image.is_file():
+    transfer_list = image.get_file(TRANSFER_LIST)
+    brotli_image = image.get_file(SDAT_BROTLI)
+    dat_image = image.get_file(SDAT)
+    lz4_image = image.get_file(LZ4)
+    sparsechunk_images = image.get_files(SPARSECHUNK)
+
+    if brotli_image is not None and transfer_list is not None:
+        # Decompress on the fly, without writing the .new.dat file
+        LOGI(f"Converting {brotli_image.name} to {output_image_path.name}")
+        with brotli_image.open("rb") as f, io.BufferedReader(BrotliReader(f)) as dat_stream:
+            sdat2img(transfer_list, dat_stream, output_image_path)
+        return True
+
+    if dat_image is not None and transfer_list is not None:
+        LOGI(f"Converting {dat_image.name} to {output_image_path.name}")
+        sdat2img(transfer_list, dat_image, output_image_path)
+        return True
+
+    if lz4_image is not None:
         LOGI(f"Decompressing {lz4_image.name} as LZ4 image")
         with LZ4FrameFile(lz4_image, mode="rb") as lz4_frame_file:
-            with io.open(raw_image, "wb") as raw_image:
-                raw_image.write(lz4_frame_file.read())
+            with output_image_path.open("wb") as raw_image:
+                copyfileobj(lz4_frame_file, raw_image, COPY_BUFFER_SIZE)
 
-        lz4_image.unlink()
+        if not keep_inputs:
+            lz4_image.unlink()
 
-    for image_name in possible_image_names:
-        image_path = files_path / image_name
-        if not image_path.is_file():
-            continue
+        # The decompressed image can still be a sparse one
+        if get_image_format(output_image_path) == SPARSE:
+            LOGI(f"Unsparsing {output_image_path.name}")
+            sparse_image_path = output_image_path.with_name(f"{output_image_path.name}.sparse")
+            move(output_image_path, sparse_image_path)
+            unsparse_images([sparse_image_path], output_image_path)
+            sparse_image_path.unlink()
 
-        try:
-            check_output(
-                ["simg2img", image_path, unsparsed_image], stderr=STDOUT
-            )  # TODO: Rewrite libsparse...
-        except Exception:
-            LOGD(f"Failed to unsparse {image_path.name}, should be a raw image")
-            pass
-        else:
-            move(unsparsed_image, image_path)
+        return True
 
-        if unsparsed_image.is_file():
-            unsparsed_image.unlink()
+    image_path = image.get_file(IMAGE)
+    if image_path is not None:
+        if get_image_format(image_path) == SPARSE:
+            LOGI(f"Unsparsing {image_path.name}")
+            unsparse_images([image_path], output_image_path)
+            return True
 
         LOGI(f"Copying {image_path.name}")
         copyfile(image_path, output_image_path, follow_symlinks=True)
         return True
 
-    LOGD(f"Partition {partition} not found")
+    if sparsechunk_images:
+        unsparse_sparsechunk_images(sparsechunk_images, output_image_path, keep_inputs)
+        return True
+
+    LOGD(f"Partition {image.name} not found")
 
     return False
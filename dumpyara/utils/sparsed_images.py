@@ -5,32 +5,26 @@
 
 from pathlib import Path
 from sebaubuntu_libs.liblogging import LOGI
-from subprocess import STDOUT, check_output
+from typing import List
 
-from dumpyara.utils.partitions import get_partition_names_with_alias
+from dumpyara.lib.libsparse import unsparse_images
 
 
-def prepare_sparsed_images(files_path: Path):
+def unsparse_sparsechunk_images(
+    sparsechunk_images: List[Path], output_image: Path, keep_inputs: bool = False
+):
     """
-    Prepare sparse images for conversion.
+    Convert the sparsechunk images of a partition, in order, to a raw image.
 
-    This function handles:
-    - sparsechunk images
+    The sparsechunk images are removed once done, unless keep_inputs is True.
     """
-    for partition in get_partition_names_with_alias():
-        output_image = files_path / f"{partition}.img"
-        if output_image.is_file():
-            continue
+    LOGI(
+        f"Converting {sparsechunk_images[0].name} and the next sparsechunks to {output_image.name}"
+    )
+    unsparse_images(sparsechunk_images, output_image)
 
-        # sparsechunk
-        sparsechunk_image_base = f"{partition}.img_sparsechunk."
-        sparsechunk_image_files = sorted(
-            files_path.glob(f"{sparsechunk_image_base}*"),
-            key=lambda x: int(x.name.split(".")[-1]),
-        )
-        if sparsechunk_image_files:
-            LOGI(f"Preparing sparsechunk images for {partition}")
-            LOGI(f"Converting {sparsechunk_image_files[0]} to {output_image.name}")
-            check_output(["simg2img", *sparsechunk_image_files, output_image], stderr=STDOUT)
-            for sparsechunk_image_file in sparsechunk_image_files:
-                sparsechunk_image_file.unlink()
+    if keep_inputs:
+        return
+
+    for sparsechunk_image in sparsechunk_images:
+        sparsechunk_image.unlink()
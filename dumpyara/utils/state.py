@@ -0,0 +1,133 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import json
+import os
+from pathlib import Path
+from sebaubuntu_libs.liblogging import LOGI
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from dumpyara.utils.partitions import PartitionFilter
+from dumpyara.utils.zip_members import StoredZipMember
+
+STATE_FILE_NAME = ".dumpyara_state.json"
+
+STATE_VERSION = 1
+
+
+def _get_fingerprint(file: Path, partition_filter: PartitionFilter):
+    stat = file.stat()
+
+    return {
+        "version": STATE_VERSION,
+        "file": str(file.absolute()),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "partition_filter": repr(partition_filter),
+    }
+
+
+def _get_files_info(path: Path):
+    files_info: Dict[str, List[int]] = {}
+    for file in path.iterdir():
+        if not file.is_file():
+            continue
+
+        stat = file.stat()
+        files_info[file.name] = [stat.st_size, stat.st_mtime_ns]
+
+    return files_info
+
+
+class DumpState:
+    """
+    Progress of a dump, saved in the output folder after each step and
+    each extracted partition.
+
+    The state is only reused if the input file (path, size and mtime) and
+    the partition selection didn't change, otherwise it's reset, so the
+    partitions already extracted stay valid even when the raw images have
+    to be prepared again.
+    """
+
+    def __init__(self, output_path: Path, file: Path, partition_filter: PartitionFilter):
+        self.path = output_path / STATE_FILE_NAME
+
+        self._lock = Lock()
+
+        fingerprint = _get_fingerprint(file, partition_filter)
+        self._data: Dict[str, Any] = {"fingerprint": fingerprint}
+
+        self.resumed = False
+        if self.path.is_file():
+            try:
+                data = json.loads(self.path.read_text())
+            except ValueError:
+                data = {}
+
+            if data.get("fingerprint") == fingerprint:
+                LOGI("Resuming previous dump")
+                self._data = data
+                self.resumed = True
+
+    def _save(self):
+        temp_path = self.path.with_name(f"{self.path.name}.tmp")
+        temp_path.write_text(json.dumps(self._data, indent=2))
+        os.replace(temp_path, self.path)
+
+    def _set(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._save()
+
+    def get_stored_members(self, archive: Path) -> Optional[List[StoredZipMember]]:
+        """Get the stored members returned by step 1, None if it isn't done."""
+        stored_members = self._data.get("stored_members")
+        if stored_members is None:
+            return None
+
+        return [
+            StoredZipMember(archive, member["name"], member["offset"], member["size"])
+            for member in stored_members
+        ]
+
+    def set_archive_extracted(self, stored_members: List[StoredZipMember]):
+        self._set(
+            "stored_members",
+            [
+                {"name": member.name, "offset": member.offset, "size": member.size}
+                for member in stored_members
+            ],
+        )
+
+    def are_raw_images_prepared(self, raw_images_path: Path):
+        """Check whether step 2 is done and the raw images are still the same."""
+        raw_images = self._data.get("raw_images")
+        if raw_images is None or not raw_images_path.is_dir():
+            return False
+
+        files_info = _get_files_info(raw_images_path)
+
+        return all(files_info.get(name) == info for name, info in raw_images.items())
+
+    def set_raw_images_prepared(self, raw_images_path: Path):
+        self._set("raw_images", _get_files_info(raw_images_path))
+
+    def get_extracted_partitions(self) -> List[str]:
+        return list(self._data.get("extracted_partitions", []))
+
+    def is_partition_extracted(self, partition: str):
+        with self._lock:
+            return partition in self._data.get("extracted_partitions", [])
+
+    def set_partition_extracted(self, partition: str):
+        with self._lock:
+            self._data.setdefault("extracted_partitions", []).append(partition)
+            self._save()
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
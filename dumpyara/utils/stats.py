@@ -0,0 +1,288 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import json
+import os
+import sys
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from subprocess import PIPE, STDOUT, CalledProcessError, Popen
+from threading import Lock, local
+from time import monotonic, process_time, thread_time
+from typing import Any, Dict, List, Optional
+
+STATS_FILE_NAME = "dump_stats.json"
+
+STATS_VERSION = 3
+
+# Categories
+STATS_STEPS = "steps"
+STATS_PARTITIONS = "partitions"
+STATS_TOOLS = "tools"
+
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def _read_io(path: str):
+    """Get the bytes read and written from a /proc io file, None if not available."""
+    try:
+        with open(path, "r") as f:
+            values = dict(line.split(":", 1) for line in f)
+    except OSError:
+        return None
+
+    return int(values["rchar"]), int(values["wchar"])
+
+
+def _get_max_rss():
+    return max(getrusage(RUSAGE_SELF).ru_maxrss, getrusage(RUSAGE_CHILDREN).ru_maxrss) * MAXRSS_UNIT
+
+
+class _ChildrenUsage:
+    """CPU time and I/O of the processes started by a thread with check_tool_output()."""
+
+    def __init__(self):
+        self.cpu_time = 0.0
+        self.read_bytes = 0
+        self.written_bytes = 0
+
+
+_thread_local = local()
+
+
+def _get_children_usage() -> _ChildrenUsage:
+    children_usage = getattr(_thread_local, "children_usage", None)
+    if children_usage is None:
+        children_usage = _ChildrenUsage()
+        _thread_local.children_usage = children_usage
+
+    return children_usage
+
+
+def _get_open_snapshots() -> List["_Snapshot"]:
+    """Get the start snapshots of the measurements running in this thread."""
+    open_snapshots = getattr(_thread_local, "open_snapshots", None)
+    if open_snapshots is None:
+        open_snapshots = []
+        _thread_local.open_snapshots = open_snapshots
+
+    return open_snapshots
+
+
+def check_tool_output(args: List[str], encoding: Optional[str] = None):
+    """
+    Like subprocess.check_output(args, stderr=STDOUT), but the CPU time,
+    I/O and peak RSS of the process (and of its own children) are added to
+    the measurements of the calling thread.
+
+    The kernel only adds them up per process once a child is reaped, so
+    they're read from the exited process right before reaping it.
+    """
+    process = Popen(args, stdout=PIPE, stderr=STDOUT)
+    try:
+        assert process.stdout is not None
+        with process.stdout:
+            output = process.stdout.read()
+
+        # Wait for the process to exit without reaping it
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        io = _read_io(f"/proc/{process.pid}/io")
+        _, status, usage = os.wait4(process.pid, 0)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    children_usage = _get_children_usage()
+    children_usage.cpu_time += usage.ru_utime + usage.ru_stime
+    if io is not None:
+        children_usage.read_bytes += io[0]
+        children_usage.written_bytes += io[1]
+
+    max_rss = usage.ru_maxrss * MAXRSS_UNIT
+    for snapshot in _get_open_snapshots():
+        if snapshot.max_rss is None or max_rss > snapshot.max_rss:
+            snapshot.max_rss = max_rss
+
+    if encoding is not None:
+        output = output.decode(encoding)
+
+    if process.returncode:
+        raise CalledProcessError(process.returncode, args, output)
+
+    return output
+
+
+class _Snapshot:
+    def __init__(self, thread: bool):
+        self.wall_time = monotonic()
+
+        # Highest peak RSS of the processes started since, only for thread measurements
+        self.max_rss: Optional[int] = None
+
+        if thread:
+            children_usage = _get_children_usage()
+
+            self.cpu_time = thread_time() + children_usage.cpu_time
+            self.io = _read_io("/proc/thread-self/io")
+            if self.io is not None:
+                self.io = (
+                    self.io[0] + children_usage.read_bytes,
+                    self.io[1] + children_usage.written_bytes,
+                )
+        else:
+            # Reaped children are included in the figures of the process
+            children_usage = getrusage(RUSAGE_CHILDREN)
+
+            self.cpu_time = process_time() + children_usage.ru_utime + children_usage.ru_stime
+            self.io = _read_io("/proc/self/io")
+
+
+class DumpStats:
+    """
+    Wall time, CPU time, I/O and peak RSS of the steps of a dump, of each
+    partition and of each external tool invocation.
+
+    Steps are measured for the whole process, partitions and tools for the
+    thread running them plus the processes it started with
+    check_tool_output().
+    Bytes read and written include the page cache, they aren't available
+    on systems without /proc.
+    The peak RSS of the process is only known for its whole lifetime, so
+    it's only recorded for the whole dump. The one of partitions and tools
+    is the highest of the processes started with check_tool_output(), the
+    memory used by the thread itself can't be told apart. It's null for
+    steps and for partitions that didn't start any process.
+    If process_wide is False, other work runs in the process at the same
+    time (e.g. the other dumps of a batch), so only the wall time of the
+    steps and of the whole dump is recorded: the figures of the process
+    would include that work too.
+    """
+
+    def __init__(self, process_wide: bool = True):
+        self.process_wide = process_wide
+
+        self._lock = Lock()
+        self._start = _Snapshot(thread=False)
+
+        self.entries: Dict[str, List[Dict[str, Any]]] = {
+            STATS_STEPS: [],
+            STATS_PARTITIONS: [],
+            STATS_TOOLS: [],
+        }
+
+    def _get_entry(self, start: _Snapshot, end: _Snapshot, thread: bool):
+        entry: Dict[str, Any] = {
+            "wall_time": round(end.wall_time - start.wall_time, 3),
+            "cpu_time": None,
+            "read_bytes": None,
+            "written_bytes": None,
+            "max_rss": start.max_rss,
+        }
+
+        if not thread and not self.process_wide:
+            return entry
+
+        entry["cpu_time"] = round(end.cpu_time - start.cpu_time, 3)
+
+        if start.io is not None and end.io is not None:
+            entry["read_bytes"] = end.io[0] - start.io[0]
+            entry["written_bytes"] = end.io[1] - start.io[1]
+
+        return entry
+
+    @contextmanager
+    def measure(self, category: str, name: str, thread: bool = False, **details: Any):
+        """
+        Measure the code run in this context.
+
+        thread must be True when running in a worker thread,
+        details are added to the entry.
+        """
+        start = _Snapshot(thread)
+        if thread:
+            _get_open_snapshots().append(start)
+
+        try:
+            yield
+        finally:
+            if thread:
+                _get_open_snapshots().remove(start)
+
+            entry = {"name": name, **details, **self._get_entry(start, _Snapshot(thread), thread)}
+
+            with self._lock:
+                self.entries[category].append(entry)
+
+    def to_dict(self):
+        return {
+            "version": STATS_VERSION,
+            "total": {
+                **self._get_entry(self._start, _Snapshot(thread=False), thread=False),
+                "max_rss": _get_max_rss() if self.process_wide else None,
+            },
+            **self.entries,
+        }
+
+    def write(self, output_path: Path):
+        """Write the stats as dump_stats.json in output_path."""
+        (output_path / STATS_FILE_NAME).write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+
+    def get_summary(self):
+        """Get a human readable summary of the stats."""
+        stats = self.to_dict()
+
+        lines = []
+        for category in (STATS_STEPS, STATS_PARTITIONS, STATS_TOOLS):
+            if not stats[category]:
+                continue
+
+            # Steps are in order, the slowest partitions and tools come first
+            entries = stats[category]
+            if category != STATS_STEPS:
+                entries = sorted(entries, key=lambda entry: -entry["wall_time"])
+
+            lines.append(f"{category.capitalize()}:")
+            for entry in entries:
+                name = entry["name"]
+                if "partition" in entry:
+                    name = f"{name} ({entry['partition']})"
+
+                line = f"  {name}: {entry['wall_time']:.1f}s"
+                if entry["cpu_time"] is not None:
+                    line += f", CPU {entry['cpu_time']:.1f}s"
+                if entry["read_bytes"] is not None:
+                    line += (
+                        f", read {entry['read_bytes'] / 1024**2:.0f} MiB"
+                        f", written {entry['written_bytes'] / 1024**2:.0f} MiB"
+                    )
+                if entry["max_rss"] is not None:
+                    line += f", peak RSS {entry['max_rss'] / 1024**2:.0f} MiB"
+
+                lines.append(line)
+
+        total = stats["total"]
+        line = f"Total: {total['wall_time']:.1f}s"
+        if total["cpu_time"] is not None:
+            line += f", CPU {total['cpu_time']:.1f}s"
+        if total["max_rss"] is not None:
+            line += f", peak RSS {total['max_rss'] / 1024**2:.0f} MiB"
+        lines.append(line)
+
+        return "\n".join(lines)
+
+
+def measure(
+    stats: Optional[DumpStats], category: str, name: str, thread: bool = False, **details: Any
+):
+    """Like DumpStats.measure(), but doing nothing if stats is None."""
+    if stats is None:
+        return nullcontext()
+
+    return stats.measure(category, name, thread, **details)
@@ -0,0 +1,52 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import brotli
+from io import RawIOBase
+from typing import BinaryIO
+
+# Amount of compressed data fed to the decompressor at once
+BROTLI_INPUT_CHUNK_SIZE = 64 * 1024
+
+
+class BrotliReader(RawIOBase):
+    """
+    Read-only stream that decompresses a brotli file incrementally.
+
+    Only a small window of compressed and decompressed data is kept in
+    memory. Wrap it in an io.BufferedReader to get full-sized reads.
+    """
+
+    def __init__(self, file: BinaryIO):
+        super().__init__()
+
+        self._file = file
+        self._decompressor = brotli.Decompressor()
+        self._buffer = b""
+        self._buffer_offset = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._buffer_offset >= len(self._buffer) and not self._eof:
+            data = self._file.read(BROTLI_INPUT_CHUNK_SIZE)
+            if not data:
+                if not self._decompressor.is_finished():
+                    raise brotli.error("Truncated brotli stream")
+
+                self._eof = True
+                break
+
+            self._buffer = self._decompressor.process(data)
+            self._buffer_offset = 0
+
+        view = memoryview(b).cast("B")
+        length = min(len(view), len(self._buffer) - self._buffer_offset)
+        view[:length] = self._buffer[self._buffer_offset : self._buffer_offset + length]
+        self._buffer_offset += length
+
+        return length
@@ -0,0 +1,90 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from contextlib import contextmanager
+from os import cpu_count
+from threading import Lock
+from typing import Iterator, List, Optional
+
+# Executor used by all the dumps of the process, if set
+_shared_executor: Optional[Executor] = None
+
+
+def set_shared_executor(executor: Optional[Executor]):
+    """
+    Make all the parallel work of the process run in executor (None to unset it).
+
+    Tasks submitted to it must never wait for other tasks,
+    otherwise they could deadlock once all the workers are busy.
+    """
+    global _shared_executor
+    _shared_executor = executor
+
+
+class _SharedExecutorView(Executor):
+    """
+    View of the shared executor only tracking the tasks submitted through it,
+    so that it can be shut down like a private executor.
+    """
+
+    def __init__(self, executor: Executor):
+        self._executor = executor
+        self._futures: List[Future] = []
+        self._lock = Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = self._executor.submit(fn, *args, **kwargs)
+
+        with self._lock:
+            self._futures.append(future)
+
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._lock:
+            futures = list(self._futures)
+
+        if cancel_futures:
+            for future in futures:
+                future.cancel()
+
+        if wait:
+            wait_futures(futures)
+
+
+@contextmanager
+def get_executor(
+    jobs: Optional[int] = None, executor: Optional[Executor] = None
+) -> Iterator[Executor]:
+    """
+    Get an executor running up to jobs tasks at the same time (by default
+    the number of CPUs).
+
+    When a shared executor is set (batch mode), tasks are submitted to it
+    instead, and jobs is ignored.
+    Either way, all the submitted tasks are done when the context exits.
+
+    If executor is set (e.g. one passed down by the caller, so that jobs
+    bounds all the work of a dump), it's used as is and the caller waits
+    for its tasks.
+    """
+    if executor is not None:
+        yield executor
+
+        return
+
+    if _shared_executor is None:
+        with ThreadPoolExecutor(max_workers=jobs or cpu_count() or 1) as executor:
+            yield executor
+
+        return
+
+    executor = _SharedExecutorView(_shared_executor)
+    try:
+        yield executor
+    finally:
+        executor.shutdown()
@@ -0,0 +1,68 @@
+#
+# SPDX-FileCopyrightText: Dumpyara Project
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+from pathlib import Path
+from struct import Struct
+from typing import Container, Optional
+from zipfile import ZIP_STORED, ZipFile
+
+# signature, version, flags, compression, mtime, mdate, crc32,
+# compressed size, uncompressed size, filename length, extra field length
+ZIP_LOCAL_FILE_HEADER = Struct("<4sHHHHHIIIHH")
+ZIP_LOCAL_FILE_HEADER_MAGIC = b"PK\x03\x04"
+
+
+class StoredZipMember:
+    """A file stored uncompressed inside a zip archive, readable in place."""
+
+    def __init__(self, archive: Path, name: str, offset: int, size: int):
+        self.archive = archive
+        self.name = name
+        self.offset = offset
+        self.size = size
+
+
+def get_stored_zip_member(archive: Path, name: str) -> Optional[StoredZipMember]:
+    """
+    Get the location of a member inside a zip archive.
+
+    Returns None if the member doesn't exist or if it's compressed or
+    encrypted, since its data can't be read in place in that case.
+    """
+    with ZipFile(archive) as zip_file:
+        try:
+            info = zip_file.getinfo(name)
+        except KeyError:
+            return None
+
+        if info.compress_type != ZIP_STORED or info.flag_bits & 0x1:
+            return None
+
+        # The extra field of the local header may differ from the central directory one
+        fp = zip_file.fp
+        assert fp is not None
+        fp.seek(info.header_offset)
+        header = fp.read(ZIP_LOCAL_FILE_HEADER.size)
+
+    if len(header) != ZIP_LOCAL_FILE_HEADER.size:
+        return None
+
+    local_header = ZIP_LOCAL_FILE_HEADER.unpack(header)
+    if local_header[0] != ZIP_LOCAL_FILE_HEADER_MAGIC:
+        return None
+
+    offset = info.header_offset + ZIP_LOCAL_FILE_HEADER.size + local_header[9] + local_header[10]
+
+    return StoredZipMember(archive, name, offset, info.file_size)
+
+
+def extract_zip(archive: Path, extract_dir: Path, exclude: Container[str] = ()):
+    """Extract a zip archive, skipping the members in exclude."""
+    with ZipFile(archive) as zip_file:
+        for info in zip_file.infolist():
+            if info.filename in exclude:
+                continue
+
+            zip_file.extract(info, extract_dir)